@@ -0,0 +1,1222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Offline benchmark of relay_msg, no phone attached.
+
+A fake phone (Message App & Wechat screens replayed from fixtures/) is served by a
+fake adb server and a fake adb executable put on _ADB_HOME_. Every phone command
+costs its latency on a simulated clock, relay_msg sleeps on the same clock, so a
+run takes seconds and the numbers don't depend on the machine running it.
+
+    python3 bench/bench_relay.py
+    python3 bench/bench_relay.py --latency uiautomator=2.5 --json bench.json
+    python3 bench/bench_relay.py --baseline bench.json --tolerance 0.1
+
+Scenarios:
+    relay         relay_msg_to_wechat with --unread new messages
+    chat          chat_with_user, the user is --swipes pages down the contact list
+    chat_cached   the same once more, the contact index knows where the user is
+    relay_warm    relay again in a new process, the device profile knows the screen & album points
+    backlog       relay of --backlog new messages
+    backlog_one   the same, one message per send (batch_size 1)
+    text          the same, sms bodies sent as one text digest (mode 'text')
+    fanout        the backlog relayed to the user & forwarded to a recent chat and a searched contact
+    fanout_one    the same, one message per send (batch_size 1)
+    checkin       DingTalk.checkIn switching company, the screenshot & the time sent to the user
+    events        MessageEventListener replaying fixtures/logcat_sms.log, its burst of sms relayed once
+    repeat        two sms of one sender with the same body, relayed, then a third one relayed by the next run,
+                  then none once the sms are unread again
+    repeat_one    the same, one message per send (batch_size 1)
+
+Reported per scenario: adb commands issued, ui dumps taken on the phone,
+simulated wall time & the real time the run took.
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import socket
+import string
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time as _time
+import xml.etree.ElementTree as ElementTree
+
+_BENCH_DIR_ = os.path.dirname(os.path.abspath(__file__))
+_FIXTURE_DIR_ = os.path.join(_BENCH_DIR_, 'fixtures')
+
+# simulated seconds per command, rough numbers of a mid-range phone
+_LATENCY_ = {
+    'adb.server': 0.005,  # one request to the adb server
+    'adb.process': 0.08,  # one forked adb process
+    'adb.mb': 0.05,  # pulling or pushing 1 MB over usb
+    'upload.mb': 1.0,  # Wechat sending 1 MB of pictures
+    'uiautomator': 1.2,
+    'screencap': 0.5,
+    'screencap.raw': 0.2,  # a frame without encoding PNG
+    'input': 0.15,
+    'am': 0.4,
+    'monkey': 0.8,
+    'content': 0.15,
+    'wm': 0.05,
+    'pm': 0.3,
+    'settings': 0.1,
+    'ime': 0.3,
+    'default': 0.01,
+}
+
+# commands answered by the fake phone, the rest (echo, grep, cp, ...) is run by sh on the host
+_PHONE_TOOLS_ = ('uiautomator', 'screencap', 'input', 'am', 'monkey', 'content', 'wm', 'pm', 'settings', 'sleep', 'rm',
+                 'ime', 'mv', 'mkdir', 'touch')
+
+_WECHAT_ = 'com.tencent.mm'
+_MESSAGING_ = 'com.samsung.android.messaging'
+_DINGTALK_ = 'com.alibaba.android.rimet'
+_ROOT_SCREENS_ = {_WECHAT_: 'wechat_main', _MESSAGING_: 'messaging_list', _DINGTALK_: 'dingtalk_main'}
+
+_KEYBOARD_IME_ = 'com.google.android.inputmethod.latin/com.android.inputmethod.latin.LatinIME'
+_ADB_KEYBOARD_IME_ = 'com.android.adbkeyboard/.AdbIME'
+
+_CONTACT_ROWS_ = 12
+_ROW_HEIGHT_ = 150
+
+# messages shown by the chat at a time, each one _BUBBLE_HEIGHT_ high from the top of the list
+_CHAT_BUBBLES_ = 4
+_BUBBLE_HEIGHT_ = 480
+
+relay_msg = None
+
+
+class SimClock(object):
+    """
+    Replaces the time module of relay_msg: sleeps & phone latencies move the clock forward,
+    nothing really waits.
+    """
+
+    def __init__(self):
+        self.offset = 0.0
+        self._lock = threading.Lock()
+
+    def advance(self, secs: float):
+        with self._lock:
+            self.offset += max(0.0, secs)
+
+    def time(self):
+        return _time.time() + self.offset
+
+    def perf_counter(self):
+        return _time.perf_counter() + self.offset
+
+    def monotonic(self):
+        return _time.monotonic() + self.offset
+
+    def sleep(self, secs: float):
+        self.advance(secs)
+        _time.sleep(0)
+
+    def __getattr__(self, name):
+        return getattr(_time, name)
+
+
+def _node(index: int, package: str, bounds: tuple, text: str = '', resource_id: str = '',
+          cls: str = 'android.widget.TextView', desc: str = '', clickable: bool = False,
+          checkable: bool = False, checked: bool = False, long_clickable: bool = False):
+    """
+    one <node> of uiautomator dump
+    """
+    _attrs = {'text': text, 'resource-id': resource_id, 'class': cls, 'package': package, 'content-desc': desc,
+              'checkable': checkable, 'checked': checked, 'clickable': clickable, 'enabled': True,
+              'focusable': clickable, 'focused': False, 'scrollable': False, 'long-clickable': long_clickable,
+              'password': False, 'selected': False, 'bounds': '[%d,%d][%d,%d]' % bounds}
+    _attrs = ' '.join(f'{_k}="{str(_v).lower() if isinstance(_v, bool) else _escape(_v)}"'
+                      for _k, _v in _attrs.items())
+    return f'<node index="{index}" {_attrs} />'
+
+
+def _escape(value: str):
+    return str(value).replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('\n', '&#10;')
+
+
+class FakePhone(object):
+    """
+    State of one fake phone: the app in foreground, screen stacks of apps,
+    inbox, pictures in album & pictures or texts received by the Wechat user.
+    """
+
+    def __init__(self, serial: str, clock: SimClock, latency: dict, root: str,
+                 user: str = 'Alice', unread: int = 3, contacts: int = 120, user_page: int = 0,
+                 recent_chat: bool = False, adb_keyboard: bool = True, recent: list = ()):
+        """
+        user_page (int): page of contact list showing the user, swipes needed to find the user
+        recent_chat (bool): the user is in the chat list of Wechat main page
+        adb_keyboard (bool): ADBKeyBoard is installed
+        recent (list): chats listed by the forward picker after the user's, other contacts are searched
+        """
+        self.serial = serial
+        self.clock = clock
+        self.latency = latency
+        self.root = root
+        self.user = user
+        self.recent_chat = recent_chat
+
+        self.foreground = 'launcher'
+        # package -> screen names, the last one on screen
+        self.stacks = {}
+        self.contacts = [f'联系人{_n:03d}' for _n in range(contacts)]
+        self.contacts.insert(min(user_page * _CONTACT_ROWS_ + _CONTACT_ROWS_ // 2, len(self.contacts)), user)
+        self.contacts_page = 0
+
+        self.sms = []
+        self.open_sms = None
+        self.receive(unread)
+
+        # phone files of pictures in album, the newest last
+        self.album = []
+        # screenshots taken & pictures received by the user, in order
+        self.captured = []
+        self.sent_files = []
+        self.album_selected = []
+        self.album_original = False
+        # number of pictures of every send to the user
+        self.sends = []
+        self.sent_bytes = 0
+
+        self.imes = [_KEYBOARD_IME_] + ([_ADB_KEYBOARD_IME_] if adb_keyboard else [])
+        self.ime = _KEYBOARD_IME_
+        # text in the input box of the chat & texts sent to the user
+        self.draft = ''
+        self.texts = []
+
+        # messages of the chat with the user, '[图片]' or the text, & messages forwarded to others
+        self.chat = []
+        self.chat_scroll = 0
+        self.recent = [user] + list(recent)
+        self.pressed = None
+        self.selected_msgs = set()
+        self.picker_multi = False
+        self.picks = []
+        self.search = ''
+        self.forwarded = {}
+
+        # DingTalk: the company shown, the apps of the work console scrolled up or not & check ins done
+        self.companies = ['甲公司', '乙公司']
+        self.company = self.companies[0]
+        self.console_scroll = 0
+        self.check_ins = 0
+
+        self.stats = {'tool_calls': 0, 'dumps': 0, 'taps': 0, 'swipes': 0, 'app_switches': 0}
+        self._lock = threading.Lock()
+        self._templates = {}
+
+    def receive(self, count: int, address: str = None, body: str = None):
+        """
+        count new unread sms arrive, one a minute up to now, all of address or with body if given
+        """
+        _now = int(_time.time() * 1000)
+        _first = len(self.sms) + 1
+        self.sms.extend({'_id': _n, 'address': address or f'1069{_n:04d}', 'date': _now - (_first + count - 1 - _n) * 60000,
+                         'body': body or f'验证码 {_n:06d}，5分钟内有效。', 'read': 0} for _n in range(_first, _first + count))
+
+    # commands
+    def run(self, argv: list):
+        """
+        run phone command argv, return (exit code, stdout bytes)
+        """
+        _tool = argv[0] if argv else ''
+        with self._lock:
+            self.stats['tool_calls'] += 1
+            if _tool == 'sleep':
+                self.clock.advance(float(argv[1]) if len(argv) > 1 else 0)
+                return 0, b''
+            _key = 'screencap.raw' if _tool == 'screencap' and '-p' not in argv else _tool
+            self.clock.advance(self.latency.get(_key, self.latency['default']))
+            _handler = getattr(self, f'_cmd_{_tool.replace(".", "_")}', None)
+            if _handler is None:
+                return 127, f'{_tool}: not found\n'.encode('utf-8')
+            _return = _handler(argv[1:])
+            return (0, _return) if isinstance(_return, bytes) else _return
+
+    def _cmd_adb_process(self, args):
+        return b''
+
+    def _cmd_uiautomator(self, args):
+        if not args or args[0] != 'dump':
+            return 1, b'usage: uiautomator dump [file]\n'
+        self.stats['dumps'] += 1
+        _file = args[1] if len(args) > 1 else '/sdcard/window_dump.xml'
+        _xml = self.render()[0].encode('utf-8')
+        if _file == '/dev/tty':
+            return _xml + b'UI hierchary dumped to: /dev/tty\n'
+        with open(self._phone_path(_file), 'wb') as f:
+            f.write(_xml)
+        return f'UI hierchary dumped to: {_file}\n'.encode('utf-8')
+
+    def _cmd_screencap(self, args):
+        if '-p' in args:
+            with open(os.path.join(_FIXTURE_DIR_, 'screen.png'), 'rb') as f:
+                _data = f.read()
+        else:
+            _data = self.frame()
+        _files = [_arg for _arg in args if not _arg.startswith('-')]
+        if not _files:
+            return _data
+        with open(self._phone_path(_files[0]), 'wb') as f:
+            f.write(_data)
+        # the album shows it once the media scanner is asked to, see _cmd_am
+        if '-p' in args:
+            self.captured.append(_files[0])
+        return b''
+
+    def _cmd_rm(self, args):
+        for _file in args:
+            if _file.startswith('-'):
+                continue
+            if _file in self.album:
+                self.album.remove(_file)
+            try:
+                os.remove(self._phone_path(_file))
+            except OSError:
+                pass
+        return b''
+
+    def _cmd_mv(self, args):
+        _paths = [_arg for _arg in args if not _arg.startswith('-')]
+        try:
+            os.replace(self._phone_path(_paths[0]), self._phone_path(_paths[1]))
+        except (OSError, IndexError) as err:
+            return 1, f'mv: {err}\n'.encode('utf-8')
+        if _paths[0] in self.album:
+            self.album.remove(_paths[0])
+        return b''
+
+    def _cmd_mkdir(self, args):
+        for _dir in args:
+            if not _dir.startswith('-'):
+                os.makedirs(self._phone_path(_dir), exist_ok=True)
+        return b''
+
+    def _cmd_touch(self, args):
+        for _file in args:
+            open(self._phone_path(_file), 'ab').close()
+        return b''
+
+    def _cmd_input(self, args):
+        if args[:1] == ['tap'] and len(args) >= 3:
+            self.stats['taps'] += 1
+            self.tap(int(float(args[1])), int(float(args[2])))
+        elif args[:1] == ['swipe'] and len(args) >= 5 and args[1:3] == args[3:5]:
+            self.long_press(int(float(args[1])), int(float(args[2])))
+        elif args[:1] == ['swipe'] and len(args) >= 5:
+            self.stats['swipes'] += 1
+            self.swipe(int(float(args[2])), int(float(args[4])))
+        elif args[:1] == ['keyevent'] and len(args) >= 2:
+            self.keyevent(args[1])
+        return b''
+
+    def _cmd_am(self, args):
+        if args[:1] == ['start'] and '-n' in args:
+            self.bring_to_front(args[args.index('-n') + 1].split('/')[0])
+            return f'Starting: Intent {{ cmp={args[args.index("-n") + 1]} }}\n'.encode('utf-8')
+        if args[:1] == ['force-stop'] and len(args) >= 2:
+            self.stacks.pop(args[1], None)
+            if self.foreground == args[1]:
+                self.foreground = 'launcher'
+            return b''
+        if args[:1] == ['broadcast']:
+            # media scanner adds the file to album, drops it if the file is gone
+            _file = args[args.index('-d') + 1][len('file://'):] if '-d' in args else ''
+            if _file and os.path.exists(self._phone_path(_file)):
+                if _file not in self.album:
+                    self.album.append(_file)
+            elif _file in self.album:
+                self.album.remove(_file)
+            if args[args.index('-a') + 1:][:1] == ['ADB_INPUT_B64'] and self.ime == _ADB_KEYBOARD_IME_:
+                _text = base64.b64decode(args[args.index('msg') + 1]).decode('utf-8')
+                if self.screen == 'wechat_chat':
+                    self.draft += _text
+                elif self.screen == 'wechat_picker_search':
+                    self.search += _text
+            return b'Broadcasting: Intent\nBroadcast completed: result=0\n'
+        return 1, b'am: unknown command\n'
+
+    def _cmd_monkey(self, args):
+        if '-p' in args:
+            self.bring_to_front(args[args.index('-p') + 1])
+        return b'Events injected: 1\n'
+
+    def _cmd_content(self, args):
+        _projection = args[args.index('--projection') + 1].split(':') if '--projection' in args else ['_id']
+        _where = args[args.index('--where') + 1] if '--where' in args else ''
+        _min_id = re.search(r'_id>(\d+)', _where)
+        rows = [_sms for _sms in self.sms
+                if (not _min_id or _sms['_id'] > int(_min_id.group(1))) and ('read=0' not in _where or not _sms['read'])]
+        if not rows:
+            return b'No result found.\n'
+        return ''.join(f'Row: {_n} ' + ', '.join(f'{_column}={_sms.get(_column, "")}' for _column in _projection) + '\n'
+                       for _n, _sms in enumerate(rows)).encode('utf-8')
+
+    def _cmd_wm(self, args):
+        with open(os.path.join(_FIXTURE_DIR_, 'wm_size.txt'), 'rb') as f:
+            return f.read()
+
+    def _cmd_pm(self, args):
+        _version = ' versionCode:2280' if '--show-versioncode' in args else ''
+        return ''.join(f'package:{_package}{_version}\n' for _package in _ROOT_SCREENS_).encode('utf-8')
+
+    def _cmd_settings(self, args):
+        if args[:3] == ['get', 'secure', 'default_input_method']:
+            return f'{self.ime}\n'.encode('utf-8')
+        return b''
+
+    def _cmd_ime(self, args):
+        if args[:1] == ['list']:
+            return ''.join(f'{_ime}\n' for _ime in self.imes).encode('utf-8')
+        if args[:1] in (['enable'], ['set']) and args[1:2] and args[1] not in self.imes:
+            return 1, f'Unknown input method {args[1]}\n'.encode('utf-8')
+        if args[:1] == ['set']:
+            self.ime = args[1]
+        return f'Input method {args[1] if len(args) > 1 else ""} selected\n'.encode('utf-8')
+
+    def _phone_path(self, path: str):
+        """
+        /sdcard of the phone is a directory of the sandbox, other paths are host paths already
+        """
+        if path.startswith('/sdcard'):
+            path = os.path.join(self.root, 'phone') + path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    # screens
+    @property
+    def screen(self):
+        if self.foreground == 'launcher':
+            return 'launcher'
+        return self.stacks[self.foreground][-1]
+
+    def _template(self, screen: str):
+        if screen not in self._templates:
+            with open(os.path.join(_FIXTURE_DIR_, f'{screen}.xml'), 'r', encoding='utf-8') as f:
+                self._templates[screen] = string.Template(f.read())
+        return self._templates[screen]
+
+    def render(self):
+        """
+        return (xml of the screen, {row key: action}) where row key is text or content-desc of a list row
+        """
+        screen = self.screen
+        rows, actions = [], {}
+        values = {'user': _escape(self.user), 'rows': ''}
+
+        if screen == 'wechat_main' and self.recent_chat:
+            rows.append(_node(0, _WECHAT_, (0, 300, 1080, 450), self.user, 'com.tencent.mm:id/kbq', clickable=True))
+            actions[self.user] = lambda: self.push('wechat_chat')
+        elif screen == 'wechat_contacts':
+            _first = self.contacts_page * _CONTACT_ROWS_
+            for _n, _name in enumerate(self.contacts[_first:_first + _CONTACT_ROWS_]):
+                _top = 300 + _n * _ROW_HEIGHT_
+                rows.append(_node(_n, _WECHAT_, (0, _top, 1080, _top + _ROW_HEIGHT_), _name,
+                                  'com.tencent.mm:id/hg4', clickable=True))
+                if _name == self.user:
+                    actions[_name] = lambda: self.push('wechat_profile')
+        elif screen == 'wechat_album':
+            _count = min(len(self.album), 12)
+            for _n in range(_count):
+                _left, _top = (_n % 4) * 270, 300 + (_n // 4) * 270
+                rows.append(_node(_n, _WECHAT_, (_left + 190, _top + 10, _left + 260, _top + 80),
+                                  resource_id='com.tencent.mm:id/f3n', cls='android.widget.CheckBox',
+                                  desc=f'第{_n + 1}张', clickable=True, checkable=True,
+                                  checked=_n in self.album_selected))
+                actions[f'第{_n + 1}张'] = lambda _n=_n: self.select_picture(_n)
+            values['send'] = f'发送({len(self.album_selected)}/9)' if self.album_selected else '发送'
+            values['original'] = str(self.album_original).lower()
+        elif screen == 'messaging_list':
+            _sms = sorted(self.sms, key=lambda _s: (_s['read'], -_s['_id']))[:10]
+            for _n, _s in enumerate(_sms):
+                _top = 320 + _n * 200
+                _desc = f'{_s["address"]}，{_s["body"]}' + ('' if _s['read'] else '，1条未读信息')
+                _bounds = (0, _top, 1080, _top + 200)
+                rows.append(_node(_n, _MESSAGING_, _bounds, resource_id=f'{_MESSAGING_}:id/base_list_item_data',
+                                  cls='android.widget.RelativeLayout', desc=_desc, clickable=True))
+                # rows may look the same, each one opens its own sms
+                actions['[%d,%d][%d,%d]' % _bounds] = lambda _s=_s: self.open_conversation(_s)
+        elif screen in ('wechat_chat', 'wechat_chat_select'):
+            for _index, (_top, _bottom) in self._bubbles().items():
+                _message = self.chat[_index]
+                rows.append(_node(_index, _WECHAT_, (200, _top + 20, 980, _bottom - 20),
+                                  '' if _message == '[图片]' else _message, 'com.tencent.mm:id/bkl',
+                                  cls='android.widget.ImageView' if _message == '[图片]' else 'android.widget.TextView',
+                                  desc='图片' if _message == '[图片]' else '', long_clickable=True))
+                if screen == 'wechat_chat_select':
+                    rows.append(_node(_index, _WECHAT_, (20, _top + 200, 100, _top + 280), resource_id='com.tencent.mm:id/bkm',
+                                      cls='android.widget.CheckBox', desc=f'选择{_index}', clickable=True,
+                                      checkable=True, checked=_index in self.selected_msgs))
+                    actions[f'选择{_index}'] = lambda _index=_index: self.select_message(_index)
+        elif screen in ('wechat_picker', 'wechat_picker_search'):
+            if screen == 'wechat_picker':
+                _names, _top = self.recent, 380
+            else:
+                _names = [_name for _name in self.contacts + self.recent[1:] if self.search and self.search in _name]
+                _top = 240
+                values['search'] = _escape(self.search)
+            for _n, _name in enumerate(_names[:12]):
+                _row_top = _top + _n * _ROW_HEIGHT_
+                rows.append(_node(_n, _WECHAT_, (0, _row_top, 1080, _row_top + _ROW_HEIGHT_), _name,
+                                  'com.tencent.mm:id/h3f', clickable=True))
+                if self.picker_multi:
+                    rows.append(_node(_n, _WECHAT_, (960, _row_top + 40, 1040, _row_top + 110),
+                                      resource_id='com.tencent.mm:id/h3g', cls='android.widget.CheckBox',
+                                      checkable=True, checked=_name in self.picks))
+                actions[_name] = lambda _name=_name: self.pick(_name)
+            _done = f'完成({len(self.picks)})' if self.picker_multi and self.picks else '多选'
+            values['done'] = _node(3, _WECHAT_, (860, 100, 1060, 200), _done, 'com.tencent.mm:id/en',
+                                   cls='android.widget.Button' if self.picker_multi else 'android.widget.TextView',
+                                   clickable=True)
+        elif screen == 'wechat_forward_confirm':
+            values['names'] = _escape('、'.join(self.picks))
+        elif screen == 'dingtalk_console':
+            # 考勤打卡 is below the viewport until the console is scrolled up
+            _top = 560 if self.console_scroll else 1160
+            for _n, (_app, _left, _row) in enumerate((('智能人事', 0, 0), ('审批', 270, 0), ('日志', 540, 0),
+                                                      ('考勤打卡', 0, 1))):
+                _app_top = _top + _row * 600
+                rows.append(_node(_n, _DINGTALK_, (_left, _app_top, _left + 270, _app_top + 140), _app,
+                                  f'{_DINGTALK_}:id/oa_entry', clickable=True))
+            actions['考勤打卡'] = lambda: self.push('dingtalk_checkin')
+            values['company'] = _escape(self.company)
+        elif screen == 'dingtalk_orgs':
+            for _n, _name in enumerate(self.companies):
+                _top = 300 + _n * _ROW_HEIGHT_
+                rows.append(_node(_n, _DINGTALK_, (0, _top, 1080, _top + _ROW_HEIGHT_), _name,
+                                  f'{_DINGTALK_}:id/org_name', clickable=True))
+                actions[_name] = lambda _name=_name: self.switch_company(_name)
+        elif screen == 'dingtalk_checkin':
+            values['button'] = '已打卡' if self.check_ins else '上班打卡'
+            values['status'] = '打卡成功' if self.check_ins else ''
+        if screen == 'wechat_chat':
+            values['draft'] = _escape(self.draft)
+            if self.draft:
+                values['button'] = _node(5, _WECHAT_, (880, 2190, 1070, 2310), '发送', 'com.tencent.mm:id/b8k',
+                                         cls='android.widget.Button', clickable=True)
+            else:
+                values['button'] = _node(5, _WECHAT_, (960, 2180, 1080, 2320), resource_id='com.tencent.mm:id/b3s',
+                                         cls='android.widget.ImageButton', desc='更多功能按钮，已折叠', clickable=True)
+        elif screen == 'messaging_conversation':
+            values['address'] = _escape(self.open_sms['address'])
+            values['body'] = _escape(self.open_sms['body'])
+
+        values['rows'] = ''.join(rows)
+        return self._template(screen).substitute(values), actions
+
+    def frame(self):
+        """
+        raw frame of 'screencap' in one color told by the screen, the same screen gives the same frame
+        """
+        with open(os.path.join(_FIXTURE_DIR_, 'wm_size.txt'), 'r') as f:
+            _width, _height = (int(_value) for _value in f.read().split(':')[-1].strip().split('x'))
+        _color = hashlib.md5(self.render()[0].encode('utf-8')).digest()[:3] + b'\xff'
+        return struct.pack('<IIII', _width, _height, 1, 0) + _color * (_width * _height)
+
+    def push(self, screen: str):
+        self.stacks[self.foreground].append(screen)
+
+    def bring_to_front(self, package: str):
+        if package not in _ROOT_SCREENS_:
+            return
+        if self.foreground != package:
+            self.stats['app_switches'] += 1
+        self.foreground = package
+        self.stacks.setdefault(package, [_ROOT_SCREENS_[package]])
+
+    def open_conversation(self, sms: dict):
+        sms['read'] = 1
+        self.open_sms = sms
+        self.push('messaging_conversation')
+
+    def switch_company(self, name: str):
+        self.company = name
+        self.console_scroll = 0
+        self.stacks[_DINGTALK_].pop()
+
+    def select_picture(self, n: int):
+        if n in self.album_selected:
+            self.album_selected.remove(n)
+        elif len(self.album_selected) < 9:
+            self.album_selected.append(n)
+
+    def _bubbles(self):
+        """
+        return {index of message in chat: (top, bottom)} of the messages on screen, the last at the bottom
+        """
+        _end = len(self.chat) - self.chat_scroll
+        _first = max(_end - _CHAT_BUBBLES_, 0)
+        return {_index: (240 + (_index - _first) * _BUBBLE_HEIGHT_, 240 + (_index - _first + 1) * _BUBBLE_HEIGHT_)
+                for _index in range(_first, _end)}
+
+    def long_press(self, x: int, y: int):
+        if self.screen != 'wechat_chat':
+            return
+        for _index, (_top, _bottom) in self._bubbles().items():
+            if _top <= y < _bottom and 200 <= x < 980:
+                self.pressed = _index
+                self.push('wechat_chat_menu')
+
+    def select_message(self, index: int):
+        if index in self.selected_msgs:
+            self.selected_msgs.remove(index)
+        else:
+            self.selected_msgs.add(index)
+
+    def pick(self, name: str):
+        if not self.picker_multi:
+            self.picks = [name]
+            self.push('wechat_forward_confirm')
+            return
+        if name in self.picks:
+            self.picks.remove(name)
+        else:
+            self.picks.append(name)
+        if self.screen == 'wechat_picker_search':
+            self.search = ''
+            self.stacks[_WECHAT_].pop()
+
+    def forward(self):
+        """
+        the selected messages of the chat are forwarded to the picks, back to the chat
+        """
+        _messages = [self.chat[_index] for _index in sorted(self.selected_msgs)]
+        for _name in self.picks:
+            self.forwarded.setdefault(_name, []).extend(_messages)
+        self.selected_msgs = set()
+        while self.stacks[_WECHAT_][-1] != 'wechat_chat':
+            self.stacks[_WECHAT_].pop()
+
+    def send_pictures(self):
+        if not self.album_selected:
+            return
+        self.sends.append(len(self.album_selected))
+        self.sent_files.extend(self.album[-1 - _n] for _n in self.album_selected)
+        _bytes = 0
+        for _n in self.album_selected:
+            try:
+                _bytes += os.path.getsize(self._phone_path(self.album[-1 - _n]))
+            except OSError:
+                pass
+        self.sent_bytes += _bytes
+        self.clock.advance(_bytes / 1e6 * self.latency['upload.mb'])
+        self.chat.extend(['[图片]'] * len(self.album_selected))
+        self.chat_scroll = 0
+        self.album_selected = []
+        while self.stacks[_WECHAT_][-1] != 'wechat_chat':
+            self.stacks[_WECHAT_].pop()
+
+    @property
+    def received(self):
+        return sum(self.sends)
+
+    @property
+    def received_in_order(self):
+        """
+        the pictures received are the screenshots in the order they were taken, whatever the directory or format.
+        a name repeated in a row is one picture: shrunk over itself, or the one screenshot file of a flow reused
+        """
+        _names = [_name for _name, _ in itertools.groupby(
+            os.path.splitext(os.path.basename(_file))[0] for _file in self.sent_files)]
+        _captured = [_name for _name, _ in itertools.groupby(
+            os.path.splitext(os.path.basename(_file))[0] for _file in self.captured)]
+        return _names == [_name for _name in _captured if _name in _names]
+
+    # input
+    def tap(self, x: int, y: int):
+        _xml, actions = self.render()
+        hit = None
+        for _element in ElementTree.fromstring(_xml).iter('node'):
+            _bounds = [int(_v) for _v in re.findall(r'-?\d+', _element.get('bounds', ''))]
+            if len(_bounds) == 4 and _bounds[0] <= x < _bounds[2] and _bounds[1] <= y < _bounds[3] \
+                    and _element.get('clickable') == 'true':
+                # the last one in document order is on top
+                hit = _element
+        if hit is None:
+            return
+
+        screen = self.screen
+        _text, _desc, _id = hit.get('text', ''), hit.get('content-desc', ''), hit.get('resource-id', '')
+        if hit.get('bounds') in actions:
+            actions[hit.get('bounds')]()
+        elif _text in actions or _desc in actions:
+            actions[_text if _text in actions else _desc]()
+        elif screen == 'launcher':
+            self.bring_to_front({'微信': _WECHAT_, '信息': _MESSAGING_}.get(_text, ''))
+        elif screen in ('wechat_main', 'wechat_contacts') and _text in ('微信', '通讯录'):
+            # tabs replace each other
+            self.stacks[_WECHAT_][-1] = 'wechat_main' if _text == '微信' else 'wechat_contacts'
+        elif screen == 'wechat_profile' and _text == '发消息':
+            self.stacks[_WECHAT_][-1] = 'wechat_chat'
+        elif screen == 'wechat_chat_menu' and _text == '多选':
+            self.stacks[_WECHAT_][-1] = 'wechat_chat_select'
+            self.selected_msgs = {self.pressed}
+        elif screen == 'wechat_chat_menu':
+            self.stacks[_WECHAT_].pop()
+        elif screen == 'wechat_chat_select' and _desc == '转发' and self.selected_msgs:
+            self.picker_multi, self.picks = False, []
+            self.push('wechat_forward_mode' if len(self.selected_msgs) > 1 else 'wechat_picker')
+        elif screen == 'wechat_chat_select' and _text == '取消':
+            self.selected_msgs = set()
+            self.stacks[_WECHAT_].pop()
+        elif screen == 'wechat_forward_mode' and _text == '逐条转发':
+            self.stacks[_WECHAT_][-1] = 'wechat_picker'
+        elif screen == 'wechat_forward_mode':
+            self.stacks[_WECHAT_].pop()
+        elif screen == 'wechat_picker' and _text == '多选':
+            self.picker_multi = True
+        elif screen == 'wechat_picker' and _text.startswith('完成'):
+            self.push('wechat_forward_confirm')
+        elif screen == 'wechat_picker' and _text == '搜索':
+            self.search = ''
+            self.push('wechat_picker_search')
+        elif screen == 'wechat_picker' and _text == '关闭':
+            self.stacks[_WECHAT_].pop()
+        elif screen == 'wechat_forward_confirm' and _text == '发送':
+            self.forward()
+        elif screen == 'wechat_forward_confirm' and _text == '取消':
+            self.stacks[_WECHAT_].pop()
+        elif screen == 'wechat_chat' and _text == '发送' and self.draft:
+            self.texts.append(self.draft)
+            self.chat.append(self.draft)
+            self.chat_scroll = 0
+            self.sent_bytes += len(self.draft.encode('utf-8'))
+            self.draft = ''
+        elif screen == 'wechat_chat' and _desc.startswith('更多功能按钮'):
+            self.push('wechat_chat_more')
+        elif screen == 'wechat_chat_more' and _desc.startswith('更多功能按钮'):
+            self.stacks[_WECHAT_].pop()
+        elif screen == 'wechat_chat_more' and _text == '相册':
+            self.album_selected = []
+            self.push('wechat_album')
+        elif screen == 'wechat_album' and _text == '原图':
+            self.album_original = not self.album_original
+        elif screen == 'wechat_album' and _text.startswith('发送'):
+            self.send_pictures()
+        elif screen in ('dingtalk_main', 'dingtalk_console') and _id.endswith('home_bottom_tab_button_work'):
+            self.stacks[_DINGTALK_][-1] = 'dingtalk_console'
+        elif screen in ('dingtalk_main', 'dingtalk_console') and _text == '消息':
+            self.stacks[_DINGTALK_][-1] = 'dingtalk_main'
+        elif screen == 'dingtalk_console' and _id.endswith('tv_org_name'):
+            self.push('dingtalk_orgs')
+        elif screen == 'dingtalk_checkin' and _text == '上班打卡':
+            self.check_ins += 1
+
+    def swipe(self, from_y: int, to_y: int):
+        if self.screen == 'dingtalk_console':
+            self.console_scroll = int(to_y < from_y)
+            return
+        if self.screen in ('wechat_chat', 'wechat_chat_select'):
+            # swiping down shows older messages
+            _step = _CHAT_BUBBLES_ // 2 * (1 if to_y > from_y else -1)
+            self.chat_scroll = min(max(self.chat_scroll + _step, 0), max(len(self.chat) - _CHAT_BUBBLES_, 0))
+            return
+        if self.screen != 'wechat_contacts':
+            return
+        _last_page = max(0, (len(self.contacts) - 1) // _CONTACT_ROWS_)
+        _page = self.contacts_page + (1 if to_y < from_y else -1)
+        self.contacts_page = min(max(_page, 0), _last_page)
+
+    def keyevent(self, key: str):
+        if key in ('KEYCODE_BACK', '4'):
+            if self.foreground == 'launcher':
+                return
+            if len(self.stacks[self.foreground]) > 1:
+                self.stacks[self.foreground].pop()
+            else:
+                self.foreground = 'launcher'
+        elif key in ('KEYCODE_HOME', '3'):
+            self.foreground = 'launcher'
+
+
+class FakeAdbServer(object):
+    """
+    Speaks the adb host protocol like the adb server on port 5037:
+    host:devices-l, host:transport:<sn>, shell:, exec:, sync: (RECV)
+    and bench:<json> for commands of the fake phone.
+    """
+
+    def __init__(self, root: str, latency: dict):
+        self.root = root
+        self.latency = latency
+        self.phones = {}
+        self.requests = 0
+
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def _recv_exact(conn, size: int):
+        data = b''
+        while len(data) < size:
+            _chunk = conn.recv(size - len(data))
+            if not _chunk:
+                raise EOFError
+            data += _chunk
+        return data
+
+    @staticmethod
+    def _fail(conn, message: str):
+        _message = message.encode('utf-8')
+        conn.sendall(b'FAIL' + b'%04x' % len(_message) + _message)
+
+    def _charge(self, phone):
+        self.requests += 1
+        if phone is not None:
+            phone.clock.advance(self.latency['adb.server'])
+
+    def _shell_env(self, serial: str):
+        env = dict(os.environ)
+        env['FAKE_ADB_SERIAL'] = serial
+        env['PATH'] = f'{os.path.join(self.root, "device-bin")}:{env.get("PATH", "")}'
+        return env
+
+    def _handle(self, conn):
+        serial = None
+        try:
+            while True:
+                _length = int(self._recv_exact(conn, 4), 16)
+                request = self._recv_exact(conn, _length).decode('utf-8')
+                phone = self.phones.get(serial)
+
+                if request == 'host:devices-l':
+                    with open(os.path.join(_FIXTURE_DIR_, 'devices.txt'), 'rb') as f:
+                        _data = b''.join(_line for _line in f if not _line.startswith(b'List of devices'))
+                    conn.sendall(b'OKAY' + b'%04x' % len(_data) + _data)
+                    return
+                if request.startswith('host:transport'):
+                    serial = request.split(':', 2)[2] if request.startswith('host:transport:') else next(iter(self.phones), None)
+                    if serial not in self.phones:
+                        self._fail(conn, f"device '{serial}' not found")
+                        return
+                    conn.sendall(b'OKAY')
+                    continue
+                if request.startswith('bench:'):
+                    _call = json.loads(request[len('bench:'):])
+                    phone = self.phones.get(_call['serial'])
+                    if phone is None:
+                        self._fail(conn, f"device '{_call['serial']}' not found")
+                        return
+                    _code, _output = phone.run(_call['argv'])
+                    conn.sendall(b'OKAY' + b'%04x' % _code + _output)
+                    return
+                if phone is None:
+                    self._fail(conn, 'no device selected')
+                    return
+                if request.startswith('shell:') or request.startswith('exec:'):
+                    self._charge(phone)
+                    conn.sendall(b'OKAY')
+                    _return = subprocess.run(['sh', '-c', request.split(':', 1)[1]], env=self._shell_env(serial),
+                                             stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                             stderr=subprocess.STDOUT if request.startswith('shell:') else subprocess.DEVNULL)
+                    conn.sendall(_return.stdout)
+                    phone.clock.advance(len(_return.stdout) / 1e6 * self.latency['adb.mb'])
+                    return
+                if request == 'sync:':
+                    conn.sendall(b'OKAY')
+                    self._sync(conn, phone)
+                    return
+                self._fail(conn, f'unknown request {request}')
+                return
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _sync(self, conn, phone):
+        while True:
+            _id, _length = struct.unpack('<4sI', self._recv_exact(conn, 8))
+            if _id == b'QUIT':
+                return
+            _path = self._recv_exact(conn, _length).decode('utf-8')
+            # a sync session kept open by relay_msg outlives the phone it was opened on
+            phone = self.phones.get(phone.serial, phone)
+            if _id == b'SEND':
+                self._sync_send(conn, phone, _path.rsplit(',', 1)[0])
+                continue
+            if _id != b'RECV':
+                _message = f'sync {_id!r} not supported'.encode('utf-8')
+                conn.sendall(b'FAIL' + struct.pack('<I', len(_message)) + _message)
+                return
+            self._charge(phone)
+            try:
+                with open(phone._phone_path(_path), 'rb') as f:
+                    _data = f.read()
+            except OSError as err:
+                _message = str(err).encode('utf-8')
+                conn.sendall(b'FAIL' + struct.pack('<I', len(_message)) + _message)
+                continue
+            for _n in range(0, len(_data), 65536):
+                _chunk = _data[_n:_n + 65536]
+                conn.sendall(b'DATA' + struct.pack('<I', len(_chunk)) + _chunk)
+            conn.sendall(b'DONE' + struct.pack('<I', 0))
+            phone.clock.advance(len(_data) / 1e6 * self.latency['adb.mb'])
+
+    def _sync_send(self, conn, phone, path: str):
+        chunks = []
+        while True:
+            _id, _length = struct.unpack('<4sI', self._recv_exact(conn, 8))
+            if _id == b'DONE':
+                break
+            chunks.append(self._recv_exact(conn, _length))
+        self._charge(phone)
+        _data = b''.join(chunks)
+        with open(phone._phone_path(path), 'wb') as f:
+            f.write(_data)
+        # a settled frame or a shrunk screenshot is pushed instead of taken by screencap
+        if path.startswith('/sdcard'):
+            phone.captured.append(path)
+        phone.clock.advance(len(_data) / 1e6 * self.latency['adb.mb'])
+        conn.sendall(b'OKAY' + struct.pack('<I', 0))
+
+
+class Bench(object):
+    """
+    Sandbox of one benchmark run: fake adb on _ADB_HOME_, fake adb server, simulated clock,
+    HOME of relay_msg state files.
+    """
+
+    def __init__(self, latency: dict, user: str = 'Alice', verbose: bool = False):
+        self.latency = latency
+        self.user = user
+        self.verbose = verbose
+        self.root = tempfile.mkdtemp(prefix='relaymsg_bench_')
+        self.clock = SimClock()
+        with open(os.path.join(_FIXTURE_DIR_, 'devices.txt'), 'r') as f:
+            self.serial = [_line.split()[0] for _line in f
+                           if _line.strip() and not _line.startswith('List of devices')][0]
+
+        _bin = os.path.join(self.root, 'device-bin')
+        os.makedirs(_bin)
+        for _tool in _PHONE_TOOLS_:
+            with open(os.path.join(_bin, _tool), 'w') as f:
+                f.write(f'#!/bin/sh\nexec "$FAKE_ADB_PYTHON" -S "$FAKE_ADB_TOOL" {_tool} "$@"\n')
+            os.chmod(os.path.join(_bin, _tool), 0o755)
+        shutil.copy(os.path.join(_BENCH_DIR_, 'fake_adb'), os.path.join(self.root, 'adb'))
+        os.chmod(os.path.join(self.root, 'adb'), 0o755)
+
+        self.server = FakeAdbServer(self.root, latency).start()
+        # relay_msg reads the adb server port & its state dir at import
+        os.environ.update({'ANDROID_ADB_SERVER_PORT': str(self.server.port),
+                           'HOME': os.path.join(self.root, 'home'),
+                           'FAKE_ADB_ROOT': self.root,
+                           'FAKE_ADB_FIXTURES': _FIXTURE_DIR_,
+                           'FAKE_ADB_PYTHON': sys.executable,
+                           'FAKE_ADB_TOOL': os.path.join(_BENCH_DIR_, 'fake_tool.py')})
+
+        global relay_msg
+        sys.path.insert(0, os.path.dirname(_BENCH_DIR_))
+        import relay_msg
+        relay_msg._ADB_HOME_ = self.root
+        relay_msg._SCRIPT_DIR_ = os.path.join(self.root, 'phone', 'data', 'local', 'tmp')
+        relay_msg._TMP_DIR_ = os.path.join(self.root, 'tmp')
+        relay_msg.time = self.clock
+        relay_msg._PROFILER_.enabled = True
+
+    def restart(self):
+        """
+        drop what relay_msg keeps in memory, as a new process does, the state directory is kept
+        """
+        relay_msg.close_shell_sessions()
+        relay_msg._PUSHED_SCRIPTS_.clear()
+        with relay_msg._UI_CACHES_LOCK_:
+            relay_msg._UI_CACHES_.clear()
+        with relay_msg._DEVICE_PROFILES_LOCK_:
+            relay_msg._DEVICE_PROFILES_.clear()
+        relay_msg._PROFILER_.reset()
+
+    def reset(self, **phone_options):
+        """
+        new phone & clean relay_msg state, return the phone
+        """
+        self.restart()
+        for _dir in ('phone', 'home', 'tmp'):
+            shutil.rmtree(os.path.join(self.root, _dir), ignore_errors=True)
+        os.makedirs(relay_msg._SCRIPT_DIR_)
+        os.makedirs(relay_msg._TMP_DIR_)
+
+        phone = FakePhone(self.serial, self.clock, self.latency, self.root, self.user, **phone_options)
+        self.server.phones = {self.serial: phone}
+        return phone
+
+    def measure(self, name: str, scenario, phone):
+        """
+        run scenario(), return the report of it
+        """
+        _output = io.StringIO()
+        _started_at, _offset = _time.time(), self.clock.offset
+        with contextlib.redirect_stdout(sys.stdout if self.verbose else _output):
+            try:
+                passed = bool(scenario())
+            except Exception as err:
+                print(f'{name} failed: {err!r}')
+                passed = False
+        _summary = relay_msg._PROFILER_.summary()
+        return {'scenario': name,
+                'passed': passed,
+                'commands': sum(_stat['calls'] for _op, _stat in _summary.items() if _op.startswith('adb.')),
+                'dumps': phone.stats['dumps'],
+                'host_dumps': _summary.get('ui.dump', {}).get('calls', 0),
+                'app_switches': phone.stats['app_switches'],
+                'sent_kb': round(phone.sent_bytes / 1024),
+                'sim_secs': round(self.clock.offset - _offset, 2),
+                'real_secs': round(_time.time() - _started_at, 2)}
+
+    def close(self):
+        relay_msg.close_shell_sessions()
+        relay_msg.close_adb_clients()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def run_scenarios(bench: Bench, names: list, unread: int = 3, swipes: int = 5, backlog: int = 20,
+                  shrink: bool = False, settle: str = 'ui', image_format: str = 'JPEG'):
+    reports = []
+    user = bench.user
+    relay_options = {'screenshot_options': relay_msg.ScreenshotOptions(image_format=image_format)} if shrink else {}
+    relay_options['settle'] = settle
+
+    def _relay_once(count: int, batch_size: int = None):
+        phone = bench.reset(unread=count, user_page=1)
+        phone.bring_to_front(_MESSAGING_)
+        _options = dict(relay_options) if batch_size is None else dict(relay_options, batch_size=batch_size)
+        return phone, lambda: relay_msg.RelayWorker(phone.serial).relay(user, **_options) == count == phone.received \
+            and phone.received_in_order
+
+    for name in names:
+        if name == 'relay':
+            phone = bench.reset(unread=unread, user_page=1)
+            reports.append(bench.measure(
+                name, lambda: relay_msg.relay_msg_to_wechat(user, phone.serial, **relay_options) == unread == phone.received, phone))
+        elif name in ('chat', 'chat_cached'):
+            phone = bench.reset(user_page=swipes)
+            phone.bring_to_front(_WECHAT_)
+
+            def _chat():
+                _wechat = relay_msg.Wechat(phone.serial)
+                _wechat.settle_mode = settle
+                _wechat.chat_with_user(user, select_input_box=False)
+                return phone.screen == 'wechat_chat'
+
+            if name == 'chat_cached':
+                # learn where the user is, then start over from the main page
+                bench.measure('chat', _chat, phone)
+                phone.stacks[_WECHAT_] = ['wechat_main']
+                phone.stats = dict.fromkeys(phone.stats, 0)
+                relay_msg._PROFILER_.reset()
+            reports.append(bench.measure(name, _chat, phone))
+        elif name == 'relay_warm':
+            phone = bench.reset(unread=unread, user_page=1)
+            bench.measure('relay', lambda: relay_msg.relay_msg_to_wechat(user, phone.serial, **relay_options), phone)
+            bench.restart()
+            _received = phone.received
+            phone.receive(unread)
+            phone.bring_to_front(_MESSAGING_)
+            phone.stats = dict.fromkeys(phone.stats, 0)
+            phone.sent_bytes = 0
+            reports.append(bench.measure(
+                name, lambda: relay_msg.relay_msg_to_wechat(user, phone.serial, **relay_options) == unread ==
+                phone.received - _received, phone))
+        elif name == 'backlog':
+            phone, _scenario = _relay_once(backlog)
+            reports.append(bench.measure(name, _scenario, phone))
+        elif name == 'backlog_one':
+            phone, _scenario = _relay_once(backlog, batch_size=1)
+            reports.append(bench.measure(name, _scenario, phone))
+        elif name == 'text':
+            phone = bench.reset(unread=backlog, user_page=1)
+            phone.bring_to_front(_MESSAGING_)
+
+            def _text():
+                _count = relay_msg.RelayWorker(phone.serial).relay(user, mode='text', settle=settle)
+                _received = '\n'.join(phone.texts)
+                return _count == backlog and all(_sms['body'] in _received for _sms in phone.sms)
+
+            reports.append(bench.measure(name, _text, phone))
+        elif name in ('fanout', 'fanout_one'):
+            phone = bench.reset(unread=backlog, user_page=1, recent=['Bob'])
+            phone.bring_to_front(_MESSAGING_)
+            _others = ['Bob', phone.contacts[5]]
+            _options = dict(relay_options, batch_size=1) if name == 'fanout_one' else relay_options
+
+            def _fanout():
+                _worker = relay_msg.RelayWorker(phone.serial)
+                _count = _worker.relay([user] + _others, **_options)
+                # every sms is in the ledger as delivered to every recipient
+                _delivered = [_worker.ledger.deliveries(relay_msg.RelayLedger.sms_key(phone.serial, _record))
+                              for _record in _worker.msg_app.query_sms()]
+                return _count == backlog == phone.received and \
+                    all(len(phone.forwarded.get(_other, [])) == backlog == _worker.delivery_status[_other]
+                        for _other in _others) and \
+                    len(_delivered) == backlog and all(set(_d) == {user, *_others} for _d in _delivered)
+
+            reports.append(bench.measure(name, _fanout, phone))
+        elif name == 'checkin':
+            phone = bench.reset(user_page=1)
+
+            def _checkin():
+                _dingtalk = relay_msg.DingTalk(phone.serial, phone.companies[1], waitSecs=0)
+                _dingtalk.settle_mode = settle
+                return _dingtalk.checkIn(user) and phone.check_ins == 1 and phone.company == phone.companies[1] and \
+                    phone.received == 1 and any('checked in' in _text for _text in phone.texts)
+
+            reports.append(bench.measure(name, _checkin, phone))
+        elif name == 'events':
+            phone = bench.reset(unread=0, user_page=1)
+            phone.bring_to_front(_MESSAGING_)
+
+            def _replay():
+                # the sms of every handleSmsReceived line arrives as the line is read
+                with open(os.path.join(_FIXTURE_DIR_, 'logcat_sms.log'), 'r') as f:
+                    for _line in f:
+                        if 'handleSmsReceived' in _line:
+                            phone.receive(1)
+                        yield _line
+
+            def _events():
+                _worker = relay_msg.RelayWorker(phone.serial)
+                _relayed = []
+                _listener = relay_msg.MessageEventListener(
+                    phone.serial, lambda count: _relayed.append(_worker.relay(user, **relay_options)),
+                    source=_replay, reconnect=False)
+                try:
+                    _listener.run()
+                finally:
+                    _worker.close()
+                # 3 sms, each logged by the receiver & the notification, wechat notifications ignored
+                return _listener.events == 6 and _listener.bursts == 1 and _relayed == [3] == [phone.received]
+
+            reports.append(bench.measure(name, _events, phone))
+        elif name in ('repeat', 'repeat_one'):
+            phone = bench.reset(unread=0, user_page=1)
+            phone.bring_to_front(_MESSAGING_)
+            _notice = dict(address='95588', body='您尾号1234的账户有一笔交易，详情请查看账单。')
+            _options = dict(relay_options, batch_size=1) if name == 'repeat_one' else relay_options
+
+            def _repeat():
+                # the rows of the list look the same, the provider _id of the sms tells them apart
+                phone.receive(2, **_notice)
+                _first = relay_msg.RelayWorker(phone.serial).relay(user, **_options)
+                phone.receive(1, **_notice)
+                phone.bring_to_front(_MESSAGING_)
+                _second = relay_msg.RelayWorker(phone.serial).relay(user, **_options)
+                # the read state didn't stick, nothing is relayed twice
+                for _sms in phone.sms:
+                    _sms['read'] = 0
+                phone.bring_to_front(_MESSAGING_)
+                _third = relay_msg.RelayWorker(phone.serial).relay(user, **_options)
+                return (_first, _second, _third) == (2, 1, 0) and phone.received == 3 and phone.received_in_order
+
+            reports.append(bench.measure(name, _repeat, phone))
+    return reports
+
+
+def compare(reports: list, baseline: list, tolerance: float):
+    """
+    return lines of metrics worse than baseline by more than tolerance (ratio)
+    """
+    regressions = []
+    _baseline = {_report['scenario']: _report for _report in baseline}
+    for _report in reports:
+        _base = _baseline.get(_report['scenario'])
+        if _base is None:
+            continue
+        if _base['passed'] and not _report['passed']:
+            regressions.append(f'{_report["scenario"]}: failed, passed in baseline')
+        for _metric in ('commands', 'dumps', 'sim_secs'):
+            # one more command or dump is noise of the polling, not a regression
+            _limit = _base[_metric] * (1 + tolerance) + (0 if _metric == 'sim_secs' else 1)
+            if _report[_metric] > _limit:
+                regressions.append(f'{_report["scenario"]}: {_metric} {_report[_metric]} > {_base[_metric]}')
+    return regressions
+
+
+def main(argv: list = None):
+    scenarios = ['relay', 'relay_warm', 'chat', 'chat_cached', 'backlog', 'backlog_one', 'text', 'fanout', 'fanout_one',
+                 'checkin', 'events', 'repeat', 'repeat_one']
+    parser = argparse.ArgumentParser(description='Offline benchmark of relay_msg with a fake phone.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help=f'scenarios to run, all by default: {", ".join(scenarios)}')
+    parser.add_argument('--unread', type=int, default=3, help='new messages of the relay scenario')
+    parser.add_argument('--swipes', type=int, default=5, help='pages of contact list before the user')
+    parser.add_argument('--backlog', type=int, default=20, help='new messages of the backlog scenarios')
+    parser.add_argument('--latency', action='append', default=[], metavar='COMMAND=SECS',
+                        help=f'simulated latency of a phone command, one of {", ".join(_LATENCY_)}')
+    parser.add_argument('--json', metavar='FILE', help='write the reports as json')
+    parser.add_argument('--baseline', metavar='FILE', help='json of an earlier run, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed ratio over baseline (default 0.1)')
+    parser.add_argument('--shrink', action='store_true', help='relay with shrunk screenshots, needs Pillow')
+    parser.add_argument('--image-format', default='JPEG', choices=('JPEG', 'WEBP', 'PNG'),
+                        help='format of shrunk screenshots')
+    parser.add_argument('--settle', default='ui', choices=('ui', 'frames'),
+                        help='wait for screens to settle by ui dumps or screencap frames')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show output of relay_msg')
+    args = parser.parse_args(argv)
+    for _name in args.scenarios:
+        if _name not in scenarios:
+            parser.error(f'unknown scenario: {_name}')
+
+    latency = dict(_LATENCY_)
+    for _item in args.latency:
+        _command, _, _secs = _item.partition('=')
+        if _command not in latency:
+            parser.error(f'unknown command of --latency: {_command}')
+        latency[_command] = float(_secs)
+
+    bench = Bench(latency, verbose=args.verbose)
+    try:
+        reports = run_scenarios(bench, args.scenarios or scenarios, args.unread, args.swipes, args.backlog,
+                                args.shrink, args.settle, args.image_format)
+    finally:
+        bench.close()
+
+    print(f'{"scenario":<14}{"passed":>8}{"commands":>10}{"dumps":>7}{"host dumps":>12}{"app switches":>14}'
+          f'{"sent KB":>9}{"sim s":>9}{"real s":>8}')
+    for _report in reports:
+        print(f'{_report["scenario"]:<14}{str(_report["passed"]):>8}{_report["commands"]:>10}{_report["dumps"]:>7}'
+              f'{_report["host_dumps"]:>12}{_report["app_switches"]:>14}{_report["sent_kb"]:>9}'
+              f'{_report["sim_secs"]:>9.1f}{_report["real_secs"]:>8.1f}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(reports, json.load(f), args.tolerance)
+        for _line in regressions:
+            print('REGRESSION', _line)
+        if regressions:
+            return 1
+    return 0 if all(_report['passed'] for _report in reports) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+One command of the fake phone, e.g. 'fake_tool.py input tap 540 800',
+answered by the fake adb server of bench_relay.py.
+"""
+import json
+import os
+import socket
+import sys
+
+
+def main(argv: list):
+    request = 'bench:' + json.dumps({'serial': os.environ.get('FAKE_ADB_SERIAL', ''), 'argv': argv})
+    request = request.encode('utf-8')
+
+    data = b''
+    with socket.create_connection(('127.0.0.1', int(os.environ['ANDROID_ADB_SERVER_PORT']))) as sock:
+        sock.sendall(b'%04x' % len(request) + request)
+        while True:
+            _chunk = sock.recv(65536)
+            if not _chunk:
+                break
+            data += _chunk
+
+    # OKAY <exit code, 4 hex> <stdout> or FAIL <length, 4 hex> <message>
+    if data[:4] != b'OKAY':
+        sys.stderr.write(data[8:].decode('utf-8', errors='replace') + '\n')
+        return 1
+    sys.stdout.buffer.write(data[8:])
+    sys.stdout.flush()
+    return int(data[4:8], 16)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -15,7 +15,6 @@ Android Debug Bridge (ADB) Command Line Interface Python Module
 
 v1.0.0 - 2023/02/01
     Read new message and take a screenshot, send the picture to Wechat
-    todo Read msg as text, copy from app & send to Wechat
     todo Add log support
 
 """
@@ -25,723 +24,4873 @@ import time
 import random
 import platform
 import pinyin
-import sys
+import select
+import threading
+import atexit
+import socket
+import struct
+import re
+import functools
+import xml.parsers.expat
+import concurrent.futures
+import argparse
+import signal
+import json
+import shlex
+import queue
+import hashlib
+import sqlite3
+import asyncio
+import weakref
+import contextlib
+import math
+import io
+import base64
+import zlib
+from typing import NamedTuple
+
+# Pillow is optional, screenshots are sent as they are without it
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# numpy is optional, geometric lookups of ui nodes are vectorized with it
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 _ADB_HOME_ = '/opt/adb/' if platform.system() == 'Linux' else '/Users/beyan/Documents/Scripts/43-Android/adb/'
 _TMP_DIR_ = '/tmp'
 
-# define tmp xml file for adb ui dump
+# define tmp xml file for adb ui dump, written only by save_ui_dump
 _TMP_XML_FILE_ = os.path.join(_TMP_DIR_, 'adb_ui_dump.xml')
 _SCREENSHOT_FILE_ = os.path.join(_TMP_DIR_, f'adb_screenshot_{random.randint(1000, 9999)}.png')
 
+# seconds to wait for a single command sent through the persistent adb shell
+_SHELL_TIMEOUT_ = 60
 
-# Only support fetching single android device ID & SN.
-# todo support multiple devices
-def fetch_device_SN(return_id=False) -> str:
-    """
-    return: android device serial number list
+# local adb server, talked to directly by AdbClient
+_ADB_SERVER_HOST_ = '127.0.0.1'
+_ADB_SERVER_PORT_ = int(os.environ.get('ANDROID_ADB_SERVER_PORT', 5037))
 
-    9f11ca4d device usb:1-1.2 product:on7xltezc model:SM_G6100 device:on7xltechn transport_id:58
-    """
-    _command = f'{_ADB_HOME_}/adb devices -l'
-    _output_list = subprocess.getoutput(_command).split('\n')
+# seconds a ui hierarchy dump is reused for if no action changed the screen
+_UI_CACHE_MAX_AGE_ = 10
 
-    _SN = _output_list[1].split(' ')[0]
-    _ID = _output_list[1].split(':')[-1]
+# state kept across runs, e.g. the last sms relayed of each device
+_STATE_DIR_ = os.path.expanduser('~/.relaymsg')
 
-    return _ID if return_id else _SN
+# pictures Wechat sends at most at one time
+_WECHAT_MAX_PICS_ = 9
 
+# characters of one Wechat text message, longer digests are split
+_WECHAT_MAX_TEXT_ = 2000
 
-class AndroidConsole(object):
+# ADBKeyBoard, the IME typing any text broadcast by ADB_INPUT_B64
+_ADB_KEYBOARD_IME_ = 'com.android.adbkeyboard/.AdbIME'
+
+# columns of content://sms read by the sync & async consoles, body last as it may contain ', '
+_SMS_PROJECTION_ = ('_id', 'address', 'date', 'body')
+
+# commands of one device running at a time through the async consoles
+_ASYNC_DEVICE_CONCURRENCY_ = 2
+
+# messages captured per cycle at most before sending them, 4 album sends
+_RELAY_QUEUE_SIZE_ = 4 * _WECHAT_MAX_PICS_
+
+# seconds messages are remembered as relayed
+_LEDGER_TTL_ = 30 * 24 * 3600
+
+# seconds a device profile is trusted before its screen size & package versions are read again
+_PROFILE_MAX_AGE_ = 3600
+
+# frames are compared downsampled to blocks of _FRAME_STEP_ x _FRAME_STEP_ pixels
+_FRAME_STEP_ = 8
+
+# mean difference (0-255) of two downsampled frames still taken as the same screen, e.g. a blinking cursor
+_FRAME_SETTLE_THRESHOLD_ = 1.0
+
+# share of the screen height at the top left out of comparing frames, the status bar & its clock
+_FRAME_SKIP_TOP_ = 0.04
+
+# screenshots captured but not sent yet, hidden from albums & the media scanner until their batch is sent
+_HELD_PICS_DIR_ = '/sdcard/.relaymsg'
+
+# where action scripts are pushed on the phone
+_SCRIPT_DIR_ = '/data/local/tmp'
+
+# logcat lines telling a new message arrived
+_MSG_EVENT_PATTERNS_ = (r'notification_enqueue.*com\.samsung\.android\.messaging',
+                        r'android\.provider\.Telephony\.SMS_RECEIVED',
+                        r'SmsReceiverService.*onStart|handleSmsReceived')
+
+
+class AdbDevice(NamedTuple):
     """
-    ADB Operate Console
+    One line of 'adb devices -l'
     """
+    sn: str
+    state: str
+    properties: dict
 
-    def __init__(self,
-                 device_sn: str = None,
-                 app_name: str = None,
-                 app_actv_name: str = None,
-                 app_run_keyword: str = None):
-        """
-        app_run_keyword (str): keyword to identify app is running.
-        """
-        self.sn = device_sn
-        self.name = app_name
-        self.actv_name = app_actv_name
-        self.run_keyword = app_run_keyword
+    @property
+    def transport_id(self):
+        return self.properties.get('transport_id', '')
 
-        self.last_output = []
 
-        self.tmp_file = _TMP_XML_FILE_
-        self.screenshot_file_local = _SCREENSHOT_FILE_
-        # the name of screenshot photo saved on the phone
-        self.screenshot_file_phone = f'/sdcard/screen_{random.randint(1000, 9999)}.png'
+def fetch_devices(online_only: bool = True) -> list:
+    """
+    return: AdbDevice list of all attached android devices
 
-        # the middle point of the phone screen
-        self.screen_mid_point = self.fetch_mid_of_screen()
+    9f11ca4d device usb:1-1.2 product:on7xltezc model:SM_G6100 device:on7xltechn transport_id:58
+    """
+    try:
+        _output = get_adb_client().devices()
+    except (OSError, AdbError):
+        _output = subprocess.getoutput(f'{_ADB_HOME_}/adb devices -l')
 
-    # low level cli for internal using
-    def _send_shell_command(self, command):
-        """
-        send shell command to android device connected
+    devices = []
+    # 'adb devices -l' prints a header line, the adb server does not
+    for _line in _output.split('\n'):
+        _fields = _line.split()
+        if len(_fields) < 2 or _line.startswith('List of devices') or _line.startswith('*'):
+            continue
+        _properties = dict(_field.split(':', 1) for _field in _fields[2:] if ':' in _field)
+        devices.append(AdbDevice(_fields[0], _fields[1], _properties))
 
-        return True/False, depends on if command is executed successfully.
-        """
-        # Light on the screen by sending key event 224
-        os.system(f"""{_ADB_HOME_}/adb -s {self.sn} shell input keyevent 224""")
+    return [_device for _device in devices if _device.state == 'device'] if online_only else devices
 
-        # sending command to adb shell
-        command = f"""{_ADB_HOME_}/adb -s {self.sn} {command}"""
 
-        # fetching output of the command and storing to class attribute self.last_output
-        # return True or False depends on the return code
-        _output = subprocess.getstatusoutput(command)
-        _return = _output[0]
-        self.last_output = _output[1].split('\n')
-        return True if _return == 0 else False
+def fetch_device_SN(return_id=False) -> str:
+    """
+    return: serial number (or transport id) of the first android device, '' if there isn't.
+    """
+    devices = fetch_devices()
+    if not devices:
+        return ''
+    return devices[0].transport_id if return_id else devices[0].sn
 
-    def get_point_of_text(self, text: str = None, reverse_order: bool = True):
-        """
-        get touch point x,y value list of text on phone screen
-        """
-        command = f'exec-out uiautomator dump /dev/tty > {self.tmp_file}'
-        self._send_shell_command(command)
-        point = []
 
-        try:
-            with open(self.tmp_file, 'r+') as f:
-                dump_txt = f.readlines()
-                f.close()
+def device_tmp_dir(device_sn: str = None):
+    """
+    return tmp directory of the device, files of different devices never collide.
+    """
+    _dir = os.path.join(_TMP_DIR_, f'relaymsg_{device_sn}')
+    os.makedirs(_dir, exist_ok=True)
+    return _dir
 
-        except FileNotFoundError as err:
-            print(err, 'dump screen txt failed.')
-            return point
 
-        # ui_data = [_line for _line in self.last_output.split('/><')]
-        # ui_data = [_line for _line in dump_txt[0].split('/><node')]
-        ui_data = [_line for _line in dump_txt[0].split('><node')]
+# locks keeping more than one relay from driving the same device
+_DEVICE_LOCKS_ = {}
+_DEVICE_LOCKS_LOCK_ = threading.Lock()
 
-        if reverse_order:
-            ui_data.reverse()  # for looking up the last saved pictures using Wechat
 
-        try:
-            for _line in ui_data:
-                if text in _line:
-                    for _part in _line.split():
-                        if 'bounds=' in _part:
-                            _part = _part.strip('bounds="[]').split('][')
-                            point0 = _part[0].split(',')
-                            point1 = _part[1].split(',')
-                            point = [str((int(point0[0]) + int(point1[0])) // 2),
-                                     str((int(point0[1]) + int(point1[1])) // 2)]
-        except IndexError:
-            pass
-        return point
+def get_device_lock(device_sn: str = None):
+    with _DEVICE_LOCKS_LOCK_:
+        return _DEVICE_LOCKS_.setdefault(device_sn, threading.Lock())
 
-    def read_screen_text(self, label: str = None, sub_label: str = None, read_all: bool = True):
-        """
-        label (str) - the keyword only contains in the data block
-        sub_label (str) - ...
-        """
-        label = '' if label is None else label
-        sub_label = '' if sub_label is None else sub_label
 
-        command = f'exec-out uiautomator dump /dev/tty > {self.tmp_file}'
-        self._send_shell_command(command)
+class Profiler(object):
+    """
+    Wall time, byte count & retries of every operation of the run, off by default.
 
-        text = ''
+    summary: calls, p50 & p95 seconds per operation
+    export_chrome_trace: json for chrome://tracing or ui.perfetto.dev
+    export_prometheus: text format for node exporter's textfile collector
+    """
 
-        try:
-            with open(self.tmp_file, 'r+') as f:
-                dump_txt = f.readlines()
-                f.close()
+    def __init__(self):
+        self.enabled = False
+        # (operation, started at, seconds, bytes, retries, thread id)
+        self.records = []
+        self._lock = threading.Lock()
 
-        except FileNotFoundError as err:
-            print(err, 'dump screen txt failed.')
-            return text
+    def record(self, op: str, started_at: float, secs: float, nbytes: int = 0, retries: int = 0):
+        with self._lock:
+            self.records.append((op, started_at, secs, nbytes, retries, threading.get_ident()))
 
-        ui_data = [_line for _line in dump_txt[0].split('><node')]
-        try:
-            for _line in ui_data:
-                if label in _line:
-                    _sub_data_list = _line.split('"')
-                    for _sub_line in _sub_data_list:
-                        if sub_label in _sub_line:
-                            _text_tmp = _sub_data_list[_sub_data_list.index(_sub_line) + 1]
-                            if read_all:
-                                text += _text_tmp + '\n'
-                            else:
-                                return _text_tmp
-            return text
-
-        except IndexError as err:
-            raise err
+    def reset(self):
+        with self._lock:
+            self.records = []
 
-    def launch_app(self):
+    @contextlib.contextmanager
+    def span(self, op: str):
         """
-        launch application in phone
+        time the block as operation op, set 'bytes' & 'retries' of the yielded dict to count them.
         """
-        return self._send_shell_command(f'shell am start -n {self.actv_name}')
-
-    def launch_app_monkey(self):
-        return self._send_shell_command(f'shell monkey -p {self.name} 1')
+        _span = {'bytes': 0, 'retries': 0}
+        if not self.enabled:
+            yield _span
+            return
+        started_at = time.time()
+        _perf = time.perf_counter()
+        try:
+            yield _span
+        finally:
+            self.record(op, started_at, time.perf_counter() - _perf, _span['bytes'], _span['retries'])
 
-    def shutdown_app(self):
+    def summary(self):
         """
-        shutdown application via actv_name
+        return {operation: {'calls', 'total', 'p50', 'p95', 'bytes', 'retries'}}
         """
-        return self._send_shell_command(f'shell am force-stop {self.name}')
+        with self._lock:
+            records = list(self.records)
 
-    def is_app_inst(self):
-        """
-        return true if application installed.
-        """
-        return self._send_shell_command(f'shell pm list packages | grep {self.name}')
+        _durations = {}
+        result = {}
+        for _op, _, _secs, _bytes, _retries, _ in records:
+            _durations.setdefault(_op, []).append(_secs)
+            _stat = result.setdefault(_op, {'calls': 0, 'total': 0.0, 'bytes': 0, 'retries': 0})
+            _stat['calls'] += 1
+            _stat['total'] += _secs
+            _stat['bytes'] += _bytes
+            _stat['retries'] += _retries
 
-    def is_app_launched(self):
-        """
-        return true if application is running
-        """
-        if self.get_point_of_text('text="权限申请"'):
-            self.tap_screen(self.get_point_of_text('text="取消"'))
-        return self.get_point_of_text(self.run_keyword)
+        for _op, _secs in _durations.items():
+            _secs.sort()
+            for _name, _q in (('p50', 0.5), ('p95', 0.95)):
+                # nearest rank
+                result[_op][_name] = _secs[max(0, math.ceil(_q * len(_secs)) - 1)]
+        return result
 
-    def return_back(self):
+    def report(self):
         """
-        back to last page
+        return the summary as a text table, the slowest operation first.
         """
-        return self._send_shell_command('shell input keyevent KEYCODE_BACK')
+        lines = [f'{"operation":<36}{"calls":>7}{"total s":>10}{"p50 s":>9}{"p95 s":>9}{"bytes":>12}{"retries":>9}']
+        for _op, _stat in sorted(self.summary().items(), key=lambda _item: -_item[1]['total']):
+            lines.append(f'{_op:<36}{_stat["calls"]:>7}{_stat["total"]:>10.2f}{_stat["p50"]:>9.3f}'
+                         f'{_stat["p95"]:>9.3f}{_stat["bytes"]:>12}{_stat["retries"]:>9}')
+        return '\n'.join(lines)
 
-    def return_home(self):
-        """
-        back to home screen
-        """
-        return self._send_shell_command('shell input keyevent KEYCODE_HOME')
+    def export_chrome_trace(self, file: str):
+        with self._lock:
+            records = list(self.records)
+        events = [{'name': _op, 'ph': 'X', 'ts': int(_started_at * 1e6), 'dur': int(_secs * 1e6),
+                   'pid': os.getpid(), 'tid': _tid, 'args': {'bytes': _bytes, 'retries': _retries}}
+                  for _op, _started_at, _secs, _bytes, _retries, _tid in records]
+        with open(file, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
 
-    def power_on(self):
+    def export_prometheus(self, file: str):
         """
-        tap power key
+        written to a tmp file & renamed, node exporter never reads a half written file.
         """
-        return self._send_shell_command('shell input keyevent POWER')
+        lines = ['# HELP relaymsg_operation_seconds Wall time of relaymsg operations.',
+                 '# TYPE relaymsg_operation_seconds summary']
+        summary = self.summary()
+        for _op, _stat in sorted(summary.items()):
+            _label = _op.replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'relaymsg_operation_seconds{{operation="{_label}",quantile="0.5"}} {_stat["p50"]:.6f}')
+            lines.append(f'relaymsg_operation_seconds{{operation="{_label}",quantile="0.95"}} {_stat["p95"]:.6f}')
+            lines.append(f'relaymsg_operation_seconds_sum{{operation="{_label}"}} {_stat["total"]:.6f}')
+            lines.append(f'relaymsg_operation_seconds_count{{operation="{_label}"}} {_stat["calls"]}')
+        for _metric, _key, _help in (('bytes', 'bytes', 'Bytes transferred by'),
+                                     ('retries', 'retries', 'Retries of')):
+            lines.append(f'# HELP relaymsg_operation_{_metric}_total {_help} relaymsg operations.')
+            lines.append(f'# TYPE relaymsg_operation_{_metric}_total counter')
+            for _op, _stat in sorted(summary.items()):
+                _label = _op.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'relaymsg_operation_{_metric}_total{{operation="{_label}"}} {_stat[_key]}')
 
-    def screen_off(self):
-        """
-        turn-off screen
-        """
-        return self._send_shell_command('shell input keyevent 223')
+        with open(file + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(file + '.tmp', file)
 
-    def tap_screen(self, point: list):
-        """
-        touch the pointer on screen
-        """
-        return False if len(point) != 2 else self._send_shell_command(f'shell input tap {point[0]} {point[1]}')
 
-    def paste_text(self):
-        return self._send_shell_command('shell input keyevent 279')
+_PROFILER_ = Profiler()
 
-    def copy_text(self, x: int, y: int):
-        self._send_shell_command('shell input keyevent 278')
 
-    def swipe_screen_up_down(self,
-                             up: bool = True,
-                             down: bool = False):
-        """
-        swipe up or down of the screen
-        """
-        from_x_point = self.screen_mid_point[0]
-        from_y_point = self.screen_mid_point[-1]
-        to_x_point = from_x_point
-        try:
-            from_y_point = int(from_y_point)
-        except ValueError:
-            pass
+def profiled(op: str):
+    """
+    decorator timing every call as operation op, bytes returned are counted.
+    """
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            if not _PROFILER_.enabled:
+                return func(*args, **kwargs)
+            with _PROFILER_.span(op) as _span:
+                _result = func(*args, **kwargs)
+                if isinstance(_result, (bytes, bytearray)):
+                    _span['bytes'] = len(_result)
+                return _result
+        return _wrapper
+    return _decorator
 
-        # to_y_point = from_y_point // 2 + from_y_point if up else from_y_point // 2
-        to_y_point = from_y_point // 2 if up else from_y_point // 2 + from_y_point
 
-        return self._send_shell_command(
-            f'shell input swipe {from_x_point} {str(from_y_point)} {to_x_point} {str(to_y_point)}')
+def wait_until(predicate, timeout: float = 10, poll: float = 0.1, max_poll: float = 2.0, backoff: float = 1.5):
+    """
+    call predicate until it returns something true, polling fast at first then slower.
+
+    timeout (float): give up after timeout seconds, predicate is called at least once
+    poll (float): seconds between the first two calls, multiplied by backoff after each call
+    max_poll (float): the longest seconds between two calls
 
-    def take_screenshot(self):
+    return the last value returned by predicate
+    """
+    deadline = time.time() + timeout
+    interval = poll
+    with _PROFILER_.span('wait_until') as _span:
+        while True:
+            _value = predicate()
+            if _value:
+                return _value
+            _left = deadline - time.time()
+            if _left <= 0:
+                return _value
+            _span['retries'] += 1
+            time.sleep(min(interval, _left))
+            interval = min(interval * backoff, max_poll)
+
+
+def _frame_command(command: str, sentinel: str):
+    """
+    wrap shell command, so that its output is followed by line: <sentinel> <exit code>
+    """
+    # '{ }' keeps pipes & redirects of the command together, stdin is closed to
+    # keep the command from eating the commands sent after it.
+    return f"{{ {command}\n}} </dev/null 2>&1; printf '\\n%s %d\\n' {sentinel} $?\n"
+
+
+def _split_framed_output(data: bytes, sentinel: str):
+    """
+    return (exit code, output, the bytes left) of framed command output,
+    None if the sentinel line is not received yet.
+    """
+    marker = f'\n{sentinel} '.encode('utf-8')
+    _index = data.find(marker)
+    if _index < 0:
+        return None
+    _end = data.find(b'\n', _index + len(marker))
+    if _end < 0:
+        return None
+
+    # drop the trailing newline like subprocess.getstatusoutput does
+    _output = data[:_index].decode('utf-8', errors='replace').replace('\r\n', '\n')
+    _output = _output[:-1] if _output.endswith('\n') else _output
+    try:
+        _code = int(data[_index + len(marker):_end].strip())
+    except ValueError:
+        _code = -1
+    return _code, _output, data[_end + 1:]
+
+
+class AdbShellSession(object):
+    """
+    One long-lived `adb -s SN shell` process.
+
+    Commands are written to the stdin of the process, the output and the exit code
+    are read back from stdout, framed by a sentinel line: <sentinel> <exit code>
+    """
+
+    def __init__(self, device_sn: str = None, timeout: float = _SHELL_TIMEOUT_):
+        self.sn = device_sn
+        self.timeout = timeout
+
+        self._proc = None
+        self._buffer = b''
+        self._lock = threading.Lock()
+        self._sentinel = f'__RELAYMSG_{os.getpid()}_{random.randint(1000, 9999)}__'
+
+    def open(self):
         """
-        take screenshot to local
+        start the adb shell process, light on the screen once for the whole session
         """
-        if self._send_shell_command(f'shell screencap {self.screenshot_file_phone}'):
-            return self._send_shell_command(f'pull {self.screenshot_file_phone} {self.screenshot_file_local}')
-        else:
+        self.close()
+        try:
+            self._proc = subprocess.Popen([f'{_ADB_HOME_}/adb', '-s', str(self.sn), 'shell'],
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT)
+        except OSError as err:
+            print(err, 'open adb shell session failed.')
+            self._proc = None
             return False
 
-    def set_screen_on_secs(self, sec=1):
+        self._buffer = b''
+        self.wake_screen()
+        return self.is_alive()
+
+    def is_alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def wake_screen(self):
         """
-        set the time of screen on
+        Light on the screen by sending key event 224
         """
-        return self._send_shell_command(f'shell settings put system screen_off_timeout {str(int(sec * 59998))}')
+        return self.run('input keyevent 224')[0] == 0
 
-    def wait_with_screen_on(self, times=1):
+    def run(self, command: str, timeout: float = None):
         """
-        waiting while keeping screen on
+        run command in the session
+
+        return (exit code, output), exit code is -1 if the session is broken or timed out.
         """
-        count = 0
-        times *= 2
-        while True:
-            count += 1
-            self._send_shell_command('shell input keyevent 224')
-            if count >= times:
-                return True
+        timeout = self.timeout if timeout is None else timeout
 
-    def fetch_mid_of_screen(self):
+        with self._lock:
+            if not self.is_alive():
+                return -1, ''
+
+            try:
+                self._proc.stdin.write(_frame_command(command, self._sentinel).encode('utf-8'))
+                self._proc.stdin.flush()
+            except (OSError, ValueError) as err:
+                print(err, 'write to adb shell session failed.')
+                self._kill()
+                return -1, ''
+
+            deadline = time.time() + timeout
+            while True:
+                _framed = _split_framed_output(self._buffer, self._sentinel)
+                if _framed is not None:
+                    break
+
+                _left = deadline - time.time()
+                if _left <= 0 or not self._read_more(_left):
+                    print(f'adb shell session broken while running: {command}')
+                    self._kill()
+                    return -1, ''
+
+            _code, _output, self._buffer = _framed
+        return _code, _output
+
+    def _read_more(self, timeout: float):
         """
-        fetch middle point of screen
+        read available bytes from stdout into buffer, return False on EOF or timeout.
         """
-        self._send_shell_command(f'shell wm size')
-        wm_size = self.last_output[0].split(':')[-1].split('x')
-        return [str(int(wm_size[0]) // 2), str(int(wm_size[1]) * 3 // 5)]
+        _fd = self._proc.stdout.fileno()
+        _ready, _, _ = select.select([_fd], [], [], timeout)
+        if not _ready:
+            return False
+        _chunk = os.read(_fd, 65536)
+        if not _chunk:
+            return False
+        self._buffer += _chunk
+        return True
 
-    def input_text(self, text: str):
+    def _kill(self):
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+                self._proc.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        self._proc = None
+        self._buffer = b''
+
+    def close(self):
         """
-        Chinese not supported by ADB
+        exit the adb shell process
         """
-        text = pinyin.get(text, format='strip', delimiter='')
-        text = text.replace(' ', '%s')  # sed 's/ /\%s/g'
-        text = text.replace('[_<>|&$;()\"]', '\\&')
-        # sed -e 's/[_<>|&$;()\"]/\/&/g' -e 's/!+/!/g')'
+        if self.is_alive():
+            try:
+                self._proc.stdin.write(b'exit\n')
+                self._proc.stdin.close()
+                self._proc.wait(timeout=5)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                pass
+        self._kill()
 
-        input_cmd = f"""shell input text '{text}'"""
-        return self._send_shell_command(input_cmd)
 
+# adb shell sessions shared by all consoles of the same device
+_SHELL_SESSIONS_ = {}
+_SHELL_SESSIONS_LOCK_ = threading.Lock()
 
-class Wechat(AndroidConsole):
+
+def get_shell_session(device_sn: str = None):
     """
-    Wechat operate console
+    return the running shell session of the device, open one if there isn't.
+    None if the session can not be opened.
     """
+    with _SHELL_SESSIONS_LOCK_:
+        _session = _SHELL_SESSIONS_.get(device_sn)
+        if _session is not None and _session.is_alive():
+            return _session
 
-    def __init__(self, device_sn):
-        app_name = 'com.tencent.mm'
-        app_actv_name = 'com.tencent.mm/.ui.LauncherUI'
-        app_run_keyword = '"通讯录"'
-        AndroidConsole.__init__(self, device_sn, app_name, app_actv_name, app_run_keyword)
-
-    def launch_wechat(self):
-        return self.launch_app()
-
-    def kill_wechat(self):
-        return self.shutdown_app()
-
-    def return_wechat_main_page(self):
-        while not self.get_point_of_text('"通讯录"'):
-            self.return_back()
-        return self.tap_screen(self.get_point_of_text('"微信"'))
+        _session = AdbShellSession(device_sn)
+        if not _session.open():
+            _session.close()
+            return None
+        _SHELL_SESSIONS_[device_sn] = _session
+        return _session
 
-    def is_wechat_running(self):
-        return self.is_app_launched()
 
-    def chat_with_user(self,
-                       user_profile_name: str,
-                       select_input_box: bool = True,
-                       try_times: int = 10,
-                       send_msg_label: str = 'text="发消息"'):
-        # make sure Wechat is running at foreground
-        self.launch_wechat() if not self.is_wechat_running() else ''
-        # ADB dump text
-        user_profile_name = f'''"{user_profile_name}"'''
+@atexit.register
+def close_shell_sessions():
+    with _SHELL_SESSIONS_LOCK_:
+        for _session in _SHELL_SESSIONS_.values():
+            _session.close()
+        _SHELL_SESSIONS_.clear()
 
-        # search user at current page
-        user_point = self.get_point_of_text(user_profile_name)
-        if not user_point:  # search user in 'contact' page
-            self.return_wechat_main_page()
-            self.tap_screen(self.get_point_of_text('通讯录'))
-            count = 0
 
-            while True:
-                user_point = self.get_point_of_text(user_profile_name)
-                if user_point or count >= try_times:
-                    break
-                else:
-                    self.swipe_screen_up_down()
-                    count += 1
-        if not user_point:
-            raise f'User [{user_profile_name} not found error.]'
-        else:
-            self.tap_screen(user_point)
-            _return = self.tap_screen(self.get_point_of_text(send_msg_label))
-            if select_input_box:
-                return self.tap_screen(self.get_point_of_text('android.widget.EditText'))
-            else:
-                return _return
+class AdbError(Exception):
+    """
+    adb server answered FAIL, or broke the protocol
+    """
+    pass
 
-    def send_last_pic(self, user_profile_name: str, try_times: int = 10):
-        self.chat_with_user(user_profile_name, select_input_box=False)
 
-        print(f'Try send last picture to user {user_profile_name}')
-        self.tap_screen(self.get_point_of_text('content-desc="更多功能按钮'))
-        self.tap_screen(self.get_point_of_text('text="相册"'))
-        self.tap_screen(self.get_point_of_text('text="去授权"'))
-        self.tap_screen(self.get_point_of_text('text="总是允许"'))
-        self.tap_screen(self.get_point_of_text('text="原图"'))
-        self.tap_screen(self.get_point_of_text('class="android.widget.CheckBox"'))
+class AdbClient(object):
+    """
+    Client of the adb host protocol, talks to the local adb server (port 5037) directly.
 
-        count = 0
-        while not self.tap_screen(self.get_point_of_text('text="发送')):
-            self.wait_with_screen_on(2)
-            if count >= try_times:
-                return False
+    Every request opens one socket: host:devices-l, host:transport:<sn> then shell: or exec:.
+    Sync connections (used for pull & push) are kept and reused per device.
+    """
 
-        return self.get_point_of_text('"切换到按住说话"')
+    def __init__(self,
+                 host: str = _ADB_SERVER_HOST_,
+                 port: int = _ADB_SERVER_PORT_,
+                 timeout: float = _SHELL_TIMEOUT_):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
 
-    def send_msg(self, user_profile_name: str, msg: str = None):
-        self.chat_with_user(user_profile_name)
-
-        self.input_text(msg)
-        # todo find out point of 'input box' and tap
-        # todo send adb key event 279, paste message
-        # try ADB_INPUT_TEXT
-        # 'https://stackoverflow.com/questions/14224549/adb-shell-input-unicode-character/23482717'
-        self.wait_with_screen_on()
-        self.tap_screen(self.get_point_of_text('text="发送"'))
-        if self.get_point_of_text('text="发送"'):
-            self.tap_screen(self.get_point_of_text('text="发送"'))
-        print('Done')
+        # device sn -> idle sync sockets
+        self._sync_pool = {}
+        self._lock = threading.Lock()
+        self._sentinel = f'__RELAYMSG_{os.getpid()}_{random.randint(1000, 9999)}__'
 
+    # low level protocol
+    def _connect(self):
+        return socket.create_connection((self.host, self.port), timeout=self.timeout)
 
-class DingTalk(AndroidConsole):
-    """
-    Once used for automatically checking in.
-    Lots of mistakes, fixed soon or never...
-    """
+    @staticmethod
+    def _recv_exact(sock, size: int):
+        data = b''
+        while len(data) < size:
+            _chunk = sock.recv(size - len(data))
+            if not _chunk:
+                raise AdbError(f'connection closed, {size - len(data)} bytes missing')
+            data += _chunk
+        return data
 
-    def __init__(self, devID, coName, waitSecs=random.randint(60, 600)):
-        self.devID = devID
-        self.coName = coName
-        self.appName = 'com.alibaba.android.rimet'
-        self.appActvName = 'com.alibaba.android.rimet/.biz.LaunchHomeActivity'
-        self.waitSecs = waitSecs
-        AndroidConsole.__init__(self, self.devID, self.appName, self.appActvName)
+    @staticmethod
+    def _recv_all(sock):
+        chunks = []
+        while True:
+            _chunk = sock.recv(65536)
+            if not _chunk:
+                return b''.join(chunks)
+            chunks.append(_chunk)
 
-    def getCurrentCompany(self):
+    def _request(self, sock, payload: str):
         """
+        send request '<hex length><payload>' and check the OKAY/FAIL status
         """
-        cmdStr = 'exec-out uiautomator dump /dev/tty > ' + self.tmpFile
-        if not self.sendCommand(cmdStr):
-            return ''
-        uiData = ''
-        try:
-            with open(self.tmpFile, 'r') as f:
-                uiData += f.readline()
-            f.close()
-        except FileNotFoundError:
-            print('Temp File Not Found.')
-            return ''
-        os.system('rm -rf ' + self.tmpFile)
-        for line in uiData.split('<'):
-            keyword = 'com.alibaba.android.rimet:id/menu_current_company'
-            keyword = 'com.alibaba.android.rimet:id/tv_org_name'
-            if keyword in line:
-                for statement in line.split():
-                    if 'text' in statement:
-                        return statement.strip().split('"')[-2]
-        return ''
+        data = payload.encode('utf-8')
+        sock.sendall(b'%04x' % len(data) + data)
 
-    def changeCurrCo(self, currCoName, toCoName):
-        """
-        """
-        if not currCoName or not toCoName:
-            return False
-        try:
-            self.tapScreen(self.getIconOrTextPointer(currCoName))
-        except ValueError:
-            return False
-        try:
-            self.tapScreen(self.getIconOrTextPointer(toCoName))
-        except ValueError:
-            return False
-        # add method to verify if changed successfully.
-        if self.getCurrentCompany() == toCoName:
+        _status = self._recv_exact(sock, 4)
+        if _status == b'OKAY':
             return True
-        else:
-            return False
+        if _status == b'FAIL':
+            _length = int(self._recv_exact(sock, 4), 16)
+            raise AdbError(self._recv_exact(sock, _length).decode('utf-8', errors='replace'))
+        raise AdbError(f'unexpected status {_status!r} of request {payload}')
 
-    def getWorkConsoleIcon(self):
+    def _open_transport(self, device_sn: str = None):
         """
+        return a socket switched to the device, ready for one device service.
         """
-        xPointer = ''
-        yPointer = ''
+        sock = self._connect()
         try:
-            leftPointer = self.getIconOrTextPointer('"协作"')
-            rightPointer = self.getIconOrTextPointer('"通讯录"')
-            yPointer = leftPointer[1]
-            xPointer = str((int(rightPointer[0]) - int(leftPointer[0])) // 2 + int(leftPointer[0]))
-        except IndexError:
-            return []
-        pointer = [xPointer, yPointer]
-        return pointer
+            self._request(sock, f'host:transport:{device_sn}' if device_sn else 'host:transport-any')
+        except (OSError, AdbError):
+            sock.close()
+            raise
+        return sock
 
-    def launchDingDing(self):
+    # host services
+    def devices(self):
         """
+        return output of host:devices-l, same as 'adb devices -l' without the header line.
         """
-        return self.launchApp()
+        with self._connect() as sock:
+            self._request(sock, 'host:devices-l')
+            _length = int(self._recv_exact(sock, 4), 16)
+            return self._recv_exact(sock, _length).decode('utf-8', errors='replace')
 
-    def isDingDingRunning(self):
+    # device services
+    def exec_out(self, device_sn: str, command: str):
         """
+        return raw stdout bytes of command, like 'adb exec-out'.
         """
-        return self.isAppLaunched()
+        with self._open_transport(device_sn) as sock:
+            self._request(sock, f'exec:{command}')
+            return self._recv_all(sock)
 
-    def shutdownDingDing(self):
+    def shell(self, device_sn: str, command: str):
         """
+        run command with shell:, return (exit code, output)
         """
-        return self.shutdownApp()
+        with self._open_transport(device_sn) as sock:
+            self._request(sock, f'shell:{_frame_command(command, self._sentinel)}')
+            data = self._recv_all(sock)
 
-    def checkIn(self, wechatUser):
+        _framed = _split_framed_output(data, self._sentinel)
+        if _framed is None:
+            raise AdbError(f'exit code of shell command missing: {command}')
+        return _framed[:2]
+
+    def pull(self, device_sn: str, remote_file: str, local_file: str = None):
         """
+        pull file through sync: protocol, return the bytes of the file
+        or write them to local_file and return True.
         """
-        print('-' * 20 + 'Check in start' + '-' * 20)
-        # os.system('date "+%y/%m/%d %H:%M:%S" | ' + "awk '{print \"Started at: \"$1\" \"$2}'")
-        print('Started at: ', time.strftime('%Y/%m/%d %A %H:%M:%S'))
-        screen_off_time = 1800
-        print('Set system screen off timeout {}s: '.format(screen_off_time), end='', flush=True)
-        if self.setScreenOnSecs(1800):
-            print('Passed')
-        else:
-            print('Failed')
-
-        print('Check Android devices list: ', end='', flush=True)
-        # if sendCommand('devices -l | grep -v "List of devices attached" | grep -v "^$" &>/dev/null'):
-        if self.sendCommand('devices -l | grep "{}" &>/dev/null'.format(self.devID)):
-            print('Passed')
-        else:
-            print('Failed, connect Android device to this computer.')
-            return False
+        sock = self._acquire_sync(device_sn)
+        try:
+            data = self._sync_recv(sock, remote_file)
+        except AdbError as err:
+            # FAIL of the file keeps the connection usable, broken protocol does not
+            if getattr(err, 'sync_failed', False):
+                self._release_sync(device_sn, sock)
+            else:
+                sock.close()
+            raise
+        except OSError:
+            sock.close()
+            raise
 
-        print('Generate random seconds for waiting: ', end='', flush=True)
-        print(str(self.waitSecs) + 's')
-        time.sleep(self.waitSecs)
+        self._release_sync(device_sn, sock)
+        if local_file is None:
+            return data
+        with open(local_file, 'wb') as f:
+            f.write(data)
+        return True
 
-        print('Shutdown DingTalk: ', end='', flush=True)
-        self.shutdownDingDing()
-        self.shutdownDingDing()
-        while True:
-            if self.isDingDingRunning():
-                self.shutdownDingDing()
-                self.lightOnScreenAndWait(1)
+    def push(self, device_sn: str, data: bytes, remote_file: str, mode: int = 0o644):
+        """
+        write data to remote_file through sync: protocol, return True.
+        """
+        sock = self._acquire_sync(device_sn)
+        try:
+            self._sync_send(sock, data, remote_file, mode)
+        except AdbError as err:
+            if getattr(err, 'sync_failed', False):
+                self._release_sync(device_sn, sock)
             else:
-                print('Passed')
-                break
+                sock.close()
+            raise
+        except OSError:
+            sock.close()
+            raise
 
-        print('Launch DingTalk: ', end='', flush=True)
-        self.launchDingDing()
-        self.lightOnScreenAndWait(3)
-        while True:
-            if self.isDingDingRunning():
-                print('Passed')
-                break
-            else:
-                self.lightOnScreenAndWait(1)
-                self.launchDingDing()
-
-                # modify
-        print('Tap work console icon: ', end='', flush=True)
-        # tapScreen(getIconOrTextPointer('工作台'))
-        # tapScreen(getIconOrTextPointer('home_bottom_tab_text'))
-        self.tapScreen(self.getWorkConsoleIcon())
-        while True:
-            currentCoName = self.getCurrentCompany()
-            if currentCoName:
-                print('Passed')
-                break
-            else:
-                self.lightOnScreenAndWait()
-                self.tapScreen(self.getWorkConsoleIcon())
+        self._release_sync(device_sn, sock)
+        return True
 
-        print('Verify if the current company is {}: '.format(self.coName), end='', flush=True)
-        if currentCoName == self.coName:
-            print('Passed')
-        else:
-            print('Failed')
-            print('Change to company {}: '.format(self.coName), end='', flush=True)
-            while True:
-                if self.changeCurrCo(currentCoName, self.coName):
-                    print('Passed')
-                    break
-                else:
-                    self.lightOnScreenAndWait(1)
+    def _acquire_sync(self, device_sn: str):
+        """
+        return an idle sync connection of the device, open one if there isn't.
+        """
+        with self._lock:
+            _idle = self._sync_pool.setdefault(device_sn, [])
+            sock = _idle.pop() if _idle else None
 
-        print('Press checkin icon: ', end='', flush=True)
-        while True:
-            checkInIcon = self.getIconOrTextPointer('"考勤打卡"')
-            if not checkInIcon:
-                self.lightOnScreenAndWait(1)
-            else:
-                if checkInIcon[1] <= '194':
-                    self.swapDownQuarterScreen()
-                    checkInIcon = self.getIconOrTextPointer('考勤打卡')
+        if sock is None:
+            sock = self._open_transport(device_sn)
+            try:
+                self._request(sock, 'sync:')
+            except (OSError, AdbError):
+                sock.close()
+                raise
+        return sock
 
-                elif checkInIcon[1] >= '1700':
-                    self.swapUpQuarterScreen()
-                    checkInIcon = self.getIconOrTextPointer('考勤打卡')
+    def _sync_send(self, sock, data: bytes, remote_file: str, mode: int):
+        _path = f'{remote_file},{mode}'.encode('utf-8')
+        sock.sendall(b'SEND' + struct.pack('<I', len(_path)) + _path)
+        for _offset in range(0, len(data), 65536):
+            _chunk = data[_offset:_offset + 65536]
+            sock.sendall(b'DATA' + struct.pack('<I', len(_chunk)) + _chunk)
+        sock.sendall(b'DONE' + struct.pack('<I', int(time.time())))
 
-                self.tapScreen(checkInIcon)
-                print('Passed')
-                break
+        _id, _length = struct.unpack('<4sI', self._recv_exact(sock, 8))
+        if _id == b'OKAY':
+            return True
+        if _id == b'FAIL':
+            err = AdbError(self._recv_exact(sock, _length).decode('utf-8', errors='replace'))
+            err.sync_failed = True
+            raise err
+        raise AdbError(f'unexpected sync response {_id!r}')
 
-        # add method to verify if the big icon is exit.
-        print('Verify if the current page is the one we wanted: ', end='', flush=True)
-        # This page return 'ERROR: could not get idle state.'
-        count = 0
+    def _sync_recv(self, sock, remote_file: str):
+        _path = remote_file.encode('utf-8')
+        sock.sendall(b'RECV' + struct.pack('<I', len(_path)) + _path)
+
+        chunks = []
         while True:
-            if count > 10:
-                print('Failed, check in anyway!')
-                break
-            if not self.getIconOrTextPointer(self.coName):
-                print('Passed')
-                break
+            _id, _length = struct.unpack('<4sI', self._recv_exact(sock, 8))
+            if _id == b'DATA':
+                chunks.append(self._recv_exact(sock, _length))
+            elif _id == b'DONE':
+                return b''.join(chunks)
+            elif _id == b'FAIL':
+                err = AdbError(self._recv_exact(sock, _length).decode('utf-8', errors='replace'))
+                err.sync_failed = True
+                raise err
             else:
-                self.lightOnScreenAndWait(1)
-                count += 1
+                raise AdbError(f'unexpected sync response {_id!r}')
 
-        print('Finally, check in: ', end='', flush=True)
-        self.tapScreen(self.midPoint)
-        self.lightOnScreenAndWait(1)
-        self.tapScreen(self.midPoint)
-        self.lightOnScreenAndWait(1)
-
-        # continueIcon = ['818', '1114']
-        continueIcon = self.getIconOrTextPointer('text="继续打卡"')
-        if continueIcon:
-            continueIcon = self.getIconOrTextPointer('text="继续打卡"')
-            print('ORG changed before, continue check in.')
-            self.tapScreen(continueIcon)
-            self.lightOnScreenAndWait(1)
-            self.tapScreen(continueIcon)
-        else:
-            print('Passed')
-
-        print('Take screenshot & return home screen: ', end='', flush=True)
-        self.lightOnScreenAndWait(1)
-        self.screenShot()
-        self.lightOnScreenAndWait(1)
-        if self.returnHome():
-            print('Passed')
+    def _release_sync(self, device_sn: str, sock):
+        with self._lock:
+            self._sync_pool.setdefault(device_sn, []).append(sock)
+
+    def close(self):
+        """
+        quit and close the pooled sync connections
+        """
+        with self._lock:
+            for _idle in self._sync_pool.values():
+                for sock in _idle:
+                    try:
+                        sock.sendall(b'QUIT' + struct.pack('<I', 0))
+                    except OSError:
+                        pass
+                    sock.close()
+            self._sync_pool.clear()
+
+
+# adb clients shared by all consoles, keyed by (host, port) of the adb server
+_ADB_CLIENTS_ = {}
+_ADB_CLIENTS_LOCK_ = threading.Lock()
+
+
+def get_adb_client(host: str = _ADB_SERVER_HOST_, port: int = _ADB_SERVER_PORT_):
+    with _ADB_CLIENTS_LOCK_:
+        _client = _ADB_CLIENTS_.get((host, port))
+        if _client is None:
+            _client = _ADB_CLIENTS_[(host, port)] = AdbClient(host, port)
+        return _client
+
+
+@atexit.register
+def close_adb_clients():
+    with _ADB_CLIENTS_LOCK_:
+        for _client in _ADB_CLIENTS_.values():
+            _client.close()
+        _ADB_CLIENTS_.clear()
+
+
+# boolean attributes of a ui node, stored as bits of UiNode.flags
+_UI_NODE_FLAGS_ = ('checkable', 'checked', 'clickable', 'enabled', 'focusable', 'focused',
+                   'scrollable', 'long-clickable', 'password', 'selected')
+
+# attributes of a ui node indexed by UiTree for exact lookups
+_UI_INDEXED_ATTRIBUTES_ = ('text', 'content-desc', 'resource-id', 'class')
+
+_BOUNDS_PATTERN_ = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+
+# pixels of one cell of UiSpatialIndex
+_UI_GRID_CELL_ = 120
+
+
+class UiNode(object):
+    """
+    One node of the ui hierarchy dump, bounds & center point are parsed once.
+    """
+    __slots__ = ('order', 'depth', 'index', 'text', 'resource_id', 'class_name', 'package',
+                 'content_desc', 'flags', 'bounds', 'center')
+
+    # dump attribute name -> slot name
+    _SLOT_OF_ = {'index': 'index', 'text': 'text', 'resource-id': 'resource_id', 'class': 'class_name',
+                 'package': 'package', 'content-desc': 'content_desc'}
+
+    def __init__(self, attrs: dict, order: int = 0, depth: int = 0):
+        self.order = order
+        self.depth = depth
+        self.index = attrs.get('index', '')
+        self.text = attrs.get('text', '')
+        self.resource_id = attrs.get('resource-id', '')
+        self.class_name = attrs.get('class', '')
+        self.package = attrs.get('package', '')
+        self.content_desc = attrs.get('content-desc', '')
+
+        self.flags = 0
+        for _bit, _name in enumerate(_UI_NODE_FLAGS_):
+            if attrs.get(_name) == 'true':
+                self.flags |= 1 << _bit
+
+        _match = _BOUNDS_PATTERN_.match(attrs.get('bounds', ''))
+        if _match:
+            self.bounds = tuple(int(_v) for _v in _match.groups())
+            self.center = ((self.bounds[0] + self.bounds[2]) // 2, (self.bounds[1] + self.bounds[3]) // 2)
         else:
-            print('Failed')
+            self.bounds = None
+            self.center = None
 
-        sendMail(self.coName, subject='通知：{}打卡记录自动发送'.format(self.coName), image=self.screenShotLocalFile)
-        wechatCon = wechatConsole(self.devID)
-        coNameEng = pinyin.get(self.coName, format='strip', delimiter='')
-        # Capitalize the first letter of the string
-        coNameEng = coNameEng.replace(coNameEng[0], coNameEng[0].upper(), 1)
-        wechatCon.sendMsg2one(wechatUser, '{} checked in at: {}.'
-                              .format(coNameEng, time.strftime("%m/%d %a %H:%M")), lastPic=True)
-        self.returnHome()
-        self.screenOff()
-        print('-' * 20 + 'Check in done' + '-' * 20)
+    def __repr__(self):
+        return f'<UiNode {self.class_name} text="{self.text}" bounds={self.bounds}>'
 
-    def OneKeyClean(self):
+    def has_flag(self, name: str):
+        return bool(self.flags & (1 << _UI_NODE_FLAGS_.index(name)))
+
+    def get(self, name: str):
         """
+        return attribute value as it is in the dump, '' if the node hasn't it.
         """
-        pass
+        if name in self._SLOT_OF_:
+            return getattr(self, self._SLOT_OF_[name])
+        if name in _UI_NODE_FLAGS_:
+            return 'true' if self.has_flag(name) else 'false'
+        if name == 'bounds' and self.bounds is not None:
+            return '[{},{}][{},{}]'.format(*self.bounds)
+        return ''
 
+    def attributes(self):
+        """
+        return [(name, value)] in the order of the dump
+        """
+        names = ('index', 'text', 'resource-id', 'class', 'package', 'content-desc') + _UI_NODE_FLAGS_ + ('bounds',)
+        return [(_name, self.get(_name)) for _name in names]
 
-class Message(AndroidConsole):
-    def __init__(self, device_sn):
-        app_name = 'com.samsung.android.messaging'
-        app_actv_name = 'com.samsung.android.messaging/com.android.mms.ui.ConversationComposer'
-        app_run_keyword = '"对话"'
-        AndroidConsole.__init__(self, device_sn, app_name, app_actv_name, app_run_keyword)
+    @property
+    def point(self):
+        """
+        center point as ['x', 'y'], the format taken by tap_screen
+        """
+        return [str(self.center[0]), str(self.center[1])] if self.center else []
 
-    def launch_msg(self):
-        print('Shutdown Message App for restarting: ', self.shutdown_app())
-        print('Launch Message App: ', self.launch_app_monkey())
 
-    def read_msg(self, label: str = None, sub_label: str = None):
-        label = 'com.samsung.android.messaging:id/base_list_item_data' if not label else label
-        sub_label = 'content-desc' if not sub_label else sub_label
-        return self.read_screen_text(label, sub_label)
+@functools.lru_cache(maxsize=256)
+def _parse_selector(selector: str):
+    """
+    translate the lookup text used all over this module to (attribute, value, mode)
 
-    def read_new_msg(self, new_msg_label: str = None):
-        new_msg_label = '条未读信息' if not new_msg_label else new_msg_label
-        new_msgs = ''
-        # todo tap screen to the bottom, read the last unread new.
+        'text="发送"'          -> ('text', '发送', 'exact')
+        'text="发送'           -> ('text', '发送', 'prefix')
+        '"通讯录"'             -> (None, '通讯录', 'exact'), any attribute
+        'android.widget.EditText' -> (None, 'android.widget.EditText', 'contains'), any attribute
+    """
+    _match = re.fullmatch(r'\s*([\w-]+)="([^"]*)("?)\s*', selector)
+    if _match:
+        return _match.group(1), _match.group(2), 'exact' if _match.group(3) else 'prefix'
+    if len(selector) >= 2 and selector.startswith('"') and selector.endswith('"'):
+        return None, selector[1:-1], 'exact'
+    return None, selector, 'contains'
 
-        _point = self.get_point_of_text(new_msg_label)
-        # read message only if 'new_msg_label' exist
-        while _point:
-            self.tap_screen(_point)
-            _point = None
 
-            """
-            _inter_point = self.get_point_of_text(new_msg_label)
-            if _inter_point:
-                self.tap_screen(_inter_point)
-                new_msgs += self.read_msg() + '\n'
-            """
-            new_msgs += self.read_msg() + '\n'
-            _point = self.get_point_of_text(new_msg_label)
+class UiTree(object):
+    """
+    Ui hierarchy dump parsed once into UiNode records,
+    indexed by text, content-desc, resource-id & class.
+    """
 
-        _prompt = 'New messages fetched.' if new_msgs else 'All messages has been read.'
-        print(_prompt)
-        return new_msgs
+    def __init__(self, dump=b''):
+        self.xml = dump
+        self.nodes = []
+        # attribute -> value -> [UiNode] in document order
+        self._index = {_attr: {} for _attr in _UI_INDEXED_ATTRIBUTES_}
 
-    def read_new_msg_as_screenshot(self, new_msg_label: str = None):
-        new_msg_label = '条未读信息' if not new_msg_label else new_msg_label
-        # todo tap screen to the bottom, read the last unread new.
-        _point = self.get_point_of_text(new_msg_label)
-        # read message only if 'new_msg_label' exist
-        if _point:
-            self.tap_screen(_point)
+        if dump:
+            self._parse(dump)
 
-            _point = self.get_point_of_text(new_msg_label)
-            if _point:
-                self.tap_screen(_point)
+    def __len__(self):
+        return len(self.nodes)
 
-            print('Reading 1 new message to screenshot...')
-            return self.take_screenshot()
+    def __bool__(self):
+        return bool(self.nodes)
+
+    @functools.cached_property
+    def digest(self):
+        """
+        hash of the dump, the same on screens not changed
+        """
+        return hashlib.md5(self.xml if isinstance(self.xml, bytes) else self.xml.encode('utf-8')).hexdigest()
+
+    def _parse(self, dump):
+        _depth = [0]
+
+        def _start(name, attrs):
+            if name == 'node':
+                _node = UiNode(attrs, len(self.nodes), _depth[0])
+                self.nodes.append(_node)
+                for _attr in _UI_INDEXED_ATTRIBUTES_:
+                    _value = attrs.get(_attr)
+                    if _value:
+                        self._index[_attr].setdefault(_value, []).append(_node)
+            _depth[0] += 1
+
+        def _end(name):
+            _depth[0] -= 1
+
+        parser = xml.parsers.expat.ParserCreate('utf-8')
+        parser.StartElementHandler = _start
+        parser.EndElementHandler = _end
+
+        try:
+            parser.Parse(dump, True)
+        except xml.parsers.expat.ExpatError as err:
+            # 'uiautomator dump /dev/tty' appends 'UI hierchary dumped to: /dev/tty' to the xml,
+            # it's junk after the document which is parsed already.
+            if not self.nodes or _depth[0] != 0:
+                print(err, 'parse ui dump failed.')
+
+    def find(self, selector: str = None):
+        """
+        return nodes matched selector in document order, see _parse_selector for the syntax.
+        all nodes if selector is empty.
+        """
+        if not selector:
+            return list(self.nodes)
+
+        attr, value, mode = _parse_selector(selector)
+
+        if attr is not None and mode == 'exact':
+            if attr in self._index:
+                return list(self._index[attr].get(value, []))
+            return [_node for _node in self.nodes if _node.get(attr) == value]
+
+        if attr is not None:
+            if attr in self._index:
+                return self._merge([_nodes for _value, _nodes in self._index[attr].items()
+                                    if _value.startswith(value)])
+            return [_node for _node in self.nodes if _node.get(attr).startswith(value)]
+
+        # any attribute: exact values first, substrings of the indexed values if none
+        _matched = [self._index[_attr][value] for _attr in _UI_INDEXED_ATTRIBUTES_ if value in self._index[_attr]]
+        if not _matched and mode == 'contains':
+            _matched = [_nodes for _attr in _UI_INDEXED_ATTRIBUTES_
+                        for _value, _nodes in self._index[_attr].items() if value in _value]
+        return self._merge(_matched)
+
+    @staticmethod
+    def _merge(node_lists: list):
+        """
+        merge node lists into one in document order without duplicates
+        """
+        if len(node_lists) == 1:
+            return list(node_lists[0])
+        _nodes = {_node.order: _node for _nodes in node_lists for _node in _nodes}
+        return [_nodes[_order] for _order in sorted(_nodes)]
+
+    def find_one(self, selector: str = None, last: bool = False):
+        """
+        return the first (or the last) node matched selector, None if not found.
+        """
+        _nodes = self.find(selector)
+        if not _nodes:
+            return None
+        return _nodes[-1] if last else _nodes[0]
+
+    def point_of(self, selector: str = None, last: bool = False, bottom_most: bool = False):
+        """
+        return touch point of the first (or the last) node matched selector, [] if not found.
+        bottom_most (bool): of the lowest node on screen, whatever the document order
+        """
+        if bottom_most:
+            _node = self.spatial.bottom_most(self.find(selector))
         else:
-            print('All messages been read.')
-            return False
+            _node = self.find_one(selector, last)
+        return _node.point if _node is not None else []
 
-    def read_msg_from(self, sender: str):
-        msg_entry_label = '''"通知类信息"'''
+    def find_any(self, selectors: list):
+        """
+        return (selector, node) of the first selector of selectors matched a node, None if none did.
+        """
+        for _selector in selectors:
+            _node = self.find_one(_selector)
+            if _node is not None:
+                return _selector, _node
+        return None
 
-        _point = self.get_point_of_text(msg_entry_label)
-        # read message only if 'new_msg_label' exist
-        if _point:
-            self.tap_screen(_point)
+    def texts(self, selector: str = None, attr: str = 'text'):
+        """
+        return values of the attributes named like attr of the nodes matched selector
+        """
+        return [_value for _node in self.find(selector)
+                for _name, _value in _node.attributes() if attr in _name]
 
-            _sender_point = self.get_point_of_text(sender)
-            _count = 0
-            while not _sender_point and _count <= 10:
-                self.swipe_screen_up_down()
-                _sender_point = self.get_point_of_text(sender)
-                _count += 1
+    @functools.cached_property
+    def spatial(self):
+        """
+        UiSpatialIndex of the nodes, built on the first geometric lookup
+        """
+        return UiSpatialIndex(self.nodes)
 
-            if _sender_point:
-                self.tap_screen(_sender_point)
-                return self.read_msg()
-            else:
-                print('No sender found.')
-                return None
+
+class UiSpatialIndex(object):
+    """
+    Bounds of ui nodes bucketed in a grid of cell pixels, answering where things are on screen
+    instead of where they are in the dump:
+
+        node_at(x, y)            the node drawn on top at the point
+        nearest(x, y, flag)      the node with flag closest to the point, e.g. the clickable one
+        in_viewport(viewport)    nodes inside a rectangle, the screen by default
+        bottom_most(nodes)       the lowest of nodes on screen, e.g. the last message of a chat
+
+    bounds & flags are numpy arrays if numpy is installed, lookups over all nodes are vectorized.
+    """
+
+    def __init__(self, nodes: list, cell: int = _UI_GRID_CELL_):
+        self.nodes = [_node for _node in nodes if _node.bounds is not None]
+        self.cell = cell
+        # (column, row) -> positions in self.nodes
+        self._grid = {}
+        for _n, _node in enumerate(self.nodes):
+            for _key in self._cells(_node.bounds):
+                self._grid.setdefault(_key, []).append(_n)
+
+        if numpy is not None:
+            self._bounds = numpy.array([_node.bounds for _node in self.nodes], dtype=numpy.int64).reshape(-1, 4)
+            self._flags = numpy.array([_node.flags for _node in self.nodes], dtype=numpy.int64)
         else:
-            print('sys error.')
+            self._bounds = [_node.bounds for _node in self.nodes]
+            self._flags = [_node.flags for _node in self.nodes]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _cells(self, bounds: tuple):
+        for _column in range(bounds[0] // self.cell, max(bounds[2] - 1, bounds[0]) // self.cell + 1):
+            for _row in range(bounds[1] // self.cell, max(bounds[3] - 1, bounds[1]) // self.cell + 1):
+                yield _column, _row
+
+    @staticmethod
+    def _bit(flag: str):
+        return 1 << _UI_NODE_FLAGS_.index(flag)
+
+    @property
+    def screen(self):
+        """
+        bounds of the root node, the whole screen
+        """
+        return self.nodes[0].bounds if self.nodes else (0, 0, 0, 0)
+
+    def node_at(self, x: int, y: int, flag: str = None):
+        """
+        return the node at point x, y drawn on top (the last one in document order), None if nothing there.
+        flag (str): only nodes with the flag, e.g. 'clickable'
+        """
+        _bit = self._bit(flag) if flag else 0
+        hits = [_n for _n in self._grid.get((int(x) // self.cell, int(y) // self.cell), [])
+                if self.nodes[_n].bounds[0] <= x < self.nodes[_n].bounds[2]
+                and self.nodes[_n].bounds[1] <= y < self.nodes[_n].bounds[3]
+                and (not _bit or self.nodes[_n].flags & _bit)]
+        return self.nodes[max(hits)] if hits else None
+
+    def nearest(self, x: int, y: int, flag: str = 'clickable', viewport: tuple = None):
+        """
+        return the node with flag nearest to point x, y, measured to its bounds, 0 inside them.
+        the smallest one wins among nodes at the same distance. None if there's no node with flag.
+        viewport (tuple): only nodes inside (left, top, right, bottom)
+        """
+        if not self.nodes:
             return None
+        _bit = self._bit(flag) if flag else 0
+        _inside = self._inside_mask(viewport, fully=False) if viewport is not None else None
+        if numpy is not None:
+            _left, _top, _right, _bottom = self._bounds.T
+            _dx = numpy.maximum(numpy.maximum(_left - x, x - (_right - 1)), 0)
+            _dy = numpy.maximum(numpy.maximum(_top - y, y - (_bottom - 1)), 0)
+            _distance = (_dx * _dx + _dy * _dy).astype(numpy.float64)
+            if _bit:
+                _distance[(self._flags & _bit) == 0] = numpy.inf
+            if _inside is not None:
+                _distance[~_inside] = numpy.inf
+            _best = float(_distance.min())
+            if _best == numpy.inf:
+                return None
+            _candidates = numpy.flatnonzero(_distance == _best)
+            _areas = (_right - _left)[_candidates] * (_bottom - _top)[_candidates]
+            return self.nodes[int(_candidates[int(numpy.argmin(_areas))])]
 
+        best = None
+        for _n, (_left, _top, _right, _bottom) in enumerate(self._bounds):
+            if _bit and not self._flags[_n] & _bit or _inside is not None and not _inside[_n]:
+                continue
+            _dx = max(_left - x, x - (_right - 1), 0)
+            _dy = max(_top - y, y - (_bottom - 1), 0)
+            _key = (_dx * _dx + _dy * _dy, (_right - _left) * (_bottom - _top))
+            if best is None or _key < best[0]:
+                best = (_key, _n)
+        return self.nodes[best[1]] if best is not None else None
 
-def relay_msg_to_wechat(wechat_user: str):
-    sn = fetch_device_SN()
+    def _inside_mask(self, viewport: tuple, fully: bool):
+        _l, _t, _r, _b = viewport
+        if numpy is not None:
+            _left, _top, _right, _bottom = self._bounds.T
+            if fully:
+                return (_left >= _l) & (_top >= _t) & (_right <= _r) & (_bottom <= _b)
+            return (_left < _r) & (_right > _l) & (_top < _b) & (_bottom > _t)
+        if fully:
+            return [_left >= _l and _top >= _t and _right <= _r and _bottom <= _b
+                    for _left, _top, _right, _bottom in self._bounds]
+        return [_left < _r and _right > _l and _top < _b and _bottom > _t
+                for _left, _top, _right, _bottom in self._bounds]
 
-    msg_app = Message(sn)
-    msg_app.launch_msg()
-    # messages = msg_app.read_new_msg()
+    def in_viewport(self, viewport: tuple = None, flag: str = None, fully: bool = True):
+        """
+        return nodes inside viewport (left, top, right, bottom), the screen if None, in document order.
+        fully (bool): the whole node inside, any part of it if False
+        """
+        _inside = self._inside_mask(self.screen if viewport is None else viewport, fully)
+        _bit = self._bit(flag) if flag else 0
+        if numpy is not None:
+            if _bit:
+                _inside = _inside & ((self._flags & _bit) != 0)
+            return [self.nodes[int(_n)] for _n in numpy.flatnonzero(_inside)]
+        return [_node for _node, _in in zip(self.nodes, _inside) if _in and (not _bit or _node.flags & _bit)]
 
-    # print(msg.read_msg_from('10086'))
-    wechat = Wechat(sn)
-    while msg_app.read_new_msg_as_screenshot():
-        wechat.send_last_pic(wechat_user)
+    def contains(self, node: UiNode, viewport: tuple = None):
+        """
+        return True if node is inside viewport, the screen if None
+        """
+        _l, _t, _r, _b = self.screen if viewport is None else viewport
+        return node.bounds is not None and \
+            node.bounds[0] >= _l and node.bounds[1] >= _t and node.bounds[2] <= _r and node.bounds[3] <= _b
 
-    wechat.return_back()
-    wechat.screen_off()
+    @staticmethod
+    def bottom_most(nodes: list):
+        """
+        return the node of nodes reaching lowest on screen, the last in document order if even, None if empty.
+        """
+        nodes = [_node for _node in nodes if _node.bounds is not None]
+        return max(nodes, key=lambda _node: (_node.bounds[3], _node.order)) if nodes else None
 
 
-if __name__ == '__main__':
-    relay_msg_to_wechat(sys.argv[1])
+class UiSnapshotCache(object):
+    """
+    The last parsed ui hierarchy (UiTree) of one device, shared by all consoles of the device.
+
+    Actions changing the screen invalidate it, it expires after max_age seconds anyway.
+    """
+
+    def __init__(self, max_age: float = _UI_CACHE_MAX_AGE_):
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+        self._dump = None
+        self._taken_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        return the cached UiTree, None if there isn't a valid one.
+        """
+        with self._lock:
+            if self._dump is not None and time.time() - self._taken_at <= self.max_age:
+                self.hits += 1
+                return self._dump
+            self.misses += 1
+            return None
+
+    def put(self, dump):
+        with self._lock:
+            self._dump = dump
+            self._taken_at = time.time()
+
+    def invalidate(self):
+        with self._lock:
+            self._dump = None
+
+
+# ui snapshot caches keyed by device sn
+_UI_CACHES_ = {}
+_UI_CACHES_LOCK_ = threading.Lock()
+
+
+def get_ui_cache(device_sn: str = None):
+    with _UI_CACHES_LOCK_:
+        _cache = _UI_CACHES_.get(device_sn)
+        if _cache is None:
+            _cache = _UI_CACHES_[device_sn] = UiSnapshotCache()
+        return _cache
+
+
+def parse_screen_size(output: list):
+    """
+    return [width, height] of output lines of 'wm size', None if not found.
+    an override size set by 'wm size WxH' comes after the physical one & wins.
+    """
+    _sizes = [_line.split(':')[-1].strip().split('x') for _line in output if 'size:' in _line]
+    return [int(_value) for _value in _sizes[-1]] if _sizes else None
+
+
+class DeviceProfile(object):
+    """
+    What rarely changes on one device, saved across runs & shared by the consoles of the device:
+
+        {'screen_size': [1080, 2340], 'packages': {'com.tencent.mm': '2280'},
+         'learned': {'com.tencent.mm': {'version': '2280', 'points': {'text="相册"': ['405', '1650']}}}}
+
+    validate() reads screen size & versions of the packages in one command, once per process
+    or every max_age seconds. points learned of a package are dropped once its version changed,
+    nothing changes if the command failed.
+    """
+
+    def __init__(self, device_sn: str = None, state_dir: str = _STATE_DIR_, max_age: float = _PROFILE_MAX_AGE_):
+        self.file = os.path.join(state_dir, f'device_{device_sn}.json')
+        self.max_age = max_age
+        self.screen_size = None
+        # installed package -> version code, '' if the phone doesn't tell
+        self.packages = {}
+        self.learned = {}
+        self.validated_at = None
+        self._queried = set()
+        self._lock = threading.RLock()
+        try:
+            with open(self.file, 'r') as f:
+                _state = json.load(f)
+            self.screen_size = _state.get('screen_size')
+            self.packages = dict(_state.get('packages', {}))
+            self.learned = dict(_state.get('learned', {}))
+        except (FileNotFoundError, ValueError) as err:
+            if not isinstance(err, FileNotFoundError):
+                print(err, 'device profile broken, reset.')
+
+    def validate(self, console, force: bool = False):
+        """
+        read screen size & package versions by console if not done within max_age,
+        or the package of console wasn't asked yet.
+        """
+        with self._lock:
+            _request = self.validate_command(console.name, force)
+            if _request is not None and console._send_shell_command(_request[0]):
+                self.update(console.last_output, _request[1])
+
+    def validate_command(self, package: str = None, force: bool = False):
+        """
+        return (the shell command reading screen size & versions, the packages asked by it),
+        None if validated within max_age & package was asked already. the command fails if wm or pm did.
+        """
+        with self._lock:
+            _fresh = self.validated_at is not None and time.time() - self.validated_at < self.max_age
+            if _fresh and not force and (not package or package in self._queried):
+                return None
+            _packages = sorted(set(self.packages) | set(self.learned) | ({package} if package else set()))
+            command = 'shell wm size'
+            if _packages:
+                # none of the packages installed is no failure
+                command += (' && _pm=$(pm list packages --show-versioncode 2>/dev/null || pm list packages) && '
+                            '{ echo "$_pm" | grep -F ' +
+                            ' '.join(f'-e {shlex.quote(_package)}' for _package in _packages) + '; true; }')
+            return command, _packages
+
+    def update(self, output: list, packages: list):
+        """
+        take output lines of a validate_command succeeded asking packages & save.
+        return False & keep the profile as it is if the output isn't of it, e.g. no screen size.
+        """
+        with self._lock:
+            _size = parse_screen_size(output)
+            if not _size:
+                print('screen size not read, device profile kept.')
+                return False
+            self.screen_size = _size
+            _versions = {}
+            for _line in output:
+                _match = re.match(r'package:(\S+)(?:\s+versionCode:(\d+))?', _line.strip())
+                if _match and _match.group(1) in packages:
+                    _versions[_match.group(1)] = _match.group(2) or ''
+            self.packages = _versions
+            for _package in list(self.learned):
+                if self.learned[_package].get('version') != _versions.get(_package):
+                    print(f'{_package} updated or removed, points learned of it dropped.')
+                    self.learned[_package]['points'].clear()
+                    self.learned[_package]['version'] = _versions.get(_package)
+            self._queried = set(packages)
+            self.validated_at = time.time()
+            self.save()
+            return True
+
+    def points(self, package: str):
+        """
+        return the dict of points learned of package, {label: point}, fill it & save().
+        """
+        with self._lock:
+            if package not in self.learned:
+                self.learned[package] = {'version': self.packages.get(package), 'points': {}}
+            return self.learned[package]['points']
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+            with open(self.file + '.tmp', 'w') as f:
+                json.dump({'screen_size': self.screen_size, 'packages': self.packages, 'learned': self.learned},
+                          f, ensure_ascii=False, indent=1)
+            os.replace(self.file + '.tmp', self.file)
+
+
+_DEVICE_PROFILES_ = {}
+_DEVICE_PROFILES_LOCK_ = threading.Lock()
+
+
+def get_device_profile(device_sn: str = None):
+    with _DEVICE_PROFILES_LOCK_:
+        _profile = _DEVICE_PROFILES_.get(device_sn)
+        if _profile is None:
+            _profile = _DEVICE_PROFILES_[device_sn] = DeviceProfile(device_sn)
+        return _profile
+
 
+class ScreenFrame(NamedTuple):
+    """
+    One raw frame of 'screencap' without -p
+    """
+    width: int
+    height: int
+    # 1 RGBA_8888, 2 RGBX_8888
+    pixel_format: int
+    # 4 bytes per pixel, row by row
+    pixels: bytes
+    # green channel below the status bar, numpy array of the means of _FRAME_STEP_ pixels square blocks,
+    # rows of every _FRAME_STEP_ pixel without numpy
+    luma: object
+
+
+def parse_raw_frame(data: bytes, step: int = _FRAME_STEP_):
+    """
+    return ScreenFrame of the output of 'screencap', None if it isn't a frame of 4 bytes per pixel.
+
+    the header is width, height & format, followed by the color space since Android 8, 4 bytes each.
+    """
+    if not data or len(data) < 12:
+        return None
+    width, height, pixel_format = struct.unpack_from('<III', data)
+    _size = width * height * 4
+    if not _size or len(data) - _size not in (12, 16) or pixel_format not in (1, 2):
+        return None
+    pixels = memoryview(data)[len(data) - _size:]
+
+    _top = int(height * _FRAME_SKIP_TOP_)
+    if numpy is not None:
+        _rows, _columns = (height - _top) // step, width // step
+        _green = numpy.frombuffer(pixels, numpy.uint8).reshape(height, width, 4)
+        _green = _green[_top:_top + _rows * step, :_columns * step, 1]
+        luma = _green.reshape(_rows, step, _columns, step).mean(axis=(1, 3))
+    else:
+        luma = [pixels[_y * width * 4 + 1:(_y + 1) * width * 4:4 * step] for _y in range(_top, height, step)]
+    return ScreenFrame(width, height, pixel_format, pixels, luma)
+
+
+def frame_difference(frame: ScreenFrame, other: ScreenFrame):
+    """
+    return mean difference (0-255) of the downsampled frames, inf if their sizes differ, e.g. the screen rotated.
+    """
+    if (frame.width, frame.height) != (other.width, other.height):
+        return math.inf
+    if numpy is not None:
+        return float(numpy.abs(frame.luma - other.luma).mean()) if frame.luma.size else 0.0
+    _total = _count = 0
+    for _row, _other in zip(frame.luma, other.luma):
+        _total += sum(abs(_a - _b) for _a, _b in zip(_row, _other))
+        _count += len(_row)
+    return _total / _count if _count else 0.0
+
+
+def encode_png(frame: ScreenFrame, level: int = 1):
+    """
+    return PNG bytes of the frame, None for RGBX frames, whose alpha may not be set.
+    """
+    if frame.pixel_format != 1:
+        return None
+    _stride = frame.width * 4
+    _raw = b''.join(b'\x00' + frame.pixels[_y * _stride:(_y + 1) * _stride] for _y in range(frame.height))
 
+    def _chunk(kind: bytes, data: bytes):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
 
+    return (b'\x89PNG\r\n\x1a\n' +
+            _chunk(b'IHDR', struct.pack('>IIBBBBB', frame.width, frame.height, 8, 6, 0, 0, 0)) +
+            _chunk(b'IDAT', zlib.compress(_raw, level)) + _chunk(b'IEND', b''))
+
+
+def same_screen(snapshot, other, threshold: float = _FRAME_SETTLE_THRESHOLD_):
+    """
+    return True if two snapshots show the same screen: UiTree compared by digest,
+    ScreenFrame by frame_difference up to threshold. False if one is missing.
+    """
+    if snapshot is None or other is None:
+        return False
+    if isinstance(snapshot, ScreenFrame):
+        return frame_difference(snapshot, other) <= threshold
+    return snapshot.digest == other.digest
+
+
+class ScreenSettle(object):
+    """
+    The last snapshot of a screen waited for to stop changing, by both the sync & async consoles:
+
+        _settle = ScreenSettle(console.dump_ui())
+        wait_until(lambda: _settle.settled(console.dump_ui(refresh=True)), timeout)
+    """
+
+    def __init__(self, snapshot, threshold: float = _FRAME_SETTLE_THRESHOLD_):
+        self.last = snapshot
+        self.threshold = threshold
+
+    def settled(self, snapshot):
+        """
+        take the next snapshot, return True if it's the same screen as the last one.
+        a missing snapshot, e.g. a frame failed, is skipped.
+        """
+        if snapshot is None:
+            return False
+        _same = same_screen(snapshot, self.last, self.threshold)
+        self.last = snapshot
+        return _same
+
+
+def screen_mid_point(screen_size: list):
+    """
+    return the point swipes start from of screen size [width, height]
+    """
+    return [str(screen_size[0] // 2), str(screen_size[1] * 3 // 5)]
+
+
+def swipe_command(mid_point: list, up: bool = True):
+    """
+    return the shell command swiping the screen up or down from mid_point
+    """
+    _x, _y = mid_point[0], int(mid_point[-1])
+    return f'shell input swipe {_x} {_y} {_x} {_y // 2 if up else _y // 2 + _y}'
+
+
+# devices without gzip, frames are streamed from them uncompressed
+_RAW_FRAME_DEVICES_ = set()
+
+
+class AndroidConsole(object):
+    """
+    ADB Operate Console
+    """
+
+    def __init__(self,
+                 device_sn: str = None,
+                 app_name: str = None,
+                 app_actv_name: str = None,
+                 app_run_keyword: str = None,
+                 use_session: bool = True,
+                 use_socket: bool = True):
+        """
+        app_run_keyword (str): keyword to identify app is running.
+        use_session (bool): send 'shell' commands through one persistent adb shell,
+            fork one adb process per command if False.
+        use_socket (bool): talk to the adb server with AdbClient before forking adb processes.
+        """
+        self.sn = device_sn
+        self.name = app_name
+        self.actv_name = app_actv_name
+        self.run_keyword = app_run_keyword
+        self.use_session = use_session
+        self.adb = get_adb_client() if use_socket else None
+        self.ui_cache = get_ui_cache(device_sn)
+        self.profile = get_device_profile(device_sn)
+        # how the screen is waited for to stop changing: 'ui' compares dumps, 'frames' compares screencap frames
+        self.settle_mode = 'ui'
+
+        self.last_output = []
+
+        self.tmp_file = _TMP_XML_FILE_
+        self.screenshot_file_local = _SCREENSHOT_FILE_
+        # the name of screenshot photo saved on the phone
+        self.screenshot_file_phone = f'/sdcard/screen_{random.randint(1000, 9999)}.png'
+
+        # the middle point of the phone screen
+        self.screen_mid_point = self.fetch_mid_of_screen()
+
+    # low level cli for internal using
+    def _send_shell_command(self, command):
+        """
+        send shell command to android device connected
+
+        return True/False, depends on if command is executed successfully.
+        """
+        # operation named by the command, e.g. 'adb.shell.input', 'adb.pull'
+        _words = command.split(maxsplit=2)
+        _op = f'adb.{_words[0]}.{_words[1]}' if _words[0] == 'shell' and len(_words) > 1 else f'adb.{_words[0]}'
+        with _PROFILER_.span(re.sub(r'[^\w.-]', '_', _op)) as _span:
+            _return = self._dispatch_command(command)
+            _span['bytes'] = sum(len(_line) + 1 for _line in self.last_output)
+        return _return
+
+    def _dispatch_command(self, command):
+        """
+        send command by the shell session, the adb server or an adb process, the first one working.
+        """
+        if self.use_session and command.startswith('shell '):
+            _session = get_shell_session(self.sn)
+            if _session is not None:
+                _return, _output = _session.run(command[len('shell '):])
+                if _return >= 0:
+                    self.last_output = _output.split('\n')
+                    return True if _return == 0 else False
+                print('adb shell session failed, fallback to single adb process.')
+
+        if self.adb is not None and command.startswith('shell '):
+            try:
+                _return, _output = self.adb.shell(self.sn, command[len('shell '):])
+                self.last_output = _output.split('\n')
+                return True if _return == 0 else False
+            except (OSError, AdbError) as err:
+                print(err, 'adb server not reachable, fallback to single adb process.')
+
+        return self._send_process_command(command)
+
+    @profiled('adb.exec_out')
+    def _exec_out(self, command: str):
+        """
+        return raw stdout bytes of command run on device, None if failed.
+        """
+        if self.adb is not None:
+            try:
+                return self.adb.exec_out(self.sn, command)
+            except (OSError, AdbError) as err:
+                print(err, 'adb server not reachable, fallback to single adb process.')
+
+        _return = subprocess.run([f'{_ADB_HOME_}/adb', '-s', str(self.sn), 'exec-out', command],
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return _return.stdout if _return.returncode == 0 else None
+
+    @profiled('adb.pull')
+    def _pull(self, remote_file: str, local_file: str = None):
+        """
+        pull file from device to local, return True/False.
+        return the bytes of the file (None if failed) if local_file is None.
+        """
+        if self.adb is not None:
+            try:
+                return self.adb.pull(self.sn, remote_file, local_file)
+            except AdbError as err:
+                print(err, 'pull file failed.')
+                return False if local_file else None
+            except OSError as err:
+                print(err, 'adb server not reachable, fallback to single adb process.')
+
+        if local_file is None:
+            return self._exec_out(f'cat {remote_file}')
+        return self._send_process_command(f'pull {remote_file} {local_file}')
+
+    @profiled('adb.push')
+    def _push(self, data: bytes, remote_file: str):
+        """
+        write data to remote_file on device, return True/False.
+        """
+        if self.adb is not None:
+            try:
+                return self.adb.push(self.sn, data, remote_file)
+            except AdbError as err:
+                print(err, 'push file failed.')
+                return False
+            except OSError as err:
+                print(err, 'adb server not reachable, fallback to single adb process.')
+
+        _local_file = os.path.join(device_tmp_dir(self.sn), os.path.basename(remote_file))
+        with open(_local_file, 'wb') as f:
+            f.write(data)
+        try:
+            return self._send_process_command(f'push {_local_file} {remote_file}')
+        finally:
+            os.remove(_local_file)
+
+    def dump_ui(self, refresh: bool = False):
+        """
+        return UiTree of current screen, shared with other lookups
+        until the screen is changed by an action.
+
+        refresh (bool): ignore the cached snapshot and dump again.
+        """
+        if not refresh:
+            _tree = self.ui_cache.get()
+            if _tree is not None:
+                return _tree
+        else:
+            self.ui_cache.misses += 1
+
+        # the dump is streamed from exec-out into memory and parsed there
+        with _PROFILER_.span('ui.dump') as _span:
+            _data = self._exec_out('uiautomator dump /dev/tty')
+            _span['bytes'] = len(_data) if _data else 0
+        if not _data:
+            print('dump screen txt failed.')
+            return UiTree()
+
+        with _PROFILER_.span('ui.parse'):
+            _tree = UiTree(_data)
+        if _tree:
+            self.ui_cache.put(_tree)
+        return _tree
+
+    def save_ui_dump(self, local_file: str = None):
+        """
+        write the ui hierarchy xml of current screen to local_file (default self.tmp_file)
+        """
+        _tree = self.dump_ui()
+        if not _tree:
+            return False
+        local_file = self.tmp_file if local_file is None else local_file
+        with open(local_file, 'wb' if isinstance(_tree.xml, bytes) else 'w') as f:
+            f.write(_tree.xml)
+        return True
+
+    def invalidate_ui_cache(self):
+        """
+        drop the cached ui snapshot, the next lookup dumps again.
+        """
+        self.ui_cache.invalidate()
+
+    @property
+    def ui_cache_hits(self):
+        return self.ui_cache.hits
+
+    @property
+    def ui_cache_misses(self):
+        return self.ui_cache.misses
+
+    def _send_action_command(self, command):
+        """
+        send command which changes the screen, the cached ui snapshot is dropped.
+        """
+        self.invalidate_ui_cache()
+        return self._send_shell_command(command)
+
+    def _send_process_command(self, command):
+        """
+        send command by forking one adb process, the fallback of the shell session.
+        """
+        # Light on the screen by sending key event 224
+        os.system(f"""{_ADB_HOME_}/adb -s {self.sn} shell input keyevent 224""")
+
+        # the device command is quoted as one argument, so pipes, redirects & quotes
+        # are run by the device shell, same as through the session.
+        if command.startswith('shell '):
+            command = f'shell {shlex.quote(command[len("shell "):])}'
+
+        # sending command to adb shell
+        command = f"""{_ADB_HOME_}/adb -s {self.sn} {command}"""
+
+        # fetching output of the command and storing to class attribute self.last_output
+        # return True or False depends on the return code
+        _output = subprocess.getstatusoutput(command)
+        _return = _output[0]
+        self.last_output = _output[1].split('\n')
+        return True if _return == 0 else False
+
+    def get_point_of_text(self, text: str = None, reverse_order: bool = True, refresh: bool = False,
+                          bottom_most: bool = False):
+        """
+        get touch point x,y value list of text on phone screen
+
+        text (str): 'attr="value"' matches the attribute exactly, 'attr="value' by prefix,
+            '"value"' any attribute exactly, anything else any attribute containing it.
+        reverse_order (bool): take the first match in document order, the last one if False.
+            for looking up the last saved pictures using Wechat
+        refresh (bool): dump the screen again instead of using the cached snapshot.
+        bottom_most (bool): take the lowest match on screen, whatever the document order,
+            e.g. the last message of a chat.
+        """
+        return self.dump_ui(refresh).point_of(text, not reverse_order, bottom_most)
+
+    def read_screen_text(self,
+                         label: str = None,
+                         sub_label: str = None,
+                         read_all: bool = True,
+                         refresh: bool = False):
+        """
+        label (str) - selector of the nodes to read, same as text of get_point_of_text
+        sub_label (str) - read the attributes whose name contains it, e.g. 'text', 'content-desc'
+        refresh (bool) - dump the screen again instead of using the cached snapshot.
+        """
+        label = '' if label is None else label
+        sub_label = '' if sub_label is None else sub_label
+
+        _texts = self.dump_ui(refresh).texts(label, sub_label)
+        if not read_all:
+            return _texts[0] if _texts else ''
+        return ''.join(_text + '\n' for _text in _texts)
+
+    def poll_ui(self, lookup, timeout: float = 5, poll: float = 0.2):
+        """
+        return lookup(UiTree) of the screen as soon as it's something true, the last value if timed out.
+        one lookup only if timeout is 0.
+        """
+        _dumped = [False]
+
+        def _lookup():
+            # the cached snapshot is good for the first lookup only
+            _tree = self.dump_ui(refresh=_dumped[0])
+            _dumped[0] = True
+            return lookup(_tree)
+
+        return wait_until(_lookup, timeout, poll)
+
+    def wait_for_text(self, text: str, timeout: float = 5, reverse_order: bool = True, poll: float = 0.2):
+        """
+        return touch point of text as soon as it's on screen, [] if timed out.
+        one lookup only if timeout is 0.
+        """
+        return self.poll_ui(lambda _tree: _tree.point_of(text, not reverse_order), timeout, poll) or []
+
+    def wait_for_any(self, texts: list, timeout: float = 5, poll: float = 0.2):
+        """
+        return (text, touch point) of the first text of texts on screen, (None, []) if timed out.
+        """
+        _found = self.poll_ui(lambda _tree: _tree.find_any(texts), timeout, poll)
+        return (_found[0], _found[1].point) if _found else (None, [])
+
+    def tap_text(self, text: str, timeout: float = 5, reverse_order: bool = True):
+        """
+        tap text as soon as it's on screen, False if it isn't in timeout seconds.
+        """
+        return self.tap_screen(self.wait_for_text(text, timeout, reverse_order))
+
+    def wait_for_settle(self, timeout: float = 3, poll: float = 0.1):
+        """
+        dump until two dumps in a row are the same, return the last UiTree
+        (settled or not when timed out).
+        frames are compared instead of dumps if settle_mode is 'frames', the screen is dumped once settled.
+        """
+        if self.settle_mode == 'frames' and self.wait_for_frame_settle(timeout, poll) is not None:
+            return self.dump_ui()
+        _settle = ScreenSettle(self.dump_ui())
+        wait_until(lambda: _settle.settled(self.dump_ui(refresh=True)), timeout, poll)
+        return _settle.last
+
+    def swipe_and_settle(self, up: bool = True, timeout: float = 3):
+        """
+        swipe up or down & wait for the list to stop moving.
+
+        return False if the screen didn't change, e.g. the end of the list reached.
+        """
+        if self.settle_mode == 'frames':
+            _frame = self.capture_frame()
+            if _frame is not None:
+                self.swipe_screen_up_down(up, not up)
+                return not same_screen(_frame, self.wait_for_frame_settle(timeout))
+            print('capture frame failed, settle by ui dumps.')
+        _before = self.dump_ui()
+        self.swipe_screen_up_down(up, not up)
+        return not same_screen(_before, self.wait_for_settle(timeout))
+
+    def launch_app(self):
+        """
+        launch application in phone
+        """
+        return self._send_action_command(f'shell am start -n {self.actv_name}')
+
+    def launch_app_monkey(self):
+        return self._send_action_command(f'shell monkey -p {self.name} 1')
+
+    def shutdown_app(self):
+        """
+        shutdown application via actv_name
+        """
+        return self._send_action_command(f'shell am force-stop {self.name}')
+
+    def is_app_inst(self):
+        """
+        return true if application installed, as the device profile knows it.
+        """
+        self.profile.validate(self)
+        return self.name in self.profile.packages
+
+    def is_app_launched(self):
+        """
+        return true if application is running
+        """
+        if self.get_point_of_text('text="权限申请"'):
+            self.tap_screen(self.get_point_of_text('text="取消"'))
+        return self.get_point_of_text(self.run_keyword)
+
+    def return_back(self):
+        """
+        back to last page
+        """
+        return self._send_action_command('shell input keyevent KEYCODE_BACK')
+
+    def return_home(self):
+        """
+        back to home screen
+        """
+        return self._send_action_command('shell input keyevent KEYCODE_HOME')
+
+    def power_on(self):
+        """
+        tap power key
+        """
+        return self._send_action_command('shell input keyevent POWER')
+
+    def wake_screen(self):
+        """
+        Light on the screen by sending key event 224
+        """
+        return self._send_shell_command('shell input keyevent 224')
+
+    def screen_off(self):
+        """
+        turn-off screen
+        """
+        return self._send_action_command('shell input keyevent 223')
+
+    def tap_screen(self, point: list):
+        """
+        touch the pointer on screen
+        """
+        return False if len(point) != 2 else self._send_action_command(f'shell input tap {point[0]} {point[1]}')
+
+    def long_press(self, point: list, secs: float = 0.8):
+        """
+        press the pointer on screen for secs, a swipe not moving
+        """
+        if len(point) != 2:
+            return False
+        return self._send_action_command(
+            f'shell input swipe {point[0]} {point[1]} {point[0]} {point[1]} {int(secs * 1000)}')
+
+    def paste_text(self):
+        return self._send_action_command('shell input keyevent 279')
+
+    def copy_text(self, x: int, y: int):
+        self._send_shell_command('shell input keyevent 278')
+
+    @profiled('ui.swipe')
+    def swipe_screen_up_down(self,
+                             up: bool = True,
+                             down: bool = False):
+        """
+        swipe up or down of the screen
+        """
+        return self._send_action_command(swipe_command(self.screen_mid_point, up))
+
+    @profiled('ui.take_screenshot')
+    def take_screenshot(self, save_local: bool = False, phone_file: str = None):
+        """
+        take screenshot saved on the phone, where Wechat album picks it up.
+
+        save_local (bool): also pull it to self.screenshot_file_local
+        phone_file (str): save to it instead of self.screenshot_file_phone
+        """
+        phone_file = self.screenshot_file_phone if phone_file is None else phone_file
+        if self._send_shell_command(f'shell screencap -p {phone_file}'):
+            return self._pull(phone_file, self.screenshot_file_local) if save_local else True
+        else:
+            return False
+
+    def scan_media_file(self, phone_file: str):
+        """
+        ask media scanner to index the file, so that albums show it at once
+        """
+        return self._send_shell_command(
+            f'shell am broadcast -a android.intent.action.MEDIA_SCANNER_SCAN_FILE -d file://{phone_file}')
+
+    def reveal_phone_files(self, phone_files: list, album_dir: str = '/sdcard'):
+        """
+        move files held out of the album into album_dir & scan them in one command,
+        so that they are the newest pictures of the album. return their paths in album_dir.
+        a file moved already by an earlier call is scanned only.
+        """
+        _files = [f'{album_dir}/{os.path.basename(_file)}' for _file in phone_files]
+        if not _files:
+            return _files
+        _commands = [f'mv -f {shlex.quote(_held)} {shlex.quote(_file)} 2>/dev/null'
+                     for _held, _file in zip(phone_files, _files) if os.path.dirname(_held) != album_dir]
+        _commands += [f'am broadcast -a android.intent.action.MEDIA_SCANNER_SCAN_FILE -d file://{_file}'
+                      for _file in _files]
+        self._send_shell_command(f'shell {"; ".join(_commands)}')
+        return _files
+
+    def remove_phone_files(self, phone_files: list):
+        """
+        delete files on the phone and drop them from media index
+        """
+        if not phone_files:
+            return True
+        _return = self._send_shell_command(f'shell rm -f {" ".join(shlex.quote(_f) for _f in phone_files)}')
+        for _file in phone_files:
+            self.scan_media_file(_file)
+        return _return
+
+    @profiled('ui.capture_screen')
+    def capture_screen(self):
+        """
+        return PNG bytes of current screen streamed from 'exec-out screencap -p',
+        nothing is written on the phone or local. None if failed.
+        """
+        return self._exec_out('screencap -p') or None
+
+    @profiled('ui.capture_frame')
+    def capture_frame(self):
+        """
+        return ScreenFrame of current screen streamed from 'exec-out screencap', None if failed.
+
+        raw frames skip encoding PNG on the phone, the slow part of 'screencap -p',
+        they are gzipped on the phone to stream a few hundred KB instead of 4 bytes per pixel.
+        """
+        _data = None
+        if self.sn not in _RAW_FRAME_DEVICES_:
+            _output = self._exec_out('screencap | gzip -1')
+            try:
+                _data = zlib.decompress(_output, 16 + zlib.MAX_WBITS) if _output else None
+            except zlib.error:
+                _data = None
+            # a failed adb call or a broken stream says nothing of gzip, only output not gzipped does
+            if _output is not None and not _output.startswith(b'\x1f\x8b'):
+                print('gzip not on the phone, frames are streamed uncompressed.')
+                _RAW_FRAME_DEVICES_.add(self.sn)
+        if _data is None:
+            _data = self._exec_out('screencap')
+        return parse_raw_frame(_data)
+
+    def wait_for_frame_settle(self, timeout: float = 3, poll: float = 0.1,
+                              threshold: float = _FRAME_SETTLE_THRESHOLD_):
+        """
+        capture frames until two in a row differ by threshold at most, return the last ScreenFrame
+        (settled or not when timed out), None if frames can't be captured.
+        """
+        _settle = ScreenSettle(self.capture_frame(), threshold)
+        if _settle.last is None:
+            return None
+        wait_until(lambda: _settle.settled(self.capture_frame()), timeout, poll)
+        return _settle.last
+
+    @property
+    def frame_skip(self):
+        """
+        bytes at the beginning of a raw frame left out of comparing frames on the phone: the header & the status bar
+        """
+        if not self.profile.screen_size:
+            return 0
+        _width, _height = self.profile.screen_size
+        return 16 + int(_height * _FRAME_SKIP_TOP_) * _width * 4
+
+    @profiled('ui.take_settled_screenshot')
+    def take_settled_screenshot(self, phone_file: str = None, timeout: float = 3):
+        """
+        wait for the screen to settle by frames & save the settled frame as the screenshot on the phone,
+        the screen isn't captured once more. take_screenshot if the frame can't be saved.
+        """
+        phone_file = self.screenshot_file_phone if phone_file is None else phone_file
+        _frame = self.wait_for_frame_settle(timeout)
+        _png = encode_png(_frame) if _frame is not None else None
+        if _png and self._push(_png, phone_file):
+            return self.scan_media_file(phone_file)
+        return self.take_screenshot(phone_file=phone_file) and self.scan_media_file(phone_file)
+
+    def read_screenshot(self):
+        """
+        return PNG bytes of the last screenshot taken by take_screenshot, None if failed.
+        """
+        return self._pull(self.screenshot_file_phone) or None
+
+    def set_screen_on_secs(self, sec=1):
+        """
+        set the time of screen on
+        """
+        return self._send_shell_command(f'shell settings put system screen_off_timeout {str(int(sec * 59998))}')
+
+    def wait_with_screen_on(self, times=1):
+        """
+        waiting times seconds while keeping screen on,
+        prefer wait_until / wait_for_text which stop as soon as the screen is ready.
+        """
+        # the screen is expected to change while waiting
+        self.invalidate_ui_cache()
+        self.wake_screen()
+        time.sleep(times)
+        return True
+
+    def fetch_mid_of_screen(self):
+        """
+        fetch middle point of screen, from the device profile once it knows the screen size
+        """
+        self.profile.validate(self)
+        if self.profile.screen_size:
+            return screen_mid_point(self.profile.screen_size)
+        self._send_shell_command('shell wm size')
+        return screen_mid_point(parse_screen_size(self.last_output))
+
+    def input_text(self, text: str):
+        """
+        Chinese not supported by ADB
+        """
+        text = pinyin.get(text, format='strip', delimiter='')
+        text = text.replace(' ', '%s')  # sed 's/ /\%s/g'
+        text = text.replace('[_<>|&$;()\"]', '\\&')
+        # sed -e 's/[_<>|&$;()\"]/\/&/g' -e 's/!+/!/g')'
+
+        input_cmd = f"""shell input text '{text}'"""
+        return self._send_action_command(input_cmd)
+
+    def set_ime(self, ime: str):
+        """
+        make ime the input method if installed, return the input method before, None if ime not installed.
+        """
+        if not self._send_shell_command('shell ime list -s') or ime not in self.last_output:
+            return None
+        self._send_shell_command('shell settings get secure default_input_method')
+        _previous = self.last_output[0].strip()
+        if _previous != ime:
+            self._send_shell_command(f'shell ime enable {ime}')
+            self._send_shell_command(f'shell ime set {ime}')
+        return _previous
+
+    def input_unicode(self, text: str):
+        """
+        type text of any language into the focused input box in one command:
+        broadcast to ADBKeyBoard if it's the input method (see set_ime), or copied by Clipper & pasted,
+        typed as pinyin by input_text if neither is on the phone.
+        """
+        _b64 = base64.b64encode(text.encode('utf-8')).decode('ascii')
+        self._send_shell_command('shell settings get secure default_input_method')
+        if self.last_output[0].strip() == _ADB_KEYBOARD_IME_:
+            return self._send_action_command(f'shell am broadcast -a ADB_INPUT_B64 --es msg {_b64}')
+
+        # Clipper answers result=-1, nobody receives it if not installed
+        if self._send_shell_command(f'shell am broadcast -a clipper.set -e text "$(echo {_b64} | base64 -d)"') \
+                and 'result=-1' in '\n'.join(self.last_output):
+            return self.paste_text()
+
+        print('Neither ADBKeyBoard nor Clipper installed, text typed as pinyin.')
+        return self.input_text(text)
+
+
+class ActionStep(NamedTuple):
+    """
+    One step of ActionScript
+    """
+    name: str
+    # shell command run on the phone
+    command: str
+    # fallback(console, args) -> bool, runs the step from the host
+    fallback: object
+
+
+# (device sn, script path) of scripts pushed already
+_PUSHED_SCRIPTS_ = set()
+
+
+def _script_arg(value, args: tuple):
+    """
+    '$1' -> args[0], anything else as it is
+    """
+    if isinstance(value, str) and re.fullmatch(r'\$[1-9]', value):
+        return args[int(value[1:]) - 1]
+    return value
+
+
+class ActionScript(object):
+    """
+    A known sequence of actions compiled into one shell script,
+    pushed to the phone once & run with one 'sh' call.
+
+    Every step prints its exit code: __STEP__ <n> <code>, the script stops at the first failed step.
+    The steps left are run one by one from the host if the script failed.
+
+    Values like '$1' are positional arguments of run(), e.g. tap(['$1', '$2']).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.steps = []
+        self._ui_file = f'{_SCRIPT_DIR_}/relaymsg_{name}_ui.xml'
+        # the step the last run failed at on the phone, None if it passed
+        self.failed_step = None
+
+    def _add(self, name: str, command: str, fallback):
+        self.steps.append(ActionStep(name, command, fallback))
+        return self
+
+    def tap(self, point: list, text: str = None):
+        """
+        text (str): fallback taps text looked up on host instead of the point
+        """
+        if text is not None:
+            return self._add(f'tap {text}', f'input tap {point[0]} {point[1]}',
+                             lambda c, a: c.tap_text(text))
+        return self._add(f'tap {point[0]},{point[1]}', f'input tap {point[0]} {point[1]}',
+                         lambda c, a: c.tap_screen([_script_arg(point[0], a), _script_arg(point[1], a)]))
+
+    def keyevent(self, key: str):
+        return self._add(f'keyevent {key}', f'input keyevent {key}',
+                         lambda c, a: c._send_action_command(f'shell input keyevent {key}'))
+
+    def back(self):
+        return self.keyevent('KEYCODE_BACK')
+
+    def sleep(self, secs: float):
+        return self._add(f'sleep {secs}', f'sleep {secs}', lambda c, a: time.sleep(secs) or True)
+
+    def screencap(self, phone_file: str):
+        return self._add(f'screencap {phone_file}', f'screencap -p {phone_file}',
+                         lambda c, a: c.take_screenshot(phone_file=_script_arg(phone_file, a)))
+
+    def scan_media(self, phone_file: str):
+        return self._add(f'scan {phone_file}',
+                         f'am broadcast -a android.intent.action.MEDIA_SCANNER_SCAN_FILE -d file://{phone_file}'
+                         ' >/dev/null',
+                         lambda c, a: c.scan_media_file(_script_arg(phone_file, a)))
+
+    def wait_text(self, text: str, timeout: float = 5, poll: float = 0.3, fallback=None):
+        """
+        guard: wait until text (a plain substring of the dump) is on screen, the step fails if it isn't.
+        """
+        _tries = max(1, int(timeout / poll))
+        command = (f'_ok=1; _i=0; while [ $_i -lt {_tries} ]; do '
+                   f'if uiautomator dump {self._ui_file} >/dev/null 2>&1 && grep -qF {shlex.quote(text)} {self._ui_file}; '
+                   f'then _ok=0; break; fi; _i=$((_i+1)); sleep {poll}; done; (exit $_ok)')
+        return self._add(f'wait {text}', command,
+                         fallback or (lambda c, a: bool(c.wait_for_text(text, timeout))))
+
+    def save_ui(self, phone_file: str):
+        """
+        keep the last dump of the guard before at phone_file
+        """
+        return self._add(f'save ui {phone_file}', f'cp {self._ui_file} {phone_file}',
+                         lambda c, a: c._send_shell_command(f'shell uiautomator dump {_script_arg(phone_file, a)}'))
+
+    def wait_settle(self, timeout: float = 3, poll: float = 0.2):
+        """
+        guard: wait until two dumps in a row are the same
+        """
+        _tries = max(1, int(timeout / poll))
+        _prev = f'{self._ui_file}.prev'
+        command = (f'_ok=1; _i=0; uiautomator dump {self._ui_file} >/dev/null 2>&1; '
+                   f'while [ $_i -lt {_tries} ]; do cp {self._ui_file} {_prev}; sleep {poll}; '
+                   f'uiautomator dump {self._ui_file} >/dev/null 2>&1; '
+                   f'if cmp -s {self._ui_file} {_prev}; then _ok=0; break; fi; _i=$((_i+1)); done; (exit $_ok)')
+        return self._add('wait settle', command, lambda c, a: bool(c.wait_for_settle(timeout)))
+
+    def wait_frame_settle(self, skip: int = 0, timeout: float = 3, poll: float = 0.2):
+        """
+        guard: wait until two raw frames in a row are the same past their first skip bytes, see frame_skip.
+        the host compares downsampled frames instead if the step is run from there.
+        """
+        _tries = max(1, int(timeout / poll))
+        _frame = f'{_SCRIPT_DIR_}/relaymsg_{self.name}_frame.raw'
+        command = (f'_ok=1; _i=0; screencap {_frame}; '
+                   f'while [ $_i -lt {_tries} ]; do mv {_frame} {_frame}.prev; sleep {poll}; screencap {_frame}; '
+                   f'if cmp -s {_frame} {_frame}.prev {skip} {skip}; then _ok=0; break; fi; _i=$((_i+1)); done; '
+                   f'rm -f {_frame} {_frame}.prev; (exit $_ok)')
+        return self._add('wait frame settle', command, lambda c, a: c.wait_for_frame_settle(timeout) is not None)
+
+    def compile(self):
+        lines = ['#!/system/bin/sh', f'# relaymsg action script: {self.name}']
+        for _n, _step in enumerate(self.steps):
+            lines.append(f'# {_step.name}')
+            lines.append(f'{{ {_step.command}\n}}; _rc=$?; echo "__STEP__ {_n} $_rc"; [ $_rc -eq 0 ] || exit $_rc')
+        return '\n'.join(lines) + '\n'
+
+    @property
+    def path(self):
+        """
+        script path on phone, named by the content, so a changed script is pushed again
+        """
+        _digest = hashlib.md5(self.compile().encode('utf-8')).hexdigest()[:10]
+        return f'{_SCRIPT_DIR_}/relaymsg_{self.name}_{_digest}.sh'
+
+    def run(self, console, *args, fallback: bool = True):
+        """
+        run the script on the phone of console with one adb round trip.
+
+        return exit codes of steps, None for steps not run.
+        the steps from the first failed one are run one by one from the host if fallback.
+        """
+        path = self.path
+        command = f'sh {path} {" ".join(shlex.quote(str(_arg)) for _arg in args)}'
+        if (console.sn, path) not in _PUSHED_SCRIPTS_:
+            command = (f"[ -f {path} ] || cat > {path} <<'__RELAYMSG_EOF__'\n"
+                       f"{self.compile()}__RELAYMSG_EOF__\n{command}")
+
+        results = [None] * len(self.steps)
+        console.invalidate_ui_cache()
+        with _PROFILER_.span(f'script.{self.name}'):
+            console._send_shell_command(f'shell {command}')
+        for _line in console.last_output:
+            _match = re.match(r'__STEP__ (\d+) (\d+)', _line.strip())
+            if _match and int(_match.group(1)) < len(results):
+                results[int(_match.group(1))] = int(_match.group(2))
+
+        if any(_result is not None for _result in results):
+            _PUSHED_SCRIPTS_.add((console.sn, path))
+
+        failed = next((_n for _n, _result in enumerate(results) if _result != 0), None)
+        self.failed_step = failed
+        if failed is None:
+            return results
+
+        print(f'Action script {self.name} failed at step {failed}: {self.steps[failed].name}')
+        if fallback:
+            console.invalidate_ui_cache()
+            with _PROFILER_.span(f'script.{self.name}.fallback') as _span:
+                _span['retries'] = len(self.steps) - failed
+                for _n in range(failed, len(self.steps)):
+                    results[_n] = 0 if self.steps[_n].fallback(console, args) else 1
+                    if results[_n]:
+                        break
+        return results
+
+    @staticmethod
+    def passed(results: list):
+        return all(_result == 0 for _result in results)
+
+
+class FlowStep(NamedTuple):
+    """
+    One step of Flow: find target, act on it, wait for expect
+    """
+    name: str
+    # 'tap', 'long_press', 'keyevent', 'shell', 'swipe', 'sleep', 'screenshot', 'call' or 'wait' (no action)
+    action: str
+    # selector looked up on screen or a point for taps, the key, command, seconds, swipe up or not,
+    # phone file of the screenshot, callable(console, values, params) for calls & points known at run time
+    target: object
+    # selector or tuple of selectors, the first one on screen after the action passes the step
+    expect: object
+    # seconds to look up target & to wait for expect
+    timeout: float
+    # the flow goes on if the step failed, the step is skipped if its target isn't on screen
+    optional: bool
+    # the action is done again at most retries times while expect doesn't show up
+    retries: int
+    # the point of target is kept in the device profile, later runs tap it without looking it up
+    learn: bool
+    # calls not using the phone run on a thread beside the steps after them, joined at the end of the flow
+    background: bool
+    # recover(console) -> bool, run from the host if expect didn't show up, e.g. a permission dialog
+    recover: object
+
+
+class FlowResult(NamedTuple):
+    """
+    What Flow.run did
+    """
+    passed: bool
+    # name of the step the flow failed at, None if passed
+    failed_step: str
+    # step name -> value of the step: point tapped, selector expected or what the call returned
+    values: dict
+    # (step name, 'host', 'script', 'background' or 'skipped', passed, seconds) in the order run
+    trace: list
+
+
+# actions sent as the commands of an ActionScript once their points are known
+_FLOW_SCRIPT_ACTIONS_ = ('tap', 'keyevent', 'shell', 'sleep')
+
+
+class Flow(object):
+    """
+    A declarative sequence of steps automating an app:
+
+        flow = Flow('wechat_album')
+        flow.tap('text="相册"', expect='text="原图"', learn=True)
+        flow.tap('text="原图"')
+        flow.run(wechat)
+
+    Selectors, commands & phone files may name parameters of run(), e.g. 'text="{company}"'.
+
+    run() looks at what the steps need before doing them:
+    - a selector expected by the step before is tapped at the point seen then, without dumping again
+    - lookups & expectations share the cached dumps of the console, only actions drop them
+    - a run of steps whose points are known (given, or learned by an earlier run) is sent as one
+      ActionScript, taps merged into one adb round trip & expectations checked on the phone.
+      the host takes over from the step the script failed at, the points it used are learned again.
+    - background calls run on threads beside the steps after them
+    Every step is a span of the profiler: flow.<flow name>.<step name>.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.steps = []
+
+    def step(self, name: str, action: str, target=None, expect=None, timeout: float = 5, optional: bool = False,
+             retries: int = 0, learn: bool = False, background: bool = False, recover=None):
+        self.steps.append(FlowStep(name, action, target, expect, timeout, optional, retries, learn, background,
+                                   recover))
+        return self
+
+    def tap(self, target, expect=None, name: str = None, **options):
+        """
+        target: selector, point or callable(console, values, params) returning a point
+        """
+        return self.step(name or (target if isinstance(target, str) else 'tap'), 'tap', target, expect, **options)
+
+    def long_press(self, target, expect=None, name: str = None, **options):
+        return self.step(name or f'long press {target}', 'long_press', target, expect, **options)
+
+    def keyevent(self, key: str, expect=None, name: str = None, **options):
+        return self.step(name or f'keyevent {key}', 'keyevent', key, expect, **options)
+
+    def back(self, expect=None, **options):
+        return self.keyevent('KEYCODE_BACK', expect, 'back', **options)
+
+    def shell(self, name: str, command: str, expect=None, **options):
+        return self.step(name, 'shell', command, expect, **options)
+
+    def swipe(self, up: bool = True, expect=None, name: str = None, **options):
+        """
+        the step fails if the list didn't move, see AndroidConsole.swipe_and_settle
+        """
+        return self.step(name or ('swipe up' if up else 'swipe down'), 'swipe', up, expect, **options)
+
+    def sleep(self, secs: float):
+        return self.step(f'sleep {secs}', 'sleep', secs)
+
+    def screenshot(self, phone_file: str = None, name: str = 'screenshot', **options):
+        """
+        screenshot once the screen settled, by frames if the console settles by them
+        """
+        return self.step(name, 'screenshot', phone_file, **options)
+
+    def call(self, name: str, func, expect=None, **options):
+        """
+        func(console, values, params) -> value, a false value fails the step
+        """
+        return self.step(name, 'call', func, expect, **options)
+
+    def wait(self, expect, name: str = None, **options):
+        return self.step(name or f'wait {expect}', 'wait', None, expect, **options)
+
+    @staticmethod
+    def _format(value, params: dict):
+        return value.format_map(params) if isinstance(value, str) and params and '{' in value else value
+
+    def _learned_point(self, console, step: FlowStep, params: dict):
+        if not step.learn or not isinstance(step.target, str):
+            return None
+        return console.profile.points(console.name).get(self._format(step.target, params))
+
+    def _scriptable(self, console, step: FlowStep, params: dict):
+        """
+        return True if step can be a command of an ActionScript: nothing to look up on the host first.
+        """
+        if step.action not in _FLOW_SCRIPT_ACTIONS_ or step.optional or step.retries or step.background:
+            return False
+        if step.expect is not None and (not isinstance(step.expect, str) or re.search(r'[&<>\']', step.expect)):
+            return False
+        if step.action != 'tap':
+            return True
+        return isinstance(step.target, (list, tuple)) or self._learned_point(console, step, params) is not None
+
+    def _script(self, console, steps: list, run: dict):
+        """
+        return (ActionScript of steps, the step of every command of it),
+        the host fallback of every command is its part of the step.
+        the expectation of the last step of the flow is left to the host, its dump is reused after the flow.
+        """
+        params = run['params']
+        script = ActionScript(f'flow_{self.name}')
+        owners = []
+        for _step in steps:
+            _target = self._format(_step.target, params)
+            if _step.action == 'tap':
+                _point = _target if isinstance(_target, (list, tuple)) else self._learned_point(console, _step, params)
+                script._add(f'tap {_step.name}', f'input tap {_point[0]} {_point[1]}',
+                            lambda c, a, _step=_step: bool(self._act(c, _step, run)))
+            elif _step.action == 'keyevent':
+                script.keyevent(_target)
+            elif _step.action == 'shell':
+                script._add(_step.name, _target, lambda c, a, _step=_step: bool(self._act(c, _step, run)))
+            else:
+                script.sleep(_target)
+            if _step.expect is not None and _step is not self.steps[-1]:
+                script.wait_text(self._format(_step.expect, params), _step.timeout,
+                                 fallback=lambda c, a, _step=_step: self._guard(c, _step, run))
+            owners.extend([_step] * (len(script.steps) - len(owners)))
+        return script, owners
+
+    def _act(self, console, step: FlowStep, run: dict):
+        """
+        do the action of step from the host, return its value, a false value if failed.
+        """
+        params = run['params']
+        _target = self._format(step.target, params)
+        _seen, run['seen'] = run['seen'], None
+        if step.action in ('tap', 'long_press'):
+            if callable(_target):
+                _point = _target(console, run['values'], params)
+            elif isinstance(_target, str):
+                # the expectation just before saw it, nothing acted since
+                if _seen is not None and _seen[0] == _target:
+                    _point = _seen[1]
+                else:
+                    _point = console.wait_for_text(_target, 0 if step.optional else step.timeout)
+                if _point and step.learn:
+                    _points = console.profile.points(console.name)
+                    if _points.get(_target) != _point:
+                        _points[_target] = _point
+                        console.profile.save()
+            else:
+                _point = list(_target)
+            if not _point:
+                return _point
+            _done = console.tap_screen(_point) if step.action == 'tap' else console.long_press(_point)
+            return _point if _done else None
+        if step.action == 'keyevent':
+            return console._send_action_command(f'shell input keyevent {_target}')
+        if step.action == 'shell':
+            return console._send_action_command(f'shell {_target}')
+        if step.action == 'swipe':
+            return console.swipe_and_settle(up=bool(_target))
+        if step.action == 'sleep':
+            console.invalidate_ui_cache()
+            time.sleep(_target)
+            return True
+        if step.action == 'screenshot':
+            if console.settle_mode == 'frames':
+                return console.take_settled_screenshot(_target)
+            console.wait_for_settle()
+            _target = console.screenshot_file_phone if _target is None else _target
+            # the album only shows the screenshot once it's scanned
+            return console.take_screenshot(phone_file=_target) and console.scan_media_file(_target)
+        if step.action == 'call':
+            return _target(console, run['values'], params)
+        return True
+
+    def _expect(self, console, step: FlowStep, run: dict):
+        """
+        wait for expect of step, recover once if it doesn't show up. return True if it did.
+        """
+        if step.expect is None:
+            return True
+        _expects = [self._format(_expect, run['params'])
+                    for _expect in ((step.expect,) if isinstance(step.expect, str) else step.expect)]
+        _text, _point = console.wait_for_any(_expects, step.timeout)
+        if _text is None and step.recover is not None and step.recover(console):
+            # what the recovery ended at isn't known, look it up again
+            _text, _point = console.wait_for_any(_expects, step.timeout)
+        run['seen'] = (_text, _point) if _text is not None else None
+        return _text is not None
+
+    def _guard(self, console, step: FlowStep, run: dict):
+        """
+        expectation of step from the host after the script missed it,
+        a learned point may be stale: the target is looked up & acted on once more.
+        """
+        if self._expect(console, step, run):
+            return True
+        if self._learned_point(console, step, run['params']) is None:
+            return False
+        print(f'Learned point of {step.name} is stale, look it up again.')
+        return bool(self._act(console, step, run)) and self._expect(console, step, run)
+
+    def _run_step(self, console, step: FlowStep, run: dict):
+        """
+        run step from the host, return True if it passed or is optional.
+        """
+        if step.background:
+            run['futures'][step.name] = (run['executor'].submit(step.target, console, run['values'], run['params']),
+                                         len(run['trace']), time.time())
+            run['trace'].append((step.name, 'background', True, 0.0))
+            return True
+
+        _started_at = time.time()
+        _value, _passed, _how = None, False, 'host'
+        _op = re.sub(r'[^\w.-]', '_', f'flow.{self.name}.{step.name}')
+        with _PROFILER_.span(_op) as _span:
+            for _try in range(step.retries + 1):
+                _span['retries'] = _try
+                _value = self._act(console, step, run)
+                if not _value:
+                    if step.optional and step.action in ('tap', 'long_press') and isinstance(step.target, str):
+                        _how = 'skipped'
+                    continue
+                if self._expect(console, step, run):
+                    _passed = True
+                    break
+        if _passed:
+            run['values'][step.name] = _value
+        run['trace'].append((step.name, _how, _passed, time.time() - _started_at))
+        return _passed or step.optional
+
+    def _run_script(self, console, steps: list, run: dict):
+        """
+        run steps as one ActionScript, return the step failed, None if they passed.
+        """
+        _started_at = time.time()
+        script, owners = self._script(console, steps, run)
+        run['seen'] = None
+        results = script.run(console)
+        failed = next((owners[_n] for _n, _result in enumerate(results) if _result != 0), None)
+        if failed is None and steps[-1] is self.steps[-1] and not self._expect(console, steps[-1], run):
+            failed = steps[-1]
+        if script.failed_step is not None and failed is not None:
+            # a guard didn't see what the points promised even from the host, learn them again next time
+            _points = console.profile.points(console.name)
+            for _step in steps:
+                if _step.learn and isinstance(_step.target, str):
+                    _points.pop(self._format(_step.target, run['params']), None)
+            console.profile.save()
+        _secs = (time.time() - _started_at) / len(steps)
+        for _step in steps:
+            _passed = _step is not failed and \
+                all(_result == 0 for _owner, _result in zip(owners, results) if _owner is _step)
+            if _passed:
+                run['values'][_step.name] = True
+            run['trace'].append((_step.name, 'script', _passed, _secs))
+        return failed
+
+    def run(self, console, **params):
+        """
+        run the steps on the phone of console, return FlowResult.
+
+        params: values of the names in selectors, commands & phone files, passed to calls as well
+        """
+        run = {'params': params, 'values': {}, 'trace': [], 'seen': None, 'futures': {}, 'executor': None}
+        if any(_step.background for _step in self.steps):
+            run['executor'] = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix=self.name)
+
+        failed = None
+        try:
+            with _PROFILER_.span(f'flow.{self.name}'):
+                _n = 0
+                while _n < len(self.steps):
+                    _batch = []
+                    while _n + len(_batch) < len(self.steps) and \
+                            self._scriptable(console, self.steps[_n + len(_batch)], params):
+                        _batch.append(self.steps[_n + len(_batch)])
+                    # one command alone is no faster as a script
+                    if len(_batch) + sum(_step.expect is not None for _step in _batch) >= 2:
+                        _failed = self._run_script(console, _batch, run)
+                        if _failed is not None:
+                            failed = _failed.name
+                            break
+                        _n += len(_batch)
+                        continue
+                    if not self._run_step(console, self.steps[_n], run):
+                        failed = self.steps[_n].name
+                        break
+                    _n += 1
+        finally:
+            for _name, (_future, _index, _started_at) in run['futures'].items():
+                try:
+                    run['values'][_name] = _future.result()
+                except Exception as err:
+                    print(err, f'background step {_name} failed.')
+                    run['values'][_name] = None
+                run['trace'][_index] = (_name, 'background', bool(run['values'][_name]), time.time() - _started_at)
+                if not run['values'][_name] and failed is None and \
+                        not next(_step.optional for _step in self.steps if _step.name == _name):
+                    failed = _name
+            if run['executor'] is not None:
+                run['executor'].shutdown()
+
+        if failed is not None:
+            print(f'Flow {self.name} failed at step: {failed}')
+        return FlowResult(failed is None, failed, run['values'], run['trace'])
+
+
+class ContactIndex(object):
+    """
+    Where Wechat contacts were found last time, saved across runs:
+
+        {user: {'source': 'contacts', 'swipes': 3, 'point': ['540', '800'], 'updated': 1675214400}}
+
+    source is 'contacts' (found after swipes on contact page) or 'search' (found by search box).
+    """
+
+    def __init__(self, device_sn: str = None, state_dir: str = _STATE_DIR_):
+        self.file = os.path.join(state_dir, f'wechat_contacts_{device_sn}.json')
+        self.entries = {}
+        try:
+            with open(self.file, 'r') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError) as err:
+            if not isinstance(err, FileNotFoundError):
+                print(err, 'wechat contact index broken, reset.')
+
+    def get(self, user: str):
+        return self.entries.get(user)
+
+    def learn(self, user: str, source: str, swipes: int = 0, point: list = None):
+        self.entries[user] = {'source': source, 'swipes': swipes, 'point': point or [], 'updated': int(time.time())}
+        self._save()
+
+    def forget(self, user: str):
+        if self.entries.pop(user, None) is not None:
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        with open(self.file + '.tmp', 'w') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        os.replace(self.file + '.tmp', self.file)
+
+
+class Wechat(AndroidConsole):
+    """
+    Wechat operate console
+    """
+
+    def __init__(self, device_sn):
+        app_name = 'com.tencent.mm'
+        app_actv_name = 'com.tencent.mm/.ui.LauncherUI'
+        app_run_keyword = '"通讯录"'
+        AndroidConsole.__init__(self, device_sn, app_name, app_actv_name, app_run_keyword)
+        self.contact_index = ContactIndex(device_sn)
+        # points of album widgets tapped, the album is sent by one action script once all known,
+        # kept in the device profile until Wechat is updated
+        self.album_points = self.profile.points(self.name)
+
+    def launch_wechat(self):
+        return self.launch_app()
+
+    def kill_wechat(self):
+        return self.shutdown_app()
+
+    @profiled('wechat.return_main_page')
+    def return_wechat_main_page(self, try_times: int = 10):
+        for _ in range(try_times):
+            if self.wait_for_text('"通讯录"', timeout=1):
+                break
+            self.return_back()
+        return self.tap_text('"微信"')
+
+    def is_wechat_running(self):
+        return self.is_app_launched()
+
+    @profiled('wechat.chat_with_user')
+    def chat_with_user(self,
+                       user_profile_name: str,
+                       select_input_box: bool = True,
+                       try_times: int = 10,
+                       send_msg_label: str = 'text="发消息"',
+                       use_search: bool = False):
+        """
+        open the chat with user, where the user was found last time is tried first.
+
+        try_times (int): swipes at most on contact page
+        use_search (bool): find the user by search box before swiping contact page
+        """
+        # make sure Wechat is running at foreground
+        if not self.is_wechat_running():
+            self.launch_wechat()
+            self.wait_for_text(self.run_keyword, timeout=10)
+        user = user_profile_name
+        # ADB dump text
+        user_profile_name = f'''"{user_profile_name}"'''
+
+        # search user at current page
+        user_point = self.get_point_of_text(user_profile_name)
+        if not user_point:
+            _entry = self.contact_index.get(user)
+            if _entry is not None and _entry.get('source') == 'search':
+                use_search = True
+            elif _entry is not None:
+                user_point = self._find_user_at(user_profile_name, _entry.get('swipes', 0))
+                if not user_point:
+                    print(f'Cached position of user {user} is stale, look up again.')
+                    self.contact_index.forget(user)
+
+        if not user_point and use_search:
+            user_point = self._find_user_by_search(user)
+            if user_point:
+                self.contact_index.learn(user, 'search', point=user_point)
+
+        if not user_point:  # search user in 'contact' page
+            user_point, count = self._find_user_in_contacts(user_profile_name, try_times)
+            if user_point:
+                self.contact_index.learn(user, 'contacts', count, user_point)
+
+        if not user_point:
+            raise ValueError(f'User [{user_profile_name}] not found error.')
+        else:
+            self.tap_screen(user_point)
+            # contact page shows profile first, chat list & search result open the chat directly
+            _text, _point = self.wait_for_any([send_msg_label, '"切换到按住说话"', 'android.widget.EditText'])
+            _return = self.tap_screen(_point) if _text == send_msg_label else bool(_point)
+            if select_input_box:
+                return self.tap_text('android.widget.EditText')
+            else:
+                return _return
+
+    def _open_contacts(self):
+        self.return_wechat_main_page()
+        return self.tap_text('通讯录')
+
+    def _contacts_to_top(self, try_times: int = 10):
+        """
+        open contact page & swipe it back to the top, the page keeps its position.
+        """
+        self._open_contacts()
+        for _ in range(try_times):
+            if not self.swipe_and_settle(up=False):
+                break
+
+    def _find_user_at(self, user_profile_name: str, swipes: int):
+        """
+        jump to the cached swipe count of contact page from its top, return point of user, [] if not there.
+        """
+        self._contacts_to_top()
+        # the list is expected to move as it did last time, don't check it between swipes
+        for _ in range(swipes):
+            self.swipe_screen_up_down()
+        if swipes:
+            self.wait_for_settle()
+        return self.get_point_of_text(user_profile_name)
+
+    def _find_user_in_contacts(self, user_profile_name: str, try_times: int = 10):
+        """
+        swipe contact page from the top until user found, return (point of user, swipes).
+        """
+        self._contacts_to_top(try_times)
+
+        count = 0
+        with _PROFILER_.span('wechat.find_user_in_contacts') as _span:
+            while True:
+                user_point = self.wait_for_text(user_profile_name, timeout=1 if count == 0 else 0)
+                if user_point or count >= try_times:
+                    return user_point, count
+                if not self.swipe_and_settle():
+                    print('The end of contact list reached.')
+                    return user_point, count
+                count += 1
+                _span['retries'] = count
+
+    def _find_user_by_search(self, user: str):
+        """
+        type the name in search box of main page, return point of the user in result, [] if not found.
+        """
+        self.return_wechat_main_page()
+        if not self.tap_text('content-desc="搜索"', timeout=2):
+            return []
+        # Chinese not supported by ADB, Wechat search matches the pinyin as well
+        self.input_text(user)
+        return self.wait_for_text(f'text="{user}"', timeout=3)
+
+    def _pass_album_permission(self):
+        """
+        allow album permission if asked, True once the album shows up.
+        """
+        # the permission dialog shows up only before it's allowed once
+        _text, _point = self.wait_for_any(['text="去授权"', 'text="原图"'])
+        if _text == 'text="去授权"':
+            self.tap_screen(_point)
+            self.tap_text('text="总是允许"')
+            return bool(self.wait_for_text('text="原图"'))
+        return _text is not None
+
+    def _select_last_pics(self, count: int):
+        """
+        tick the last count pictures of the album oldest first, learn where the checkboxes are.
+        return the points ticked.
+        """
+        # the album lists the newest picture first in reading order, checkboxes don't move while selecting
+        self.wait_for_text('class="android.widget.CheckBox"')
+        tree = self.dump_ui()
+        checkboxes = [_node for _node in tree.spatial.in_viewport(fully=False)
+                      if _node.class_name == 'android.widget.CheckBox']
+        checkboxes = sorted(checkboxes, key=lambda _node: (_node.bounds[1], _node.bounds[0]))[:_WECHAT_MAX_PICS_]
+        if self.album_points.get('checkboxes') != [_checkbox.point for _checkbox in checkboxes]:
+            self.album_points['checkboxes'] = [_checkbox.point for _checkbox in checkboxes]
+            self.profile.save()
+        checkboxes = checkboxes[:count]
+        if len(checkboxes) < count:
+            print(f'Only {len(checkboxes)} pictures found in album.')
+        for _checkbox in reversed(checkboxes):
+            self.tap_screen(_checkbox.point)
+        return [_checkbox.point for _checkbox in checkboxes]
+
+    def _album_flow(self, count: int, try_times: int = 10):
+        """
+        return Flow opening album of current chat & sending the last count pictures with original quality.
+
+        it runs as one action script once the points of the album widgets & checkboxes are learned.
+        """
+        flow = Flow(f'wechat_album_{count}')
+        flow.tap('content-desc="更多功能按钮', expect='text="相册"', learn=True)
+        flow.tap('text="相册"', expect='text="原图"', learn=True, recover=lambda c: c._pass_album_permission())
+        flow.tap('text="原图"', learn=True)
+        checkboxes = self.album_points.get('checkboxes', [])
+        if len(checkboxes) >= count:
+            for _n in reversed(range(count)):
+                flow.tap(checkboxes[_n], expect='text="发送' if _n == 0 else None, name=f'picture {_n + 1}',
+                         timeout=try_times)
+        else:
+            flow.call('pictures', lambda c, v, p: c._select_last_pics(count))
+        flow.tap('text="发送', expect='"切换到按住说话"', learn=True, timeout=try_times)
+        return flow
+
+    def send_last_pic(self, user_profile_name: str, try_times: int = 10):
+        """
+        try_times (int): seconds to wait for the send button
+        """
+        return self.send_last_pics(user_profile_name, 1, try_times)
+
+    @profiled('wechat.send_last_pics')
+    def send_last_pics(self, user_profile_name: str, count: int = 1, try_times: int = 10):
+        """
+        send the last count pictures of the album in one send, oldest first.
+        count is limited by _WECHAT_MAX_PICS_
+        try_times (int): seconds to wait for the send button
+        """
+        count = min(count, _WECHAT_MAX_PICS_)
+        if count <= 0:
+            return False
+        self.chat_with_user(user_profile_name, select_input_box=False)
+
+        if count == 1:
+            print(f'Try send last picture to user {user_profile_name}')
+        else:
+            print(f'Try send last {count} pictures to user {user_profile_name}')
+
+        result = self._album_flow(count, try_times).run(self)
+        if not result.passed and 'checkboxes' in self.album_points:
+            # the checkboxes aren't guarded one by one, find them again next time
+            del self.album_points['checkboxes']
+            self.profile.save()
+        return result.passed
+
+    @profiled('wechat.send_msg')
+    def send_msg(self, user_profile_name: str, msg: str = None):
+        _return = self.send_text(user_profile_name, [msg]) == 1
+        print('Done')
+        return _return
+
+    @profiled('wechat.send_text')
+    def send_text(self, user_profile_name: str, texts: list):
+        """
+        send texts to user, one Wechat message each, typed by input_unicode with ADBKeyBoard
+        as the input method while sending. return number of texts sent, they are sent in order.
+        """
+        if not self.chat_with_user(user_profile_name):
+            return 0
+        _previous = self.set_ime(_ADB_KEYBOARD_IME_)
+        count = 0
+        try:
+            for _text in texts:
+                if not self.input_unicode(_text):
+                    break
+                # the send button shows up once the input box isn't empty, the more button once sent
+                if not self.tap_text('text="发送"') or not self.wait_for_text('content-desc="更多功能按钮'):
+                    break
+                count += 1
+        finally:
+            if _previous and _previous != _ADB_KEYBOARD_IME_:
+                self.set_ime(_previous)
+        print(f'{count} of {len(texts)} texts sent to user {user_profile_name}')
+        return count
+
+    @profiled('wechat.forward_last_msgs')
+    def forward_last_msgs(self, targets: list, count: int = 1, try_times: int = 10):
+        """
+        forward the last count messages of the chat on screen to all targets in one pass:
+        long press the last message, 多选 it & the ones above, 转发 one by one (逐条转发)
+        and pick the targets in the multi-select chat picker, recent chats first, searched if not there.
+
+        return the targets forwarded to, the ones not found are left out.
+        try_times (int): swipes at most to select count messages
+        """
+        if not targets or count <= 0:
+            return []
+
+        spatial = self.dump_ui().spatial
+        _lists = spatial.in_viewport(flag='scrollable')
+        _list = max(_lists, key=lambda _node: (_node.bounds[2] - _node.bounds[0]) * (_node.bounds[3] - _node.bounds[1]),
+                    default=None)
+        # messages fully shown by the chat list, not the ones under the title or the input bar
+        _last = spatial.bottom_most(spatial.in_viewport(_list.bounds if _list else None, flag='long-clickable'))
+        if _last is None:
+            print('No message to forward found in chat.')
+            return []
+        self.long_press(_last.point)
+        if not self.tap_text('"多选"'):
+            return []
+
+        # the message pressed is selected already, the others are above it
+        selected = 1
+        for _ in range(try_times):
+            if selected >= count:
+                break
+            _spatial = self.dump_ui().spatial
+            _boxes = sorted(_spatial.in_viewport(_list.bounds if _list else None, flag='checkable'),
+                            key=lambda _node: -_node.center[1])
+            for _box in _boxes:
+                if selected >= count:
+                    break
+                if not _box.has_flag('checked'):
+                    self.tap_screen(_box.point)
+                    selected += 1
+            if selected < count and not self.swipe_and_settle(up=False):
+                break
+        if selected < count:
+            print(f'Only {selected} of {count} messages selected to forward.')
+
+        if not self.tap_text('"转发"'):
+            return []
+        # pictures forwarded one by one stay pictures, merged they are a chat record
+        _text, _point = self.wait_for_any(['"逐条转发"', '"多选"'])
+        if _text == '"逐条转发"':
+            self.tap_screen(_point)
+        if not self.tap_text('"多选"'):
+            return []
+
+        forwarded = []
+        _previous_ime = None
+        try:
+            for _target in targets:
+                _point = self.get_point_of_text(f'"{_target}"')
+                if not _point and self.tap_text('"搜索"', timeout=2):
+                    if _previous_ime is None:
+                        _previous_ime = self.set_ime(_ADB_KEYBOARD_IME_) or ''
+                    self.input_unicode(_target)
+                    _found = self.wait_for_text(f'"{_target}"', timeout=3)
+                    # the search box shows the target too
+                    _results = [_node for _node in self.dump_ui().find(f'"{_target}"')
+                                if _node.class_name != 'android.widget.EditText']
+                    _point = _results[0].point if _found and _results else None
+                    if not _point:
+                        self.return_back()
+                if _point:
+                    self.tap_screen(_point)
+                    forwarded.append(_target)
+                else:
+                    print(f'User [{_target}] not found to forward to.')
+        finally:
+            if _previous_ime and _previous_ime != _ADB_KEYBOARD_IME_:
+                self.set_ime(_previous_ime)
+
+        if not forwarded or not self.tap_text('text="完成') or not self.tap_text('text="发送"'):
+            self.return_wechat_main_page()
+            return []
+        self.wait_for_text('"切换到按住说话"')
+        return forwarded
+
+
+class DingTalk(AndroidConsole):
+    """
+    Check in with DingTalk & tell a Wechat user, the steps are the flow of _check_in_flow.
+    """
+
+    def __init__(self, devID, coName, waitSecs=None):
+        """
+        coName (str): the company checked in for, switched to if DingTalk shows another one
+        waitSecs (int): seconds to wait before checking in, random 60-600 by default
+        """
+        self.devID = devID
+        self.coName = coName
+        self.waitSecs = random.randint(60, 600) if waitSecs is None else waitSecs
+        AndroidConsole.__init__(self, self.devID, 'com.alibaba.android.rimet',
+                                'com.alibaba.android.rimet/.biz.LaunchHomeActivity',
+                                'package="com.alibaba.android.rimet"')
+
+    def getCurrentCompany(self):
+        """
+        return the company shown by the work console, '' if not there
+        """
+        orgNode = self.dump_ui().find_one('resource-id="com.alibaba.android.rimet:id/tv_org_name"')
+        return orgNode.text if orgNode is not None else ''
+
+    def changeCurrCo(self, currCoName, toCoName):
+        """
+        pick toCoName from the companies listed by tapping currCoName, True if switched.
+        """
+        if not currCoName or not toCoName:
+            return False
+        if not self.tap_text(f'"{currCoName}"') or not self.tap_text(f'"{toCoName}"'):
+            return False
+        self.wait_for_text('resource-id="com.alibaba.android.rimet:id/tv_org_name"')
+        return self.getCurrentCompany() == toCoName
+
+    def switchCompany(self, coName):
+        """
+        make coName the current company, True if it is.
+        """
+        currCoName = self.getCurrentCompany()
+        return currCoName == coName or self.changeCurrCo(currCoName, coName)
+
+    def getWorkConsoleIcon(self):
+        """
+        the work console tab has no text, it's the clickable tab nearest to the middle of '协作' & '通讯录'
+        """
+        tree = self.dump_ui()
+        leftNode, rightNode = tree.find_one('"协作"'), tree.find_one('"通讯录"')
+        if leftNode is None or rightNode is None or leftNode.center is None or rightNode.center is None:
+            return []
+        xPointer = (leftNode.center[0] + rightNode.center[0]) // 2
+        tab = tree.spatial.nearest(xPointer, leftNode.center[1], 'clickable')
+        return tab.point if tab is not None else [str(xPointer), str(leftNode.center[1])]
+
+    def getCheckInIcon(self):
+        """
+        point of '考勤打卡' on the work console, scrolled into the viewport between the title & tab bars first
+        """
+        tree = self.dump_ui()
+        checkInNode = tree.find_one('"考勤打卡"')
+        if checkInNode is None or checkInNode.bounds is None:
+            return []
+        _left, _top, _right, _bottom = tree.spatial.screen
+        viewport = (_left, max(_top, 194), _right, min(_bottom, 1700))
+        if not tree.spatial.contains(checkInNode, viewport):
+            self.swipe_and_settle(up=checkInNode.bounds[3] > viewport[3])
+            checkInNode = self.dump_ui().find_one('"考勤打卡"') or checkInNode
+        return checkInNode.point
+
+    def launchDingDing(self):
+        return self.launch_app()
+
+    def isDingDingRunning(self):
+        return bool(self.is_app_launched())
+
+    def shutdownDingDing(self):
+        return self.shutdown_app()
+
+    def _check_in_flow(self, screen_off_secs: int = 1800):
+        """
+        return Flow checking in for the company named by the parameter 'company'.
+        """
+        flow = Flow('dingtalk_check_in')
+        flow.call('random wait', lambda c, v, p: time.sleep(c.waitSecs) or True)
+        flow.shell('keep screen on', f'settings put system screen_off_timeout {screen_off_secs * 1000}')
+        flow.shell('shutdown', f'am force-stop {self.name}')
+        flow.shell('launch', f'am start -n {self.actv_name}', expect=self.run_keyword, timeout=10)
+        flow.tap(lambda c, v, p: c.getWorkConsoleIcon(), name='work console',
+                 expect='resource-id="com.alibaba.android.rimet:id/tv_org_name"', retries=3)
+        flow.call('company', lambda c, v, p: c.switchCompany(p['company']))
+        flow.wait('"考勤打卡"', timeout=10)
+        flow.tap(lambda c, v, p: c.getCheckInIcon(), name='check in icon')
+        # the check in page doesn't show the company, check in anyway if it's still there
+        flow.call('check in page', lambda c, v, p: wait_until(
+            lambda: c.dump_ui(refresh=True).find_one(f'"{p["company"]}"') is None, 10, 1), optional=True)
+        flow.tap(self.screen_mid_point, name='check in')
+        flow.sleep(1)
+        flow.tap(self.screen_mid_point, name='check in again')
+        flow.sleep(1)
+        # shown if the company was switched
+        flow.tap('text="继续打卡"', name='continue', optional=True)
+        flow.screenshot(self.screenshot_file_phone)
+        # the copy on the host is pulled while the phone goes back home
+        flow.call('keep screenshot', lambda c, v, p: c._pull(c.screenshot_file_phone, c.screenshot_file_local),
+                  background=True, optional=True)
+        return flow.keyevent('KEYCODE_HOME', name='home')
+
+    @profiled('dingtalk.check_in')
+    def checkIn(self, wechatUser):
+        """
+        check in for self.coName after waiting self.waitSecs, send the screenshot & the time to wechatUser.
+        """
+        print('-' * 20 + 'Check in start' + '-' * 20)
+        print('Started at: ', time.strftime('%Y/%m/%d %A %H:%M:%S'))
+        print(f'Wait {self.waitSecs}s before checking in.')
+        result = self._check_in_flow().run(self, company=self.coName)
+        for _name, _how, _passed, _secs in result.trace:
+            _status = 'Passed' if _passed else 'Skipped' if _how == 'skipped' else 'Failed'
+            print(f'{_name}: {_status} ({_how}, {_secs:.1f}s)')
+        if not result.passed:
+            self.screen_off()
+            return False
+
+        wechat = Wechat(self.devID)
+        coNameEng = pinyin.get(self.coName, format='strip', delimiter='')
+        # Capitalize the first letter of the string
+        coNameEng = coNameEng[:1].upper() + coNameEng[1:]
+        _sent = wechat.send_last_pic(wechatUser) and \
+            wechat.send_msg(wechatUser, f'{coNameEng} checked in at: {time.strftime("%m/%d %a %H:%M")}.')
+        self.return_home()
+        self.screen_off()
+        print('-' * 20 + 'Check in done' + '-' * 20)
+        return bool(_sent)
+
+    def OneKeyClean(self):
+        """
+        """
+        pass
+
+
+class ScreenshotOptions(NamedTuple):
+    """
+    How captured screenshots are cropped & re-encoded on the host before sending, see shrink_image
+    """
+    image_format: str = 'JPEG'
+    quality: int = 70
+    # screenshots wider are scaled down to it, 0 keeps the size
+    max_width: int = 720
+    # selector of the node cropped to, the largest scrollable node (the conversation) if None
+    region: str = None
+
+
+_IMAGE_SUFFIXES_ = {'JPEG': '.jpg', 'WEBP': '.webp', 'PNG': '.png'}
+
+
+def shrink_image(data: bytes, region: tuple = None, image_format: str = 'JPEG', quality: int = 70,
+                 max_width: int = 720):
+    """
+    crop image data to region (left, top, right, bottom), scale it down to max_width & encode it in image_format.
+
+    return the encoded bytes, None if Pillow isn't installed or data isn't an image.
+    """
+    if Image is None:
+        return None
+    image_format = 'JPEG' if image_format.upper() == 'JPG' else image_format.upper()
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if region:
+                _left, _top = max(0, region[0]), max(0, region[1])
+                _right, _bottom = min(image.width, region[2]), min(image.height, region[3])
+                if _right > _left and _bottom > _top:
+                    image = image.crop((_left, _top, _right, _bottom))
+            if max_width and image.width > max_width:
+                image = image.resize((max_width, max(1, image.height * max_width // image.width)), Image.LANCZOS)
+            if image_format == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            _output = io.BytesIO()
+            image.save(_output, format=image_format, quality=quality, optimize=True)
+            return _output.getvalue()
+    except (OSError, ValueError, KeyError) as err:
+        print(err, 'shrink screenshot failed.')
+        return None
+
+
+class SmsRecord(NamedTuple):
+    """
+    One row of content://sms
+    """
+    id: int
+    sender: str
+    body: str
+    # milliseconds since epoch, as stored by the provider
+    date: int
+
+    @property
+    def timestamp(self):
+        return self.date / 1000
+
+    @property
+    def time_str(self):
+        return time.strftime('%Y/%m/%d %H:%M:%S', time.localtime(self.timestamp))
+
+
+def sms_text(record: SmsRecord):
+    """
+    one message of a text digest, sender & time then the body
+    """
+    return f'【{record.sender}】{record.time_str}\n{record.body}'
+
+
+def split_digest(texts: list, limit: int = _WECHAT_MAX_TEXT_) -> list:
+    """
+    join texts into a digest, a blank line between two, split into as few parts of at most limit characters
+    as possible, a text is only split itself if it's longer than limit.
+
+    return [(part, number of texts ended in this part or before,
+             characters of the next text in this part or before)]
+    """
+    parts, _part, _done = [], '', 0
+    for _text in texts:
+        if _part and len(_part) + 2 + len(_text) > limit:
+            parts.append((_part, _done, 0))
+            _part = ''
+        _part = f'{_part}\n\n{_text}' if _part else _text
+        # a text longer than limit starts a part of its own, the parts split off are all of it
+        _offset = 0
+        while len(_part) > limit:
+            _offset += limit
+            parts.append((_part[:limit], _done, _offset))
+            _part = _part[limit:]
+        _done += 1
+    if _part:
+        parts.append((_part, _done, 0))
+    return parts
+
+
+def parse_content_rows(output: str, projection: list) -> list:
+    """
+    parse output of 'content query' into [{column: value}]
+
+    Row: 0 _id=12, address=10086, date=1675214400000, body=hello, world
+
+    the last column of projection may contain ', ' & newlines, keep free text there.
+    """
+    rows = []
+    for _row in re.split(r'(?m)^Row: \d+ ', output)[1:]:
+        _row = _row[:-1] if _row.endswith('\n') else _row
+        _values = {}
+        _rest = _row
+        for _i, _column in enumerate(projection):
+            if not _rest.startswith(f'{_column}='):
+                break
+            _rest = _rest[len(_column) + 1:]
+            if _i == len(projection) - 1:
+                _values[_column] = _rest
+                break
+            _next = _rest.find(f', {projection[_i + 1]}=')
+            if _next < 0:
+                _values[_column] = _rest
+                break
+            _values[_column], _rest = _rest[:_next], _rest[_next + 2:]
+        if _values:
+            rows.append(_values)
+    return rows
+
+
+def sms_query_command(where: str = None, uri: str = 'content://sms/inbox'):
+    """
+    return the shell command querying sms matched where from content provider, sorted by _id
+    """
+    command = f'shell content query --uri {uri} --projection {":".join(_SMS_PROJECTION_)} --sort "_id ASC"'
+    if where:
+        command += f' --where {shlex.quote(where)}'
+    return command
+
+
+def parse_sms_records(output: str) -> list:
+    """
+    parse output of sms_query_command into SmsRecord list, broken rows skipped
+    """
+    records = []
+    for _row in parse_content_rows(output, list(_SMS_PROJECTION_)):
+        try:
+            records.append(SmsRecord(int(_row['_id']), _row.get('address', ''),
+                                     _row.get('body', ''), int(_row.get('date', 0))))
+        except (KeyError, ValueError):
+            continue
+    return records
+
+
+class SmsWatermark(object):
+    """
+    _id & date of the last sms relayed of one device, saved across runs.
+    """
+
+    def __init__(self, device_sn: str = None, state_dir: str = _STATE_DIR_):
+        self.file = os.path.join(state_dir, f'sms_watermark_{device_sn}.json')
+        self.id = 0
+        self.date = 0
+        try:
+            with open(self.file, 'r') as f:
+                _state = json.load(f)
+            self.id = int(_state.get('_id', 0))
+            self.date = int(_state.get('date', 0))
+        except (FileNotFoundError, ValueError) as err:
+            if not isinstance(err, FileNotFoundError):
+                print(err, 'sms watermark broken, reset.')
+
+    def where(self, unread_only: bool = True):
+        """
+        return where clause of sms_query_command of the sms newer than the watermark
+        """
+        return f'read=0 AND _id>{self.id}' if unread_only else f'_id>{self.id}'
+
+    def advance(self, records: list):
+        """
+        move the watermark to the newest record & save it
+        """
+        if not records:
+            return
+        self.id = max(self.id, max(_record.id for _record in records))
+        self.date = max(self.date, max(_record.date for _record in records))
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        with open(self.file + '.tmp', 'w') as f:
+            json.dump({'_id': self.id, 'date': self.date}, f)
+        os.replace(self.file + '.tmp', self.file)
+
+
+class Message(AndroidConsole):
+    def __init__(self, device_sn):
+        app_name = 'com.samsung.android.messaging'
+        app_actv_name = 'com.samsung.android.messaging/com.android.mms.ui.ConversationComposer'
+        app_run_keyword = '"对话"'
+        AndroidConsole.__init__(self, device_sn, app_name, app_actv_name, app_run_keyword)
+        self.sms_watermark = SmsWatermark(device_sn)
+        # ScreenshotOptions to shrink captured screenshots with, sent as taken if None
+        self.screenshot_options = None
+        # bytes of screenshots captured & after shrinking
+        self.screenshot_bytes = [0, 0]
+
+    @profiled('message.launch_msg')
+    def launch_msg(self):
+        print('Shutdown Message App for restarting: ', self.shutdown_app())
+        print('Launch Message App: ', self.launch_app_monkey())
+        return bool(self.wait_for_text(self.run_keyword, timeout=10))
+
+    @profiled('message.resume_msg')
+    def resume_msg(self):
+        """
+        bring the running Message App back to the conversation list without restarting it,
+        restart it only if the list can't be reached.
+        """
+        self.launch_app()
+        if not self.is_app_launched():
+            self.return_back()
+            if not self.is_app_launched():
+                self.launch_msg()
+
+    def read_msg(self, label: str = None, sub_label: str = None):
+        label = 'resource-id="com.samsung.android.messaging:id/base_list_item_data"' if not label else label
+        sub_label = 'content-desc' if not sub_label else sub_label
+        return self.read_screen_text(label, sub_label)
+
+    @profiled('message.read_new_msg')
+    def read_new_msg(self, new_msg_label: str = None):
+        new_msg_label = '条未读信息' if not new_msg_label else new_msg_label
+        new_msgs = ''
+        # todo tap screen to the bottom, read the last unread new.
+
+        _point = self.get_point_of_text(new_msg_label)
+        # read message only if 'new_msg_label' exist
+        while _point:
+            self.tap_screen(_point)
+            self.wait_for_settle()
+            _point = None
+
+            """
+            _inter_point = self.get_point_of_text(new_msg_label)
+            if _inter_point:
+                self.tap_screen(_inter_point)
+                new_msgs += self.read_msg() + '\n'
+            """
+            new_msgs += self.read_msg() + '\n'
+            _point = self.get_point_of_text(new_msg_label)
+
+        _prompt = 'New messages fetched.' if new_msgs else 'All messages has been read.'
+        print(_prompt)
+        return new_msgs
+
+    @profiled('message.query_sms')
+    def query_sms(self, where: str = None, uri: str = 'content://sms/inbox') -> list:
+        """
+        read sms from content provider in one round trip, without touching the Message App.
+
+        return SmsRecord list sorted by _id
+        """
+        if not self._send_shell_command(sms_query_command(where, uri)):
+            print('query sms failed: ', '\n'.join(self.last_output))
+            return []
+        return parse_sms_records('\n'.join(self.last_output))
+
+    def fetch_new_sms(self, unread_only: bool = True, ledger=None) -> list:
+        """
+        return SmsRecord list newer than the watermark, call mark_sms_relayed after relaying them.
+
+        ledger (RelayLedger): drop the records relayed already
+        """
+        records = self.query_sms(self.sms_watermark.where(unread_only))
+        return records if ledger is None else ledger.unseen_sms(self.sn, records)
+
+    def mark_sms_relayed(self, records: list):
+        self.sms_watermark.advance(records)
+
+    def _read_new_msg_flow(self):
+        """
+        return Flow opening the last unread conversation & taking a screenshot of it on the phone
+        """
+        flow = Flow('message_read_new_as_screenshot')
+        # the row is tapped once more if the list was still moving
+        flow.tap('{label}', name='unread', timeout=0)
+        flow.tap('{label}', name='unread again', optional=True)
+        return flow.screenshot()
+
+    @profiled('message.read_new_msg_as_screenshot')
+    def read_new_msg_as_screenshot(self, new_msg_label: str = None):
+        new_msg_label = '条未读信息' if not new_msg_label else new_msg_label
+        # todo tap screen to the bottom, read the last unread new.
+        result = self._read_new_msg_flow().run(self, label=new_msg_label)
+        if result.failed_step == 'unread':
+            print('All messages been read.')
+            return False
+        print('Reading 1 new message to screenshot...')
+        return result.passed
+
+    @profiled('message.capture_new_msgs')
+    def capture_new_msgs(self, limit: int = _WECHAT_MAX_PICS_, new_msg_label: str = None, on_captured=None,
+                         skip=None, hold: bool = False):
+        """
+        screenshot unread messages one by one, at most limit ones.
+
+        on_captured (callable): called with (phone file, row identity) right after each screenshot, e.g. to spool it
+        skip (callable): called with row identity of unread rows, True to leave the row alone, e.g. relayed already
+        hold (bool): keep the screenshots out of the album in _HELD_PICS_DIR_ until reveal_phone_files
+        return the screenshot files saved on the phone, oldest first.
+        """
+        new_msg_label = '条未读信息' if not new_msg_label else new_msg_label
+        # tap, wait, screenshot & back to the conversation list in one adb round trip
+        script = ActionScript('capture_msg')
+        script.tap(['$1', '$2'])
+        if self.settle_mode == 'frames':
+            script.wait_frame_settle(self.frame_skip)
+        else:
+            script.wait_settle()
+        script.screencap('$3')
+        if self.screenshot_options is None and not hold:
+            script.scan_media('$3')
+        else:
+            # the dump of the conversation tells where to crop, the album sees the shrunk picture only
+            script.save_ui('$4')
+        script.back().wait_text(self.run_keyword)
+        _dir = _HELD_PICS_DIR_ if hold else '/sdcard'
+        if hold:
+            self._send_shell_command(f'shell mkdir -p {_HELD_PICS_DIR_} && touch {_HELD_PICS_DIR_}/.nomedia')
+
+        phone_files = []
+        while len(phone_files) < limit:
+            _row = next((_node for _node in self.dump_ui().find(new_msg_label)
+                         if skip is None or not skip(self.row_identity(_node, new_msg_label))), None)
+            if _row is None:
+                print('All messages been read.')
+                break
+            _point = _row.point
+
+            _phone_file = f'{_dir}/screen_{int(time.time() * 1000)}_{random.randint(1000, 9999)}.png'
+            _ui_file = f'{_SCRIPT_DIR_}/relaymsg_capture_msg_{os.path.basename(_phone_file)}.xml'
+            print('Reading 1 new message to screenshot...')
+            results = script.run(self, _point[0], _point[1], _phone_file, _ui_file)
+            # the screenshot is taken even if going back to the list failed
+            if results[2] == 0:
+                if self.screenshot_options is not None:
+                    _phone_file = self.shrink_screenshot(_phone_file, _ui_file if results[3] == 0 else None,
+                                                         scan=not hold)
+                phone_files.append(_phone_file)
+                if on_captured is not None:
+                    on_captured(_phone_file, self.row_identity(_row, new_msg_label))
+            if not ActionScript.passed(results):
+                break
+        return phone_files
+
+    @profiled('message.shrink_screenshot')
+    def shrink_screenshot(self, phone_file: str, ui_file: str = None, scan: bool = True):
+        """
+        crop the screenshot to the conversation shown by the dump in ui_file, re-encode it by
+        self.screenshot_options & replace the screenshot by it, scanned into the album unless scan is False.
+
+        return the phone file of the picture to send, phone_file if it can't be shrunk.
+        """
+        options = self.screenshot_options
+        _data = self._pull(phone_file)
+        _ui_data = self._pull(ui_file) if ui_file else None
+        if ui_file:
+            self._send_shell_command(f'shell rm -f {ui_file}')
+
+        _shrunk = None
+        if _data:
+            _tree = UiTree(_ui_data) if _ui_data else UiTree()
+            if options.region:
+                _node = _tree.find_one(options.region)
+            else:
+                _scrollable = [_node for _node in _tree.nodes if _node.bounds and _node.has_flag('scrollable')]
+                _node = max(_scrollable, key=lambda _n: (_n.bounds[2] - _n.bounds[0]) * (_n.bounds[3] - _n.bounds[1]),
+                            default=None)
+            _shrunk = shrink_image(_data, _node.bounds if _node is not None else None,
+                                   options.image_format, options.quality, options.max_width)
+
+        _file = os.path.splitext(phone_file)[0] + _IMAGE_SUFFIXES_.get(options.image_format.upper(), '.jpg')
+        if not _shrunk or len(_shrunk) >= len(_data) or not self._push(_shrunk, _file):
+            # sent as it is
+            if scan:
+                self.scan_media_file(phone_file)
+            self.screenshot_bytes[0] += len(_data or b'')
+            self.screenshot_bytes[1] += len(_data or b'')
+            return phone_file
+
+        self.screenshot_bytes[0] += len(_data)
+        self.screenshot_bytes[1] += len(_shrunk)
+        # a PNG is pushed over the screenshot itself
+        if _file != phone_file:
+            self._send_shell_command(f'shell rm -f {phone_file}')
+        if scan:
+            self.scan_media_file(_file)
+        return _file
+
+    @staticmethod
+    def row_identity(node, new_msg_label: str = '条未读信息'):
+        """
+        sender & the beginning of the body shown by a row of conversation list, without the unread counter
+        """
+        return re.sub(rf'[，,]?\s*\d*\s*{re.escape(new_msg_label)}', '', node.content_desc or node.text).strip()
+
+    @staticmethod
+    def sms_of_row(identity: str, records: list):
+        """
+        return SmsRecord of records a conversation list row of identity may show, the newest first:
+        the sender & the beginning of the body are in the row, the preview may be cut short.
+        """
+        _text = ' '.join(identity.split())
+        shown = []
+        for _record in sorted(records, key=lambda _r: _r.id, reverse=True):
+            _body = ' '.join(_record.body.split())
+            if not _record.sender or _record.sender not in _text:
+                continue
+            if any(_body[:_n] in _text for _n in range(min(len(_body), 32), min(len(_body), 6) - 1, -1)):
+                shown.append(_record)
+        return shown
+
+    @profiled('message.read_msg_from')
+    def read_msg_from(self, sender: str):
+        msg_entry_label = '''"通知类信息"'''
+
+        _point = self.get_point_of_text(msg_entry_label)
+        # read message only if 'new_msg_label' exist
+        if _point:
+            self.tap_screen(_point)
+
+            _sender_point = self.wait_for_text(sender, timeout=1)
+            _count = 0
+            while not _sender_point and _count <= 10:
+                if not self.swipe_and_settle():
+                    break
+                _sender_point = self.get_point_of_text(sender)
+                _count += 1
+
+            if _sender_point:
+                self.tap_screen(_sender_point)
+                return self.read_msg()
+            else:
+                print('No sender found.')
+                return None
+        else:
+            print('sys error.')
+            return None
+
+
+class AsyncAdbClient(object):
+    """
+    asyncio client of the adb host protocol, the same requests as AdbClient.
+
+    One connection per request, so requests to one or more devices overlap.
+    """
+
+    def __init__(self,
+                 host: str = _ADB_SERVER_HOST_,
+                 port: int = _ADB_SERVER_PORT_,
+                 timeout: float = _SHELL_TIMEOUT_):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sentinel = f'__RELAYMSG_{os.getpid()}_{random.randint(1000, 9999)}__'
+
+    async def _readexactly(self, reader, size: int):
+        try:
+            return await asyncio.wait_for(reader.readexactly(size), self.timeout)
+        except asyncio.IncompleteReadError as err:
+            raise AdbError(f'connection closed, {size - len(err.partial)} bytes missing')
+
+    async def _request(self, reader, writer, payload: str):
+        """
+        send request '<hex length><payload>' and check the OKAY/FAIL status
+        """
+        data = payload.encode('utf-8')
+        writer.write(b'%04x' % len(data) + data)
+        await writer.drain()
+
+        _status = await self._readexactly(reader, 4)
+        if _status == b'OKAY':
+            return True
+        if _status == b'FAIL':
+            _length = int(await self._readexactly(reader, 4), 16)
+            raise AdbError((await self._readexactly(reader, _length)).decode('utf-8', errors='replace'))
+        raise AdbError(f'unexpected status {_status!r} of request {payload}')
+
+    @contextlib.asynccontextmanager
+    async def _connect(self, device_sn: str = None, host_request: bool = False):
+        """
+        yield (reader, writer) switched to the device, or of the host if host_request.
+        """
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        try:
+            if not host_request:
+                await self._request(reader, writer, f'host:transport:{device_sn}' if device_sn else 'host:transport-any')
+            yield reader, writer
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def devices(self):
+        async with self._connect(host_request=True) as (reader, writer):
+            await self._request(reader, writer, 'host:devices-l')
+            _length = int(await self._readexactly(reader, 4), 16)
+            return (await self._readexactly(reader, _length)).decode('utf-8', errors='replace')
+
+    async def exec_out(self, device_sn: str, command: str):
+        async with self._connect(device_sn) as (reader, writer):
+            await self._request(reader, writer, f'exec:{command}')
+            return await asyncio.wait_for(reader.read(), self.timeout)
+
+    async def shell(self, device_sn: str, command: str):
+        """
+        run command with shell:, return (exit code, output)
+        """
+        async with self._connect(device_sn) as (reader, writer):
+            await self._request(reader, writer, f'shell:{_frame_command(command, self._sentinel)}')
+            data = await asyncio.wait_for(reader.read(), self.timeout)
+
+        _framed = _split_framed_output(data, self._sentinel)
+        if _framed is None:
+            raise AdbError(f'exit code of shell command missing: {command}')
+        return _framed[:2]
+
+    async def pull(self, device_sn: str, remote_file: str, local_file: str = None):
+        """
+        pull file through sync: protocol, return the bytes of the file
+        or write them to local_file and return True.
+        """
+        async with self._connect(device_sn) as (reader, writer):
+            await self._request(reader, writer, 'sync:')
+            _path = remote_file.encode('utf-8')
+            writer.write(b'RECV' + struct.pack('<I', len(_path)) + _path)
+            await writer.drain()
+
+            chunks = []
+            while True:
+                _id, _length = struct.unpack('<4sI', await self._readexactly(reader, 8))
+                if _id == b'DATA':
+                    chunks.append(await self._readexactly(reader, _length))
+                elif _id == b'DONE':
+                    break
+                elif _id == b'FAIL':
+                    raise AdbError((await self._readexactly(reader, _length)).decode('utf-8', errors='replace'))
+                else:
+                    raise AdbError(f'unexpected sync response {_id!r}')
+            writer.write(b'QUIT' + struct.pack('<I', 0))
+            await writer.drain()
+
+        data = b''.join(chunks)
+        if local_file is None:
+            return data
+        await asyncio.to_thread(functools.partial(_write_file, local_file, data))
+        return True
+
+
+def _write_file(file: str, data: bytes):
+    with open(file, 'wb') as f:
+        f.write(data)
+
+
+async def async_wait_until(predicate, timeout: float = 10, poll: float = 0.1, max_poll: float = 2.0,
+                           backoff: float = 1.5):
+    """
+    wait_until of coroutine function predicate
+    """
+    deadline = time.time() + timeout
+    interval = poll
+    with _PROFILER_.span('wait_until') as _span:
+        while True:
+            _value = await predicate()
+            if _value:
+                return _value
+            _left = deadline - time.time()
+            if _left <= 0:
+                return _value
+            _span['retries'] += 1
+            await asyncio.sleep(min(interval, _left))
+            interval = min(interval * backoff, max_poll)
+
+
+# event loop -> {device sn: semaphore}, semaphores of asyncio belong to one loop
+_DEVICE_SEMAPHORES_ = weakref.WeakKeyDictionary()
+
+
+def get_device_semaphore(device_sn: str = None, limit: int = _ASYNC_DEVICE_CONCURRENCY_):
+    """
+    return the semaphore bounding commands running on the device at a time, of the running loop.
+    """
+    _semaphores = _DEVICE_SEMAPHORES_.setdefault(asyncio.get_running_loop(), {})
+    if device_sn not in _semaphores:
+        _semaphores[device_sn] = asyncio.Semaphore(limit)
+    return _semaphores[device_sn]
+
+
+class AsyncAndroidConsole(object):
+    """
+    asyncio counterpart of AndroidConsole, device I/O doesn't block the event loop.
+
+    Commands go through AsyncAdbClient, or forked adb processes if the adb server isn't reachable.
+    At most _ASYNC_DEVICE_CONCURRENCY_ commands run on one device at a time, dumps are parsed
+    in a worker thread, so a pull, the parsing of the last dump & work on other devices overlap:
+
+        await asyncio.gather(AsyncMessage(sn1).capture_new_msgs(), AsyncMessage(sn2).capture_new_msgs())
+
+    Methods of the sync console not defined here, e.g. Wechat.send_last_pics, run the sync
+    method in a worker thread, holding one slot of the device.
+    The ui snapshot cache & the device profile are shared with the sync consoles,
+    commands & parsing with them through pure helpers, e.g. sms_query_command, swipe_command, ScreenSettle.
+    """
+    _sync_class = AndroidConsole
+
+    def __init__(self,
+                 device_sn: str = None,
+                 app_name: str = None,
+                 app_actv_name: str = None,
+                 app_run_keyword: str = None,
+                 use_socket: bool = True):
+        self.sn = device_sn
+        self.name = app_name
+        self.actv_name = app_actv_name
+        self.run_keyword = app_run_keyword
+        self.adb = AsyncAdbClient() if use_socket else None
+        self.ui_cache = get_ui_cache(device_sn)
+        self.profile = get_device_profile(device_sn)
+        # see AndroidConsole.settle_mode, frames are captured by the sync console in a worker thread
+        self.settle_mode = 'ui'
+
+        self.last_output = []
+        self.screenshot_file_local = _SCREENSHOT_FILE_
+        self.screenshot_file_phone = f'/sdcard/screen_{random.randint(1000, 9999)}.png'
+        self.screen_mid_point = None
+
+        self._sync = None
+        self._sync_lock = threading.Lock()
+
+    # the sync console for methods not ported, created in a worker thread as it talks to the device
+    def _new_sync_console(self):
+        return AndroidConsole(self.sn, self.name, self.actv_name, self.run_keyword)
+
+    def _sync_console(self):
+        with self._sync_lock:
+            if self._sync is None:
+                self._sync = self._new_sync_console()
+            return self._sync
+
+    def __getattr__(self, name: str):
+        if name.startswith('_') or not callable(getattr(self._sync_class, name, None)):
+            raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+        async def _call(*args, **kwargs):
+            async with get_device_semaphore(self.sn):
+                return await asyncio.to_thread(lambda: getattr(self._sync_console(), name)(*args, **kwargs))
+
+        _call.__name__ = name
+        return _call
+
+    # low level
+    async def _run_process(self, *args, merge_stderr: bool = False):
+        """
+        fork adb process, return (exit code, stdout bytes)
+        """
+        proc = await asyncio.create_subprocess_exec(
+            f'{_ADB_HOME_}/adb', '-s', str(self.sn), *args,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT if merge_stderr else subprocess.DEVNULL)
+        _stdout, _ = await proc.communicate()
+        return proc.returncode, _stdout
+
+    async def _send_shell_command(self, command: str):
+        """
+        send 'shell ...' command, return True/False, output lines are kept in self.last_output
+        """
+        _device_command = command[len('shell '):] if command.startswith('shell ') else command
+        async with get_device_semaphore(self.sn):
+            with _PROFILER_.span('adb.async.shell') as _span:
+                _return = None
+                if self.adb is not None:
+                    try:
+                        _return, _output = await self.adb.shell(self.sn, _device_command)
+                    except (OSError, AdbError, asyncio.TimeoutError) as err:
+                        print(err, 'adb server not reachable, fallback to single adb process.')
+                if _return is None:
+                    _return, _stdout = await self._run_process('shell', _device_command, merge_stderr=True)
+                    _output = _stdout.decode('utf-8', errors='replace')
+                    _output = _output[:-1] if _output.endswith('\n') else _output
+                self.last_output = _output.split('\n')
+                _span['bytes'] = len(_output)
+        return _return == 0
+
+    async def _exec_out(self, command: str):
+        """
+        return raw stdout bytes of command run on device, None if failed.
+        """
+        async with get_device_semaphore(self.sn):
+            with _PROFILER_.span('adb.async.exec_out') as _span:
+                if self.adb is not None:
+                    try:
+                        _data = await self.adb.exec_out(self.sn, command)
+                        _span['bytes'] = len(_data)
+                        return _data
+                    except (OSError, AdbError, asyncio.TimeoutError) as err:
+                        print(err, 'adb server not reachable, fallback to single adb process.')
+                _return, _data = await self._run_process('exec-out', command)
+                return _data if _return == 0 else None
+
+    async def _pull(self, remote_file: str, local_file: str = None):
+        """
+        pull file from device to local, return True/False.
+        return the bytes of the file (None if failed) if local_file is None.
+        """
+        if self.adb is not None:
+            try:
+                async with get_device_semaphore(self.sn):
+                    with _PROFILER_.span('adb.async.pull'):
+                        return await self.adb.pull(self.sn, remote_file, local_file)
+            except AdbError as err:
+                print(err, 'pull file failed.')
+                return False if local_file else None
+            except (OSError, asyncio.TimeoutError) as err:
+                print(err, 'adb server not reachable, fallback to single adb process.')
+
+        if local_file is None:
+            return await self._exec_out(f'cat {remote_file}')
+        async with get_device_semaphore(self.sn):
+            return (await self._run_process('pull', remote_file, local_file))[0] == 0
+
+    async def _send_action_command(self, command: str):
+        self.ui_cache.invalidate()
+        return await self._send_shell_command(command)
+
+    # screen
+    async def dump_ui(self, refresh: bool = False):
+        """
+        return UiTree of current screen, see AndroidConsole.dump_ui
+        """
+        if not refresh:
+            _tree = self.ui_cache.get()
+            if _tree is not None:
+                return _tree
+        else:
+            self.ui_cache.misses += 1
+
+        _data = await self._exec_out('uiautomator dump /dev/tty')
+        if not _data:
+            print('dump screen txt failed.')
+            return UiTree()
+
+        # parsed in a worker thread, the loop keeps running I/O of other consoles
+        _tree = await asyncio.to_thread(UiTree, _data)
+        if _tree:
+            self.ui_cache.put(_tree)
+        return _tree
+
+    def invalidate_ui_cache(self):
+        self.ui_cache.invalidate()
+
+    async def get_point_of_text(self, text: str = None, reverse_order: bool = True, refresh: bool = False,
+                                bottom_most: bool = False):
+        return (await self.dump_ui(refresh)).point_of(text, not reverse_order, bottom_most)
+
+    async def read_screen_text(self, label: str = None, sub_label: str = None, read_all: bool = True,
+                               refresh: bool = False):
+        _texts = (await self.dump_ui(refresh)).texts(label or '', sub_label or '')
+        if not read_all:
+            return _texts[0] if _texts else ''
+        return ''.join(_text + '\n' for _text in _texts)
+
+    async def poll_ui(self, lookup, timeout: float = 5, poll: float = 0.2):
+        """
+        see AndroidConsole.poll_ui
+        """
+        _dumped = [False]
+
+        async def _lookup():
+            _tree = await self.dump_ui(refresh=_dumped[0])
+            _dumped[0] = True
+            return lookup(_tree)
+
+        return await async_wait_until(_lookup, timeout, poll)
+
+    async def wait_for_text(self, text: str, timeout: float = 5, reverse_order: bool = True, poll: float = 0.2):
+        return await self.poll_ui(lambda _tree: _tree.point_of(text, not reverse_order), timeout, poll) or []
+
+    async def wait_for_any(self, texts: list, timeout: float = 5, poll: float = 0.2):
+        _found = await self.poll_ui(lambda _tree: _tree.find_any(texts), timeout, poll)
+        return (_found[0], _found[1].point) if _found else (None, [])
+
+    async def tap_text(self, text: str, timeout: float = 5, reverse_order: bool = True):
+        return await self.tap_screen(await self.wait_for_text(text, timeout, reverse_order))
+
+    async def wait_for_settle(self, timeout: float = 3, poll: float = 0.1):
+        """
+        see AndroidConsole.wait_for_settle
+        """
+        if self.settle_mode == 'frames' and await self.wait_for_frame_settle(timeout, poll) is not None:
+            return await self.dump_ui()
+        _settle = ScreenSettle(await self.dump_ui())
+
+        async def _settled():
+            return _settle.settled(await self.dump_ui(refresh=True))
+
+        await async_wait_until(_settled, timeout, poll)
+        return _settle.last
+
+    async def swipe_and_settle(self, up: bool = True, timeout: float = 3):
+        """
+        see AndroidConsole.swipe_and_settle
+        """
+        if self.settle_mode == 'frames':
+            _frame = await self.capture_frame()
+            if _frame is not None:
+                await self.swipe_screen_up_down(up, not up)
+                return not same_screen(_frame, await self.wait_for_frame_settle(timeout))
+            print('capture frame failed, settle by ui dumps.')
+        _before = await self.dump_ui()
+        await self.swipe_screen_up_down(up, not up)
+        return not same_screen(_before, await self.wait_for_settle(timeout))
+
+    # actions
+    async def launch_app(self):
+        return await self._send_action_command(f'shell am start -n {self.actv_name}')
+
+    async def launch_app_monkey(self):
+        return await self._send_action_command(f'shell monkey -p {self.name} 1')
+
+    async def shutdown_app(self):
+        return await self._send_action_command(f'shell am force-stop {self.name}')
+
+    async def is_app_launched(self):
+        if await self.get_point_of_text('text="权限申请"'):
+            await self.tap_screen(await self.get_point_of_text('text="取消"'))
+        return await self.get_point_of_text(self.run_keyword)
+
+    async def return_back(self):
+        return await self._send_action_command('shell input keyevent KEYCODE_BACK')
+
+    async def return_home(self):
+        return await self._send_action_command('shell input keyevent KEYCODE_HOME')
+
+    async def wake_screen(self):
+        return await self._send_shell_command('shell input keyevent 224')
+
+    async def screen_off(self):
+        return await self._send_action_command('shell input keyevent 223')
+
+    async def tap_screen(self, point: list):
+        return False if len(point) != 2 else await self._send_action_command(f'shell input tap {point[0]} {point[1]}')
+
+    async def validate_profile(self, force: bool = False):
+        """
+        see DeviceProfile.validate
+        """
+        _request = self.profile.validate_command(self.name, force)
+        if _request is not None and await self._send_shell_command(_request[0]):
+            self.profile.update(self.last_output, _request[1])
+
+    async def fetch_mid_of_screen(self):
+        await self.validate_profile()
+        if self.profile.screen_size:
+            return screen_mid_point(self.profile.screen_size)
+        await self._send_shell_command('shell wm size')
+        return screen_mid_point(parse_screen_size(self.last_output))
+
+    async def swipe_screen_up_down(self, up: bool = True, down: bool = False):
+        if self.screen_mid_point is None:
+            self.screen_mid_point = await self.fetch_mid_of_screen()
+        return await self._send_action_command(swipe_command(self.screen_mid_point, up))
+
+    async def take_screenshot(self, save_local: bool = False, phone_file: str = None):
+        phone_file = self.screenshot_file_phone if phone_file is None else phone_file
+        if await self._send_shell_command(f'shell screencap -p {phone_file}'):
+            return await self._pull(phone_file, self.screenshot_file_local) if save_local else True
+        return False
+
+    async def scan_media_file(self, phone_file: str):
+        return await self._send_shell_command(
+            f'shell am broadcast -a android.intent.action.MEDIA_SCANNER_SCAN_FILE -d file://{phone_file}')
+
+    async def capture_screen(self):
+        return await self._exec_out('screencap -p') or None
+
+    async def read_screenshot(self):
+        return await self._pull(self.screenshot_file_phone) or None
+
+
+class AsyncWechat(AsyncAndroidConsole):
+    """
+    asyncio counterpart of Wechat, the flows not ported (chat_with_user, send_last_pics, ...)
+    run the ones of Wechat in a worker thread.
+    """
+    _sync_class = Wechat
+
+    def __init__(self, device_sn: str, use_socket: bool = True):
+        AsyncAndroidConsole.__init__(self, device_sn, 'com.tencent.mm', 'com.tencent.mm/.ui.LauncherUI', '"通讯录"',
+                                     use_socket)
+
+    def _new_sync_console(self):
+        return Wechat(self.sn)
+
+    async def is_wechat_running(self):
+        return await self.is_app_launched()
+
+    async def return_wechat_main_page(self, try_times: int = 10):
+        for _ in range(try_times):
+            if await self.wait_for_text('"通讯录"', timeout=1):
+                break
+            await self.return_back()
+        return await self.tap_text('"微信"')
+
+
+class AsyncMessage(AsyncAndroidConsole):
+    """
+    asyncio counterpart of Message, the flows not ported (capture_new_msgs, read_new_msg, ...)
+    run the ones of Message in a worker thread.
+    """
+    _sync_class = Message
+
+    def __init__(self, device_sn: str, use_socket: bool = True):
+        AsyncAndroidConsole.__init__(self, device_sn, 'com.samsung.android.messaging',
+                                     'com.samsung.android.messaging/com.android.mms.ui.ConversationComposer',
+                                     '"对话"', use_socket)
+        self.sms_watermark = SmsWatermark(device_sn)
+
+    def _new_sync_console(self):
+        _console = Message(self.sn)
+        _console.sms_watermark = self.sms_watermark
+        return _console
+
+    async def launch_msg(self):
+        print('Shutdown Message App for restarting: ', await self.shutdown_app())
+        print('Launch Message App: ', await self.launch_app_monkey())
+        return bool(await self.wait_for_text(self.run_keyword, timeout=10))
+
+    async def query_sms(self, where: str = None, uri: str = 'content://sms/inbox') -> list:
+        """
+        see Message.query_sms
+        """
+        if not await self._send_shell_command(sms_query_command(where, uri)):
+            print('query sms failed: ', '\n'.join(self.last_output))
+            return []
+        return parse_sms_records('\n'.join(self.last_output))
+
+    async def fetch_new_sms(self, unread_only: bool = True, ledger=None) -> list:
+        """
+        see Message.fetch_new_sms
+        """
+        records = await self.query_sms(self.sms_watermark.where(unread_only))
+        return records if ledger is None else ledger.unseen_sms(self.sn, records)
+
+    def mark_sms_relayed(self, records: list):
+        self.sms_watermark.advance(records)
+
+
+class RelaySpool(object):
+    """
+    Messages captured but not sent yet, one json file each in the spool directory of the device.
+    A broken run leaves them there, the next run sends them instead of capturing them again:
+
+        {'id': '01675214400000000000', 'kind': 'screenshot', 'phone_file': '/sdcard/screen_....png',
+         'text': None, 'key': '9f86d08...', 'captured': 1675214400}
+
+    a text sent in part has 'sent': characters of it sent, the next run sends the rest.
+    """
+
+    def __init__(self, device_sn: str = None, state_dir: str = _STATE_DIR_):
+        self.dir = os.path.join(state_dir, f'spool_{device_sn}')
+
+    def add(self, phone_file: str = None, kind: str = 'screenshot', text: str = None, key: str = None):
+        """
+        spool one captured message, return its entry
+
+        key (str): identity of the message in RelayLedger
+        """
+        entry = {'id': f'{time.time_ns():020d}', 'kind': kind, 'phone_file': phone_file, 'text': text,
+                 'key': key, 'captured': int(time.time())}
+        return self.update(entry)
+
+    def update(self, entry: dict):
+        """
+        write entry, e.g. the characters of its text sent already, return it
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        _file = os.path.join(self.dir, f'{entry["id"]}.json')
+        with open(_file + '.tmp', 'w') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(_file + '.tmp', _file)
+        return entry
+
+    def pending(self, kind: str = None):
+        """
+        return entries not sent yet, the first captured first, only the ones of kind if given
+        """
+        try:
+            _names = sorted(_name for _name in os.listdir(self.dir) if _name.endswith('.json'))
+        except FileNotFoundError:
+            return []
+
+        entries = []
+        for _name in _names:
+            try:
+                with open(os.path.join(self.dir, _name), 'r') as f:
+                    _entry = json.load(f)
+            except (OSError, ValueError) as err:
+                print(err, f'spool entry {_name} broken, dropped.')
+                os.remove(os.path.join(self.dir, _name))
+                continue
+            if kind is None or _entry.get('kind') == kind:
+                entries.append(_entry)
+        return entries
+
+    def ack(self, entries: list):
+        """
+        drop entries sent
+        """
+        for _entry in entries:
+            try:
+                os.remove(os.path.join(self.dir, f'{_entry["id"]}.json'))
+            except FileNotFoundError:
+                pass
+
+
+class RelayLedger(object):
+    """
+    Messages relayed already, kept in sqlite for ttl seconds, shared by all devices:
+
+        relayed (key TEXT PRIMARY KEY, device TEXT, relayed_at REAL), indexed by relayed_at for eviction
+        delivered (key TEXT, recipient TEXT, via TEXT, delivered_at REAL), 'send' or 'forward' per recipient
+
+    key is a hash of the device sn & the identity of the message: provider _id of sms, the one of
+    the newest sms a screenshot row shows as well, or the sender & body shown by the row if the provider
+    doesn't know it, e.g. mms.
+    """
+
+    def __init__(self, file: str = None, ttl: float = _LEDGER_TTL_):
+        self.file = os.path.join(_STATE_DIR_, 'relay_ledger.sqlite3') if file is None else file
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        if self.file != ':memory:':
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        # workers of all devices write to it, each from its own thread
+        self._conn = sqlite3.connect(self.file, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS relayed '
+                               '(key TEXT PRIMARY KEY, device TEXT, relayed_at REAL NOT NULL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS relayed_at_index ON relayed (relayed_at)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS delivered (key TEXT, recipient TEXT, via TEXT, '
+                               'delivered_at REAL NOT NULL, PRIMARY KEY (key, recipient))')
+        self.evict()
+
+    @staticmethod
+    def key(device_sn: str, kind: str, identity):
+        return hashlib.sha1(f'{device_sn}\x1f{kind}\x1f{identity}'.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def sms_key(cls, device_sn: str, record: SmsRecord):
+        return cls.key(device_sn, 'sms', record.id)
+
+    @classmethod
+    def row_key(cls, device_sn: str, identity: str):
+        return cls.key(device_sn, 'row', identity)
+
+    def unseen_sms(self, device_sn: str, records: list):
+        """
+        return the SmsRecord of records not relayed within ttl
+        """
+        return [_record for _record in records if not self.seen(self.sms_key(device_sn, _record))]
+
+    def seen(self, key: str):
+        """
+        return True if the message of key was relayed within ttl
+        """
+        with self._lock:
+            _row = self._conn.execute('SELECT 1 FROM relayed WHERE key = ? AND relayed_at >= ?',
+                                      (key, time.time() - self.ttl)).fetchone()
+        return _row is not None
+
+    def record(self, keys: list, device_sn: str = None):
+        """
+        remember messages of keys as relayed now
+        """
+        _now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO relayed (key, device, relayed_at) VALUES (?, ?, ?)',
+                                   [(_key, device_sn, _now) for _key in keys if _key])
+
+    def deliver(self, keys: list, recipient: str, via: str = 'send'):
+        """
+        remember messages of keys as delivered to recipient now, by 'send' or 'forward'
+        """
+        _now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO delivered (key, recipient, via, delivered_at) '
+                                   'VALUES (?, ?, ?, ?)', [(_key, recipient, via, _now) for _key in keys if _key])
+
+    def deliveries(self, key: str):
+        """
+        return {recipient: 'send' or 'forward'} of the message of key
+        """
+        with self._lock:
+            return dict(self._conn.execute('SELECT recipient, via FROM delivered WHERE key = ?', (key,)).fetchall())
+
+    def evict(self):
+        """
+        drop entries older than ttl, return the number dropped
+        """
+        _expired = time.time() - self.ttl
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM delivered WHERE delivered_at < ?', (_expired,))
+            return self._conn.execute('DELETE FROM relayed WHERE relayed_at < ?', (_expired,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RelayWorker(object):
+    """
+    Relay messages of one device, owns the Message/Wechat pair of the device.
+    """
+
+    def __init__(self, device_sn: str, ledger: RelayLedger = None):
+        """
+        ledger (RelayLedger): shared by the workers of all devices, the worker opens & owns one if not given
+        """
+        self.sn = device_sn
+        self.lock = get_device_lock(device_sn)
+        # Message App is running & usable, resume it instead of restarting
+        self.warm = False
+
+        self.msg_app = Message(device_sn)
+        self.wechat = Wechat(device_sn)
+        self.spool = RelaySpool(device_sn)
+        self._own_ledger = ledger is None
+        self.ledger = RelayLedger() if ledger is None else ledger
+        # recipient -> messages delivered by the last relay
+        self.delivery_status = {}
+
+        _tmp_dir = device_tmp_dir(device_sn)
+        for _console in (self.msg_app, self.wechat):
+            _console.tmp_file = os.path.join(_tmp_dir, os.path.basename(_TMP_XML_FILE_))
+            _console.screenshot_file_local = os.path.join(_tmp_dir, os.path.basename(_SCREENSHOT_FILE_))
+
+    def close(self):
+        """
+        close the ledger opened by the worker, a shared one is left to its owner
+        """
+        if self._own_ledger:
+            self.ledger.close()
+
+    @profiled('worker.relay')
+    def relay(self, wechat_user, batch_size: int = _WECHAT_MAX_PICS_, queue_size: int = _RELAY_QUEUE_SIZE_,
+              screenshot_options: ScreenshotOptions = None, mode: str = 'screenshot',
+              text_limit: int = _WECHAT_MAX_TEXT_, settle: str = 'ui'):
+        """
+        relay all new messages to wechat user, return number of messages relayed.
+        wechat_user may be a list of users or groups: messages are sent to the first one
+        & forwarded to the others in one pass, see delivery_status for the number delivered to each.
+
+        batch_size (int): messages sent in one album send. one navigation per message if 1.
+        queue_size (int): messages captured at most before switching to Wechat to send them, 1 if batch_size is 1.
+        screenshot_options (ScreenshotOptions): crop & re-encode screenshots before sending them
+        mode (str): 'screenshot' of every conversation, or 'text' to send sms bodies as one digest
+        text_limit (int): characters of one text of the digest
+        settle (str): wait for screens to settle by 'ui' dumps or screencap 'frames', see AndroidConsole.settle_mode
+        """
+        self.msg_app.settle_mode = self.wechat.settle_mode = settle
+        recipients = [wechat_user] if isinstance(wechat_user, str) else list(wechat_user)
+        wechat_user, forward_to = recipients[0], recipients[1:]
+        self.delivery_status = dict.fromkeys(recipients, 0)
+        if mode == 'text':
+            count = self._relay_text(wechat_user, forward_to, text_limit)
+            self._print_delivery_status()
+            return count
+
+        count = 0
+        if screenshot_options is not None and Image is None:
+            print(f'[{self.sn}] Pillow not installed, screenshots are sent as they are.')
+            screenshot_options = None
+        self.msg_app.screenshot_options = screenshot_options
+        _bytes_before = list(self.msg_app.screenshot_bytes)
+        with self.lock:
+            if self.warm:
+                self.msg_app.wake_screen()
+                self.msg_app.resume_msg()
+            else:
+                self.msg_app.launch_msg()
+            # messages = msg_app.read_new_msg()
+
+            # print(msg.read_msg_from('10086'))
+            self.warm = False
+            # one by one is a cycle per message, spooled & recorded in the ledger all the same
+            count = self._relay_pipeline(wechat_user, forward_to, max(batch_size, 1),
+                                         queue_size if batch_size > 1 else 1)
+
+            self.wechat.return_back()
+            self.wechat.screen_off()
+            self.warm = True
+        print(f'[{self.sn}] UI dumps taken: {self.wechat.ui_cache_misses}, reused: {self.wechat.ui_cache_hits}')
+        _captured, _sent = (_after - _before for _after, _before in zip(self.msg_app.screenshot_bytes, _bytes_before))
+        if screenshot_options is not None and _captured:
+            print(f'[{self.sn}] screenshots {_captured / 1024:.0f} KB -> {_sent / 1024:.0f} KB, '
+                  f'{(_captured - _sent) / 1024:.0f} KB ({(_captured - _sent) * 100 / _captured:.0f}%) saved')
+        self._print_delivery_status()
+        return count
+
+    def _fan_out(self, keys: list, wechat_user: str, forward_to: list, count: int, resend):
+        """
+        the last count messages of the chat with wechat_user are just sent, forward them to forward_to in one pass.
+        recipients the forward missed get them by resend(recipient) instead.
+        deliveries are recorded in the ledger & counted in delivery_status.
+        """
+        _messages = len(keys) or 1
+        self.ledger.deliver(keys, wechat_user, 'send')
+        self.delivery_status[wechat_user] += _messages
+        if not forward_to:
+            return
+        forwarded = self.wechat.forward_last_msgs(forward_to, count)
+        for _recipient in forward_to:
+            if _recipient in forwarded:
+                _via = 'forward'
+            elif resend(_recipient):
+                _via = 'send'
+            else:
+                print(f'[{self.sn}] relay to {_recipient} failed.')
+                continue
+            self.ledger.deliver(keys, _recipient, _via)
+            self.delivery_status[_recipient] += _messages
+
+    def _print_delivery_status(self):
+        if len(self.delivery_status) > 1:
+            print(f'[{self.sn}] delivered: ' +
+                  ', '.join(f'{_recipient} {_count}' for _recipient, _count in self.delivery_status.items()))
+
+    def _relay_text(self, wechat_user: str, forward_to: list, text_limit: int):
+        """
+        read new sms from the content provider into the spool as text, send everything spooled
+        as one digest, split only at text_limit. the Message App isn't opened.
+        """
+        count = 0
+        with self.lock:
+            _spooled = {_entry.get('key') for _entry in self.spool.pending('text')}
+            records = self.msg_app.fetch_new_sms(ledger=self.ledger)
+            for _record in records:
+                _key = RelayLedger.sms_key(self.sn, _record)
+                if _key not in _spooled:
+                    self.spool.add(kind='text', text=sms_text(_record), key=_key)
+            # the spool keeps them from now on
+            self.msg_app.mark_sms_relayed(records)
+
+            entries = self._spooled_not_sent('text')
+            if not entries:
+                print('All messages has been read.')
+                return 0
+            digest = split_digest([_entry['text'][_entry.get('sent', 0):] for _entry in entries], text_limit)
+            self.wechat.wake_screen()
+            parts = [_part for _part, _, _ in digest]
+            _sent = self.wechat.send_text(wechat_user, parts)
+            count = digest[_sent - 1][1] if _sent else 0
+            _keys = [_entry.get('key') for _entry in entries[:count]]
+            self.ledger.record(_keys, self.sn)
+            self.spool.ack(entries[:count])
+            if _sent and digest[_sent - 1][2]:
+                # the parts sent end inside a text, the next run starts from the rest of it
+                entries[count]['sent'] = entries[count].get('sent', 0) + digest[_sent - 1][2]
+                self.spool.update(entries[count])
+            if _sent:
+                self._fan_out(_keys, wechat_user, forward_to, _sent,
+                              lambda _recipient: self.wechat.send_text(_recipient, parts[:_sent]) == _sent)
+            if _sent < len(digest):
+                print(f'[{self.sn}] {len(entries) - count} messages not sent, kept in the spool for the next run.')
+
+            self.wechat.return_back()
+            self.wechat.screen_off()
+        return count
+
+    def _relay_pipeline(self, wechat_user: str, forward_to: list, batch_size: int, queue_size: int):
+        """
+        the capture stage drains unread messages into the spool & the pending queue,
+        the send stage sends them from Wechat, the apps are switched twice per cycle.
+        a full queue holds the capture back until the send stage drained it, then another cycle starts.
+
+        messages are sent in the order they were captured, oldest batch first: screenshots are held out
+        of the album until their batch is sent, so that the batch is the newest pictures of the album.
+        messages left in the spool by a broken run are sent first, not captured again.
+        """
+        count = 0
+        batch_size = min(batch_size, _WECHAT_MAX_PICS_)
+        capacity = max(queue_size, batch_size)
+        while True:
+            pending = queue.Queue(maxsize=capacity)
+            _entries = self._spooled_not_sent('screenshot')[:capacity]
+            for _entry in _entries:
+                pending.put_nowait(_entry)
+            if pending.qsize() and not count:
+                print(f'[{self.sn}] {pending.qsize()} messages captured before, sending them first.')
+
+            drained = self._capture_stage(pending, {_entry.get('key') for _entry in _entries})
+            if pending.empty():
+                return count
+
+            _sent, _passed = self._send_stage(wechat_user, forward_to, pending, batch_size)
+            count += _sent
+            if not _passed or (drained and not self.spool.pending('screenshot')):
+                return count
+            self.msg_app.resume_msg()
+
+    def _spooled_not_sent(self, kind: str):
+        """
+        return spool entries of kind to send, the ones sent by a run broken before acking them
+        are dropped, from the album as well, so that the last pictures are the ones to send.
+        """
+        entries, _sent = [], []
+        for _entry in self.spool.pending(kind):
+            (_sent if _entry.get('key') and self.ledger.seen(_entry['key']) else entries).append(_entry)
+        if _sent:
+            print(f'[{self.sn}] {len(_sent)} messages in the spool sent already, dropped.')
+            self.spool.ack(_sent)
+            # held still, or revealed to the album before the send
+            _files = [_entry['phone_file'] for _entry in _sent if _entry.get('phone_file')]
+            self.msg_app.remove_phone_files(_files + [f'/sdcard/{os.path.basename(_file)}' for _file in _files
+                                                      if os.path.dirname(_file) != '/sdcard'])
+        return entries
+
+    def _capture_stage(self, pending: queue.Queue, captured: set):
+        """
+        capture unread messages into the spool & pending until none left or pending is full.
+        captured (set): ledger keys of messages in pending already
+
+        return True if all unread messages are captured.
+        """
+        _free = pending.maxsize - pending.qsize()
+        if _free <= 0:
+            return False
+
+        # rows relayed or captured already are skipped before tapping them, in case the read state didn't stick
+        _captured = set(captured)
+        _skipped = set()
+        # a row is the newest unread sms it shows not relayed yet, its text only if the provider doesn't know it
+        _records = self.msg_app.query_sms('read=0')
+
+        def _key(_identity):
+            _keys = [RelayLedger.sms_key(self.sn, _record) for _record in Message.sms_of_row(_identity, _records)]
+            if not _keys:
+                return RelayLedger.row_key(self.sn, _identity)
+            return next((_k for _k in _keys if _k not in _captured and not self.ledger.seen(_k)), _keys[0])
+
+        def _skip(_identity):
+            _k = _key(_identity)
+            if _k not in _captured and not self.ledger.seen(_k):
+                return False
+            if _identity not in _skipped:
+                _skipped.add(_identity)
+                print(f'[{self.sn}] {_identity} relayed or captured already, skipped.')
+            return True
+
+        def _spool(_file, _identity):
+            _k = _key(_identity)
+            _captured.add(_k)
+            pending.put_nowait(self.spool.add(_file, key=_k))
+
+        phone_files = self.msg_app.capture_new_msgs(_free, on_captured=_spool, skip=_skip, hold=True)
+        return len(phone_files) < _free
+
+    def _send_stage(self, wechat_user: str, forward_to: list, pending: queue.Queue, batch_size: int):
+        """
+        send pending in album sends of batch_size, each batch forwarded to forward_to once sent,
+        return (number sent, False if a send failed).
+        """
+        count = 0
+        while not pending.empty():
+            batch = []
+            while len(batch) < batch_size and not pending.empty():
+                batch.append(pending.get_nowait())
+            # the album sends its newest pictures, the batch is revealed to become them
+            _files = self.msg_app.reveal_phone_files([_entry['phone_file'] for _entry in batch
+                                                      if _entry.get('phone_file')])
+            if not self.wechat.send_last_pics(wechat_user, len(batch)):
+                print(f'[{self.sn}] send {len(batch)} pictures failed, kept in the spool for the next run.')
+                return count, False
+            _keys = [_entry.get('key') for _entry in batch]
+            self.ledger.record(_keys, self.sn)
+            self.spool.ack(batch)
+            # the batch is still the last pictures of the album, in case a recipient needs a send of its own
+            self._fan_out(_keys, wechat_user, forward_to, len(batch),
+                          lambda _recipient: self.wechat.send_last_pics(_recipient, len(batch)))
+            self.msg_app.remove_phone_files(_files)
+            count += len(batch)
+        return count, True
+
+
+class DeviceRegistry(object):
+    """
+    All attached devices and their relay workers, sharing one RelayLedger.
+    """
+
+    def __init__(self, ledger: RelayLedger = None):
+        self.workers = {}
+        self.ledger = RelayLedger() if ledger is None else ledger
+
+    def refresh(self):
+        """
+        find attached devices, create workers of new devices, drop the ones detached.
+        return the worker list.
+        """
+        _sns = [_device.sn for _device in fetch_devices()]
+        for _sn in list(self.workers):
+            if _sn not in _sns:
+                self.workers.pop(_sn).close()
+        for _sn in _sns:
+            if _sn not in self.workers:
+                self.workers[_sn] = RelayWorker(_sn, ledger=self.ledger)
+        return list(self.workers.values())
+
+    def close(self):
+        """
+        close the workers & the shared ledger
+        """
+        for _worker in self.workers.values():
+            _worker.close()
+        self.workers.clear()
+        self.ledger.close()
+
+
+def relay_all_devices(wechat_user, registry: DeviceRegistry = None, max_workers: int = None, **relay_options):
+    """
+    relay messages of all attached devices concurrently, one thread per device.
+    wechat_user & relay_options are passed to RelayWorker.relay
+
+    return {device sn: number of messages relayed}, -1 if the relay of the device failed.
+    """
+    if registry is None:
+        registry = DeviceRegistry()
+        try:
+            return relay_all_devices(wechat_user, registry, max_workers, **relay_options)
+        finally:
+            registry.close()
+    started_at = time.time()
+    workers = registry.refresh()
+
+    results = {}
+    elapsed = {}
+
+    def _relay(worker):
+        _started_at = time.time()
+        try:
+            return worker.relay(wechat_user, **relay_options)
+        finally:
+            elapsed[worker.sn] = time.time() - _started_at
+
+    if not workers:
+        print('No android device found.')
+        return results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(workers)) as executor:
+        futures = {executor.submit(_relay, _worker): _worker.sn for _worker in workers}
+        for _future in concurrent.futures.as_completed(futures):
+            _sn = futures[_future]
+            try:
+                results[_sn] = _future.result()
+            except Exception as err:
+                print(f'[{_sn}] relay failed: {err}')
+                results[_sn] = -1
+
+    total_secs = time.time() - started_at
+    for _sn in sorted(results):
+        _secs = elapsed.get(_sn, 0)
+        print(f'[{_sn}] {max(results[_sn], 0)} messages in {_secs:.1f}s')
+    total = sum(_count for _count in results.values() if _count > 0)
+    print(f'{total} messages relayed from {len(results)} devices in {total_secs:.1f}s, '
+          f'{total * 60 / total_secs if total_secs else 0:.1f} messages/min')
+    return results
+
+
+def relay_msg_to_wechat(wechat_user, device_sn: str = None, **relay_options):
+    """
+    relay new messages of one device (the first attached one by default) to wechat user,
+    relay_options are passed to RelayWorker.relay.
+    """
+    sn = fetch_device_SN() if device_sn is None else device_sn
+    worker = RelayWorker(sn)
+    try:
+        return worker.relay(wechat_user, **relay_options)
+    finally:
+        worker.close()
+
+
+class MessageEventListener(object):
+    """
+    Hold one long-lived logcat stream of the device, call on_event(count)
+    shortly after new messages arrived, a burst of messages calls it once.
+    """
+
+    def __init__(self,
+                 device_sn: str,
+                 on_event,
+                 patterns: tuple = _MSG_EVENT_PATTERNS_,
+                 quiet: float = 0.3,
+                 max_delay: float = 1.0,
+                 source=None,
+                 reconnect: bool = True):
+        """
+        on_event (callable): called with the number of events in the burst
+        quiet (float): a burst ends after no event for quiet seconds
+        max_delay (float): on_event is called at most max_delay seconds after the first event of a burst
+        source (callable): return an iterable of log lines, 'adb exec-out logcat' by default,
+            e.g. lambda: open('recorded.log') for testing.
+        reconnect (bool): restart the stream when it ends, stop listening if False
+        """
+        self.sn = device_sn
+        self.on_event = on_event
+        self.pattern = re.compile('|'.join(patterns))
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.source = self._logcat_lines if source is None else source
+        self.reconnect = reconnect
+
+        self.events = 0
+        self.bursts = 0
+        self.restarts = 0
+
+        self._events = queue.Queue()
+        self._proc = None
+        self._stop = threading.Event()
+        self._source_done = threading.Event()
+        self._thread = None
+
+    def _logcat_lines(self):
+        """
+        yield new lines of main & events logs, the history is skipped by '-T 1'
+        """
+        self._proc = subprocess.Popen([f'{_ADB_HOME_}/adb', '-s', str(self.sn), 'exec-out',
+                                       'logcat -v brief -T 1 -b main -b events'],
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            for _line in self._proc.stdout:
+                yield _line.decode('utf-8', errors='replace')
+        finally:
+            self._kill()
+
+    def _kill(self):
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+                self._proc.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            self._proc = None
+
+    def is_message_event(self, line: str):
+        return self.pattern.search(line) is not None
+
+    def _read_stream(self):
+        failures = 0
+        while not self._stop.is_set():
+            started_at = time.time()
+            try:
+                for _line in self.source():
+                    if self._stop.is_set():
+                        break
+                    if self.is_message_event(_line):
+                        self.events += 1
+                        self._events.put(time.time())
+            except (OSError, ValueError) as err:
+                print(f'[{self.sn}] message event stream broken: {err}')
+
+            if self._stop.is_set() or not self.reconnect:
+                break
+
+            # the stream lived long enough, it isn't failing in a row
+            failures = 0 if time.time() - started_at > 60 else failures + 1
+            self.restarts += 1
+            print(f'[{self.sn}] message event stream ended, restart #{self.restarts}')
+            self._stop.wait(min(30, 2 ** failures - 1))
+        self._source_done.set()
+
+    def _next_burst(self):
+        """
+        wait for a burst of events, return the number of events, 0 if stopped.
+        """
+        while True:
+            try:
+                first = self._events.get(timeout=0.5)
+                break
+            except queue.Empty:
+                if self._stop.is_set() or self._source_done.is_set():
+                    return 0
+
+        count = 1
+        deadline = first + self.max_delay
+        while True:
+            _left = min(self.quiet, deadline - time.time())
+            if _left <= 0:
+                return count
+            try:
+                self._events.get(timeout=_left)
+                count += 1
+            except queue.Empty:
+                return count
+
+    def run(self):
+        """
+        listen until stop() is called or the source ends without reconnect.
+        """
+        _reader = threading.Thread(target=self._read_stream, daemon=True)
+        _reader.start()
+        while not self._stop.is_set():
+            count = self._next_burst()
+            if not count:
+                break
+            self.bursts += 1
+            try:
+                self.on_event(count)
+            except Exception as err:
+                print(f'[{self.sn}] message event handler failed: {err}')
+        self.stop()
+        _reader.join(timeout=5)
+
+    def start(self):
+        """
+        listen in a background thread
+        """
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+        self._kill()
+
+
+class RelayDaemon(object):
+    """
+    Keep relaying in one process instead of one cron invocation per cycle,
+    device connections, screen geometry & app state stay warm between cycles.
+    """
+
+    def __init__(self,
+                 wechat_user,
+                 interval: float = 60,
+                 jitter: float = 0.2,
+                 max_backoff: float = 600,
+                 event_driven: bool = False,
+                 **relay_options):
+        """
+        interval (float): seconds between two cycles
+        jitter (float): the interval is randomized by +/- jitter * interval
+        max_backoff (float): the longest seconds to wait after failed cycles
+        event_driven (bool): also start a cycle as soon as a device logs a new message
+        wechat_user & relay_options: passed to RelayWorker.relay
+        """
+        self.wechat_user = wechat_user
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.event_driven = event_driven
+        self.relay_options = relay_options
+        # profile written after every cycle for node exporter
+        self.prometheus_file = None
+
+        self.registry = DeviceRegistry()
+        self.listeners = {}
+        self.cycles = 0
+        self.failures = 0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def next_wait(self):
+        """
+        return seconds to wait before the next cycle, doubled for every failed cycle in a row.
+        """
+        _wait = self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+        if self.failures:
+            _wait = min(self.max_backoff, self.interval * 2 ** self.failures)
+        return max(_wait, 0)
+
+    def run_cycle(self):
+        """
+        relay once, return True if every device succeeded.
+        """
+        self.cycles += 1
+        started_at = time.time()
+        try:
+            results = relay_all_devices(self.wechat_user, self.registry, **self.relay_options)
+            passed = bool(results) and all(_count >= 0 for _count in results.values())
+        except Exception as err:
+            print(f'Cycle {self.cycles} failed: {err}')
+            passed = False
+
+        self.failures = 0 if passed else self.failures + 1
+        print(f'Cycle {self.cycles} done in {time.time() - started_at:.1f}s',
+              'passed' if passed else f'failed ({self.failures} in a row)')
+
+        if self.event_driven:
+            self._start_listeners()
+        if self.prometheus_file:
+            _PROFILER_.export_prometheus(self.prometheus_file)
+        return passed
+
+    def _start_listeners(self):
+        """
+        one message event listener per device known by the registry
+        """
+        for _sn in list(self.listeners):
+            if _sn not in self.registry.workers:
+                self.listeners.pop(_sn).stop()
+        for _sn in self.registry.workers:
+            if _sn not in self.listeners or not self.listeners[_sn].is_alive():
+                self.listeners[_sn] = MessageEventListener(_sn, self.trigger)
+                self.listeners[_sn].start()
+
+    def trigger(self, count: int = 1):
+        """
+        start the next cycle now
+        """
+        print(f'{count} new message events, relay now.')
+        self._wake.set()
+
+    def run(self):
+        """
+        run cycles until stop() is called or SIGTERM/SIGINT received.
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stop())
+
+        _users = self.wechat_user if isinstance(self.wechat_user, str) else ', '.join(self.wechat_user)
+        print(f'Relay daemon started, every {self.interval}s to {_users}')
+        try:
+            while not self._stop.is_set():
+                self._wake.clear()
+                self.run_cycle()
+                self._wake.wait(self.next_wait())
+        except KeyboardInterrupt:
+            pass
+        for _listener in self.listeners.values():
+            _listener.stop()
+        self.registry.close()
+        print(f'Relay daemon stopped after {self.cycles} cycles.')
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Relay new messages of Android devices to Wechat user.')
+    parser.add_argument('wechat_users', nargs='+', metavar='wechat_user',
+                        help='Wechat profile names of the receivers or groups, messages are captured once, '
+                             'sent to the first one & forwarded to the others')
+    parser.add_argument('--daemon', action='store_true', help='keep running instead of relaying once')
+    parser.add_argument('--interval', type=float, default=60, help='seconds between two cycles of daemon')
+    parser.add_argument('--jitter', type=float, default=0.2, help='randomize interval by +/- this ratio')
+    parser.add_argument('--max-backoff', type=float, default=600, help='longest seconds to wait after failures')
+    parser.add_argument('--on-event', action='store_true',
+                        help='daemon relays as soon as logcat shows a new message, interval is the fallback')
+    parser.add_argument('--batch-size', type=int, default=_WECHAT_MAX_PICS_,
+                        help=f'messages sent in one album send (max {_WECHAT_MAX_PICS_}), 1 to send one by one')
+    parser.add_argument('--queue-size', type=int, default=_RELAY_QUEUE_SIZE_,
+                        help='messages captured at most before switching to Wechat to send them')
+    parser.add_argument('--mode', default='screenshot', choices=('screenshot', 'text'),
+                        help='relay a screenshot of every conversation, or sms bodies as one text digest')
+    parser.add_argument('--text-limit', type=int, default=_WECHAT_MAX_TEXT_,
+                        help=f'characters of one Wechat text, longer digests are split (default {_WECHAT_MAX_TEXT_})')
+    parser.add_argument('--settle', default='ui', choices=('ui', 'frames'),
+                        help='wait for screens to settle by comparing ui dumps or screencap frames (default ui)')
+    parser.add_argument('--shrink', action='store_true',
+                        help='crop screenshots to the conversation & re-encode them before sending, needs Pillow')
+    parser.add_argument('--image-format', default='JPEG', choices=('JPEG', 'WEBP', 'PNG'),
+                        type=str.upper, help='format of shrunk screenshots (default JPEG)')
+    parser.add_argument('--image-quality', type=int, default=70, help='quality of shrunk screenshots (default 70)')
+    parser.add_argument('--image-width', type=int, default=720,
+                        help='shrunk screenshots wider are scaled down to it (default 720)')
+    parser.add_argument('--profile', action='store_true', help='print time spent per operation at exit')
+    parser.add_argument('--trace', metavar='FILE', help='write operations as chrome trace json')
+    parser.add_argument('--prometheus', metavar='FILE', help='write profile in prometheus text format')
+    args = parser.parse_args(argv)
+
+    _PROFILER_.enabled = bool(args.profile or args.trace or args.prometheus)
+
+    relay_options = {'batch_size': args.batch_size, 'queue_size': args.queue_size,
+                     'mode': args.mode, 'text_limit': args.text_limit, 'settle': args.settle}
+    if args.shrink:
+        relay_options['screenshot_options'] = ScreenshotOptions(args.image_format, args.image_quality, args.image_width)
+    try:
+        if args.daemon:
+            daemon = RelayDaemon(args.wechat_users, args.interval, args.jitter, args.max_backoff, args.on_event,
+                                 **relay_options)
+            daemon.prometheus_file = args.prometheus
+            daemon.run()
+        else:
+            relay_all_devices(args.wechat_users, **relay_options)
+    finally:
+        if args.profile:
+            print(_PROFILER_.report())
+        if args.trace:
+            _PROFILER_.export_chrome_trace(args.trace)
+        if args.prometheus:
+            _PROFILER_.export_prometheus(args.prometheus)
+
+
+if __name__ == '__main__':
+    main()